@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import hmac
+import os
+
+from config import Config
+
+# Формат хэша: scrypt$n$r$p$соль$хэш (соль и хэш в base64).
+# Старые хэши - несолёный sha256 в hex: проверяются и при входе заменяются на scrypt
+SCHEME = "scrypt"
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r, dklen=KEY_SIZE,
+    )
+
+
+def hash_password(password: str,
+                  n: int = Config.SCRYPT_N,
+                  r: int = Config.SCRYPT_R,
+                  p: int = Config.SCRYPT_P) -> str:
+    salt = os.urandom(SALT_SIZE)
+    key = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password(password: str, password_hash: str) -> tuple[bool, bool]:
+    # (пароль верный, хэш пора пересчитать с текущими параметрами)
+    parts = password_hash.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, password_hash), True
+    n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+    key = _scrypt(password, base64.b64decode(parts[4]), n, r, p)
+    ok = hmac.compare_digest(key, base64.b64decode(parts[5]))
+    return ok, (n, r, p) != (Config.SCRYPT_N, Config.SCRYPT_R, Config.SCRYPT_P)
+
+
+class CredentialsBusy(Exception):
+    # Пул проверки паролей переполнен: вход отклонён, клиенту стоит повторить позже
+    pass
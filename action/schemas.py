@@ -1,251 +1,226 @@
-import asyncio
 import datetime
 import json
-from enum import Enum
 from typing import Optional, Literal, Annotated, Union, TYPE_CHECKING, Protocol, Sequence
 
-from pydantic import BaseModel, Field, TypeAdapter
+from pydantic import Field, TypeAdapter
 
 from db_model.models import User, ChatRoom
 from db_model.models import Message as MessageDb
-from action.auth_token import create_token, decode_token
-from action.schemas_message import (
+from action.auth_token import create_token
+from action.passwords import CredentialsBusy, hash_password, verify_password
+from protocol.messages import (
     Message,
     InitMessage,
     UpdateMessage,
     TokenMessage,
-    TypeMessage, UserBrief, UpdateKind, END_MARKER, RoomBrief, JoinChatMessage
+    TypeMessage, UserBrief, UpdateKind, RoomBrief, JoinChatMessage, ErrorMessage, HistoryMessage,
+    HeartbeatMessage, StatsMessage, SplicedFrame
 )
+from protocol import actions as wire
+from protocol.actions import BaseAction, Command, JoinGroupAction, LeaveAction
 from utils.logger import get_logger
 
 if TYPE_CHECKING:
     from server.server import Server
+    from server.connection import Connection
 
 
 log = get_logger(__name__, to_file=True)
 
-class Command(str, Enum):
-    JOIN_CHAT = 'JOIN_CHAT'
-    JOIN_GROUP = 'JOIN_GROUP'
-    JOIN_USER = 'JOIN_USER'
-    SEND = 'SEND'
-    LEAVE = 'LEAVE'
-    JOIN_SERVER = 'JOIN_SERVER'
-    REGISTER = 'REGISTER'
-    AUTHORIZE = 'AUTHORIZE'
-
-
-class BaseAction(BaseModel):
-    token: str
-    command: Command
-
-    def __repr__(self):
-        return f'<{self.__class__.__name__}: {self.model_dump()}>'
-
-    def _to_bytes(self) -> bytes:
-        return json.dumps(self.model_dump()).encode() + END_MARKER
-
-    async def send_action(self, writer: 'asyncio.StreamWriter'):
-        writer.write(self._to_bytes())
-        await writer.drain()
-
-
+# Серверные действия - классы протокола из protocol.actions плюс обработчик run.
+# Клиенту этот модуль не нужен: он тянет за собой БД и настройки сервера
+
+
+async def history_page(server: "Server",
+                       room_id: int,
+                       before_id: Optional[int] = None,
+                       limit: Optional[int] = None,
+                       after_id: Optional[int] = None) -> tuple[list[Message], bool]:
+    # Страница истории по ключу id: последние limit сообщений старше before_id
+    # (и новее after_id). Запрашиваем на одно больше, чтобы узнать, есть ли ещё
+    # более старые - для after_id это значит, что между after_id и страницей есть разрыв
+    # limit приходит от клиента: ограничиваем с обеих сторон, отрицательный LIMIT
+    # ломает запрос, а rows[:limit] резал бы не с того конца
+    limit = max(1, min(limit or server.history_page_size, server.history_max_page))
+    rows = await server.db.get_messages(room_id, limit + 1, before_id, after_id)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [
+        Message(
+            type=TypeMessage.message,
+            id=m.id,
+            from_=m.user_id,
+            from_username=m.username,
+            room_id=m.room_id,
+            content=m.message,
+            time_=m.timestamp.timestamp(),
+        ) for m in reversed(rows)
+    ]
+    return messages, has_more
+
+async def room_briefs(server: "Server", user_id: int, only: set[int] | None = None) -> list[RoomBrief]:
+    # Комнаты пользователя с участниками; only - только эти комнаты
+    rooms = await server.db.get_chats_user(user_id)
+    return [
+        RoomBrief(
+            room_id=r.id,
+            title=r.name,
+            users=[UserBrief(id=m.user.id, username=m.user.username) for m in r.users],
+        )
+        for r in rooms if only is None or r.id in only
+    ]
 
-class RegisterAction(BaseAction):
-    command: Literal[Command.REGISTER]
-    username: str
-    password: str
-    token: Optional[str] = None
 
-    async def run(self, server: "Server", _: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+class RegisterAction(wire.RegisterAction):
+    async def run(self, server: "Server", conn: 'Connection'):
         try:
-            new_user: User = await server.db.new_user(self)
-            all_users = await server.db.get_all_users()
-            users = [UserBrief(id=u.id, username=u.username) for u in all_users]
-            server.users[new_user.id] = writer
-            auth_token = create_token(new_user)
+            # scrypt и подпись токена - в пуле потоков, не в event loop
+            async with server.credentials.admit():
+                password_hash = await server.credentials.run(hash_password, self.password)
+                new_user: User = await server.db.new_user(self.username, password_hash)
+                auth_token = await server.credentials.run(create_token, new_user)
+            server.directory.add_user(new_user.id, new_user.username)
+            server.bind_session(conn, new_user.id, new_user.username, auth_token)
             token_message = TokenMessage(content=auth_token, type=TypeMessage.token)
             init_message = InitMessage(
                 self_user={"id": new_user.id, "username": new_user.username},
                 type=TypeMessage.init,
                 rooms=[],
-                all_users=users,
-                online_users=[u for u in users if u.id in server.users],
+                # all_users - заранее закодированный снимок справочника, см. SplicedFrame
+                all_users=[],
+                online_users=server.directory.briefs(server.online_ids()),
+                directory_version=server.directory.tag,
             )
-            update_message = UpdateMessage(
-                kind=UpdateKind.user_online,
-                payload={"id": new_user.id, "username": new_user.username},
-                type=TypeMessage.update,
-            )
-            await token_message.send_message(writer)
-            await init_message.send_message(writer)
-            await server.all_broadcast(update_message)
-            server.log.info(f"Отправлено {token_message}")
-            server.log.info(f"Отправлено {init_message}")
-            server.log.info(f"Отправлено {update_message}")
+            await token_message.send_message(conn)
+            await conn.send(SplicedFrame(init_message, {"all_users": server.directory.users_fragment}))
+            await server.presence.online(new_user.id, new_user.username)
+            server.log.debug("Отправлено %s, %s", token_message, init_message)
             return new_user
         except Exception as e:
-            writer.write(str(e).encode())
-
+            await ErrorMessage(content=str(e)).send_message(conn)
 
-class AuthorizeAction(BaseAction):
-    command: Literal[Command.AUTHORIZE]
-    username: str
-    password: str
-    token: Optional[str] = None
 
-    async def run(self, server: "Server", _: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+class AuthorizeAction(wire.AuthorizeAction):
+    async def run(self, server: "Server", conn: 'Connection'):
         try:
-            user: User = await server.db.get_user(self)
-            server.users[user.id] = writer
-            auth_token = create_token(user)
+            async with server.credentials.admit():
+                user: User = await server.db.get_user(self.username)
+                valid, rehash = await server.credentials.run(verify_password, self.password, user.password_hash)
+                if not valid:
+                    raise Exception('Password mismatch')
+                if rehash:
+                    # старый sha256 или устаревшие параметры scrypt - пересчитываем при входе
+                    password_hash = await server.credentials.run(hash_password, self.password)
+                    await server.db.set_password_hash(user.id, password_hash)
+                auth_token = await server.credentials.run(create_token, user)
+            server.bind_session(conn, user.id, user.username, auth_token)
             token_message = TokenMessage(content=auth_token, type=TypeMessage.token)
-            update_message = UpdateMessage(
-                kind=UpdateKind.user_online,
-                payload={"id": user.id, "username": user.username},
-                type=TypeMessage.update,
-            )
-            await server.all_broadcast(update_message)
-            await token_message.send_message(writer)
+            await server.presence.online(user.id, user.username)
+            await token_message.send_message(conn)
+        except CredentialsBusy as e:
+            await ErrorMessage(content=str(e)).send_message(conn)
         except Exception as e:
             raise
 
 
 
-class JoinServerAction(BaseAction):
-    command: Literal[Command.JOIN_SERVER]
-
-    async def run(self,
-                  server: "Server",
-                  _: asyncio.StreamReader,
-                  writer: asyncio.StreamWriter):
-        # 1. Авторизация по токену
-        payload = decode_token(self.token)
-        user_id, username = payload['id'], payload['username']
-        user = await server.db.get_user_by_id(user_id)
-        if not user or user.username != username:
-            raise Exception("Invalid token")
-
-        # 2. Сохраняем в сервере ссылку на writer
-        server.users[user_id] = writer
-
-        # 3. Собираем справочники пользователей и комнат
-        all_users = await server.db.get_all_users()
-        all_users_briefs = [
-            UserBrief(id=u.id, username=u.username)
-            for u in all_users
-        ]
-        rooms = await server.db.get_chats_user(user_id)
-        room_briefs = []
-        for r in rooms:
-            # для PrivateRoom у тебя связка через Membership,
-            # допустим у ChatRoom есть атрибут participants = list[User]
-            participants = [
-                UserBrief(id=membership.user.id, username=membership.user.username)
-                for membership in r.users
-            ]
-            room_briefs.append(
-                RoomBrief(
-                    room_id=r.id,
-                    title=r.name,
-                    users=participants
-                )
-            )
-
-        # 4. Формируем и шлём InitMessage только этому юзеру
-        init = InitMessage(
-            type=TypeMessage.init,
-            self_user={"id": user_id, "username": username},
-            rooms=room_briefs,
-            all_users=all_users_briefs,
-            online_users=[
-                o_user for o_user in all_users_briefs
-                if o_user.id in server.users.keys()
-            ]
-        )
-        await init.send_message(writer)
-
-        # 5. Оповещаем всех остальных, что этот юзер онлайн
-        update = UpdateMessage(
-            type=TypeMessage.update,
-            content="",  # не обязательно
-            kind=UpdateKind.user_online,
-            payload={"id": user_id, "username": username}
-        )
-        await server.all_broadcast(update)
+class JoinServerAction(wire.JoinServerAction):
+    async def run(self, server: "Server", conn: 'Connection'):
+        # 1-2. Токен уже проверен сервером, соединение привязано к сессии
+        user_id, username = conn.session.user_id, conn.session.username
+        directory = server.directory
+        version = directory.tag
+        delta = directory.delta(self.directory_version)
 
-        return user
+        # 3-4. Полный снимок справочника или дельта с версии клиента - только этому юзеру
+        if delta is None:
+            init = InitMessage(
+                type=TypeMessage.init,
+                self_user={"id": user_id, "username": username},
+                rooms=await room_briefs(server, user_id),
+                all_users=[],
+                online_users=directory.briefs(server.online_ids()),
+                directory_version=version,
+            )
+            # снимок всех пользователей вклеивается в кадр уже закодированным
+            await conn.send(SplicedFrame(init, {"all_users": directory.users_fragment}))
+        else:
+            changed_rooms = delta.rooms & server.user_rooms.get(user_id, set())
+            changed_users = directory.briefs(delta.users | delta.presence)
+            init = InitMessage(
+                type=TypeMessage.init,
+                self_user={"id": user_id, "username": username},
+                rooms=await room_briefs(server, user_id, changed_rooms) if changed_rooms else [],
+                all_users=[u for u in changed_users if u.id in delta.users],
+                online_users=[u for u in changed_users if server.is_online(u.id)],
+                offline_users=[u for u in changed_users if not server.is_online(u.id)],
+                removed_users=sorted(delta.removed),
+                directory_version=version,
+                delta=True,
+            )
+            await init.send_message(conn)
 
+        # 5. Оповещаем всех остальных, что этот юзер онлайн (дайджестом раз в тик)
+        await server.presence.online(user_id, username)
 
-class JoinChatAction(BaseAction):
-    command: Literal[Command.JOIN_CHAT]
-    room: int
-    message: Optional[str] = None
 
-    async def run(self, server: "Server", _: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+class JoinChatAction(wire.JoinChatAction):
+    async def run(self, server: "Server", conn: 'Connection'):
         try:
-            payload = decode_token(self.token)
-            user_id, username = payload['id'], payload['username']
-            server.chats[self.room].add(user_id)
-
-            mes = f"Пользователь {username} подключился\n"
-            if self.message:
-                mes += f"\n{self.message}"
-
-
-            message = Message(
-                type=TypeMessage.message,
-                content=mes,
-                time_=datetime.datetime.now().timestamp(),
-                from_username=username,
-                from_=user_id,
-                room_id=self.room
-            )
-            await server.db.send_message(user_id, self.room, mes)
-            await server.send_in_chats(message, self.room)
-
-
+            user_id, username = conn.session.user_id, conn.session.username
+            # в памяти состав комнаты может отставать (в кластере - сразу после смены
+            # владельца), поэтому участие, которого там нет, проверяем по БД
+            if user_id not in server.chats.get(self.room, ()) and not await server.db.is_member(user_id, self.room):
+                # вступить можно только в существующую общую комнату, в личную - нельзя
+                if await server.db.get_room(self.room) is None:
+                    await ErrorMessage(content=f"Комната {self.room} не найдена").send_message(conn)
+                    return
+                if await server.db.is_private_room(self.room):
+                    await ErrorMessage(content=f"Комната {self.room} - личная").send_message(conn)
+                    return
+            await server.add_member(self.room, user_id)
+
+            # Повторное открытие чата из локального кэша (after_id) - не вход в комнату:
+            # без оповещения, иначе каждое переключение пишет в БД и устаревает кэш
+            if self.after_id is None or self.message:
+                mes = f"Пользователь {username} подключился\n"
+                if self.message:
+                    mes += f"\n{self.message}"
+                message = Message(
+                    type=TypeMessage.message,
+                    content=mes,
+                    time_=datetime.datetime.now().timestamp(),
+                    from_username=username,
+                    from_=user_id,
+                    room_id=self.room
+                )
+                saved = await server.message_writer.submit(user_id, self.room, mes)
+                await server.send_in_chats(message, self.room)
+                # история ниже должна уже содержать это сообщение
+                await saved
 
-            messages_chat: Sequence[MessageDb] = await server.db.get_messages(self.room)
-            log.info(f"Получены сообщения чата {self.room}")
-            log.info(f"Кол-во сообщений{len(messages_chat)}")
+            messages_chat, has_more = await history_page(server, self.room, after_id=self.after_id)
+            log.debug("Получено %s сообщений чата %s", len(messages_chat), self.room)
             join_chat_message = JoinChatMessage(
                     type=TypeMessage.join_chat,
                     content='',
-                    messages=[
-                        Message(
-                            type=TypeMessage.message,
-                            from_=m.user_id,
-                            from_username=m.user.username,
-                            room_id=m.room_id,
-                            content=m.message,
-                            time_=m.timestamp.timestamp(),
-                        ) for m in messages_chat
-                    ]
+                    room_id=self.room,
+                    messages=messages_chat,
+                    has_more=has_more,
+                    after_id=self.after_id,
                 )
-            await join_chat_message.send_message(writer)
+            await join_chat_message.send_message(conn)
         except Exception:
             raise
 
 
-class JoinGroupAction(BaseAction):
-    command: Literal[Command.JOIN_GROUP]
-    room: int
-    message: Optional[str] = None
-
-
-class JoinUserAction(BaseAction):
-    command: Literal[Command.JOIN_USER]
-    user_id: int
-    message: Optional[str] = None
-
-    async def run(self, server: "Server", _: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+class JoinUserAction(wire.JoinUserAction):
+    async def run(self, server: "Server", conn: 'Connection'):
         try:
-            new_room: ChatRoom = await server.db.new_room_privat(self)
-            messages_chat: Sequence[MessageDb] = await server.db.get_messages(new_room.id)
-            payload = decode_token(self.token)
-            user_id, username = payload['id'], payload['username']
-            server.chats[new_room.id] = {self.user_id, user_id}
+            user_id, username = conn.session.user_id, conn.session.username
+            new_room: ChatRoom = await server.db.new_room_privat(user_id, username, self.user_id)
+            messages_chat, has_more = await history_page(server, new_room.id)
+            server.add_room(new_room.id, [self.user_id, user_id])
             mes = f'{username} хочет с вами поболтать\n'
             if self.message:
                 mes += f'{self.message}\n'
@@ -276,34 +251,25 @@ class JoinUserAction(BaseAction):
             join_chat_message = JoinChatMessage(
                 type=TypeMessage.join_chat,
                 content='',
-                messages=[
-                    Message(
-                        type=TypeMessage.message,
-                        from_=m.user_id,
-                        from_username=m.user.username,
-                        room_id=m.room_id,
-                        content=m.message,
-                        time_=m.timestamp.timestamp(),
-                    ) for m in messages_chat
-                ]
+                room_id=new_room.id,
+                messages=messages_chat,
+                has_more=has_more,
             )
-            await join_chat_message.send_message(writer)
+            await join_chat_message.send_message(conn)
 
 
         except Exception as e:
             raise
 
 
-class SendAction(BaseAction):
-    command: Literal[Command.SEND]
-    room: int
-    message: str
-
-    async def run(self, server: "Server", _: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+class SendAction(wire.SendAction):
+    async def run(self, server: "Server", conn: 'Connection'):
         try:
-            room: ChatRoom = await server.db.get_room(self)
-            payload = decode_token(self.token)
-            user_id, username = payload['id'], payload['username']
+            room: ChatRoom = await server.db.get_room(self.room)
+            if room is None:
+                await ErrorMessage(content=f"Комната {self.room} не найдена").send_message(conn)
+                return
+            user_id, username = conn.session.user_id, conn.session.username
             mes = f'{self.message}'
             new_message = Message(
                 content=mes,
@@ -313,20 +279,42 @@ class SendAction(BaseAction):
                 time_=datetime.datetime.now().timestamp(),
                 type=TypeMessage.message
             )
-            for user in server.chats[room.id]:
-                user_writer = server.users.get(user)
-                if user_writer:
-                    await new_message.send_message(user_writer)
+            # рассылка сразу, запись в БД - позже пачкой; id сообщения клиент
+            # получит из истории (JOIN_CHAT с after_id)
+            await server.send_in_chats(new_message, room.id)
 
-            saved_message = await server.db.send_message(user_id, self.room, mes)
+            await server.message_writer.submit(user_id, self.room, mes)
         except Exception as e:
-            writer.write(e.args[1].encode())
+            await ErrorMessage(content=str(e)).send_message(conn)
+
+
+class HistoryAction(wire.HistoryAction):
+    async def run(self, server: "Server", conn: 'Connection'):
+        if self.room not in server.user_rooms.get(conn.session.user_id, ()):
+            raise Exception(f"Пользователь {conn.session.user_id} не состоит в комнате {self.room}")
+        messages, has_more = await history_page(server, self.room, self.before_id, self.limit)
+        history = HistoryMessage(
+            content='',
+            room_id=self.room,
+            before_id=self.before_id,
+            messages=messages,
+            has_more=has_more,
+        )
+        await history.send_message(conn)
+
+
+class HeartbeatAction(wire.HeartbeatAction):
+    async def run(self, server: "Server", conn: 'Connection'):
+        if not self.reply:
+            await HeartbeatMessage(nonce=self.nonce, reply=True).send_message(conn)
 
 
-class LeaveAction(BaseAction):
-    command: Literal[Command.LEAVE]
-    room: int
-    message: Optional[str] = None
+class StatsAction(wire.StatsAction):
+    async def run(self, server: "Server", conn: 'Connection'):
+        if conn.session is None or conn.session.username not in server.admin_users:
+            await ErrorMessage(content="Команда STATS доступна только администраторам").send_message(conn)
+            return
+        await StatsMessage(stats=server.metrics.snapshot()).send_message(conn)
 
 
 ActionUnion = Annotated[
@@ -338,7 +326,10 @@ ActionUnion = Annotated[
         SendAction,
         LeaveAction,
         RegisterAction,
-        AuthorizeAction
+        AuthorizeAction,
+        HistoryAction,
+        HeartbeatAction,
+        StatsAction,
     ],
     Field(discriminator='command')
 ]
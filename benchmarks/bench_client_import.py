@@ -0,0 +1,66 @@
+# Холодный старт клиента: время импорта (по -X importtime), число модулей и
+# память процесса после импорта. gui_client/main.py сразу открывает окно, поэтому
+# меряется то, что он импортирует: gui_client.gui_tk.main_app и gui_client.async_connector.
+# Для сравнения - серверные действия action.schemas (БД, SQLAlchemy, настройки).
+# Заодно проверяется, что клиент не тянет серверные модули.
+# Запуск: python -m benchmarks.bench_client_import [--repeat N]
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+TARGETS = {
+    "клиент": "gui_client.gui_tk.main_app, gui_client.async_connector",
+    "сервер": "action.schemas",
+}
+# модули, которых в клиенте быть не должно
+SERVER_ONLY = ("server", "db_model", "config", "sqlalchemy", "asyncpg", "aiosqlite", "dotenv", "jwt", "action")
+
+PROBE = """
+import json, resource, sys
+import {modules}
+print(json.dumps({{
+    "modules": len(sys.modules),
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "loaded": sorted({{name.split(".")[0] for name in sys.modules}}),
+}}))
+"""
+
+
+def measure(modules: str) -> tuple[float, dict]:
+    # для серверного модуля нужен SECRET_KEY, клиенту он не нужен
+    env = dict(os.environ, SECRET_KEY=os.environ.get("SECRET_KEY", "bench"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(modules=modules)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    # строки importtime: "import time: self | cumulative | имя", верхний уровень без отступа
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+    return total_us / 1e3, json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for title, modules in TARGETS.items():
+        runs = [measure(modules) for _ in range(args.repeat)]
+        best_ms = min(ms for ms, _ in runs)
+        info = runs[0][1]
+        print(f"{title}: импорт {best_ms:.0f} мс (лучший из {args.repeat}), "
+              f"{info['modules']} модулей, {info['maxrss_kb'] / 1024:.1f} МиБ")
+        if title == "клиент":
+            leaked = [name for name in SERVER_ONLY if name in info["loaded"]]
+            print(f"  серверные модули в клиенте: {', '.join(leaked) or 'нет'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Кластер из нескольких узлов на localhost: клиенты подключаются к разным узлам,
+# сидят в общих комнатах и шлют сообщения; посередине прогона последний узел
+# (к нему клиенты не подключены, но он владеет частью комнат) останавливается.
+# Проверяем, что после перебалансировки сообщения не потерялись:
+# сколько доставлено участникам и сколько записано в БД.
+# Запуск: python -m benchmarks.bench_cluster [--db-url URL] [--nodes N]
+#         [--rooms R] [--members M] [--messages K] [--rate MSG_PER_SEC] [--no-kill]
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from sqlalchemy import func, select
+
+from protocol.framing import client_handshake
+from action.schemas import Command, RegisterAction, JoinChatAction, SendAction
+from protocol.messages import TypeMessage, message_adapter
+from benchmarks.bench_workers import prepare, wait_port
+from config import Config
+from db_model.db_repo import DbRepo
+from db_model.models import Message
+
+
+class Client:
+
+    def __init__(self, port: int, room_id: int, tag: str):
+        self.port = port
+        self.room_id = room_id
+        self.tag = tag
+        self.received: set[str] = set()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self.framing, self.codec = await client_handshake(self.reader, self.writer)
+        await RegisterAction(command=Command.REGISTER, username=f"{self.tag}-{uuid.uuid4().hex[:10]}",
+                             password="bench").send_action(self.writer, self.framing, self.codec)
+        self.token = None
+        while self.token is None:
+            msg = await self.read()
+            if msg.type_ == TypeMessage.token:
+                self.token = msg.content
+        await self.action(JoinChatAction(command=Command.JOIN_CHAT, room=self.room_id, token=self.token))
+        while (await self.read()).type_ != TypeMessage.join_chat:
+            pass
+
+    async def read(self):
+        return message_adapter.validate_python(self.codec.loads(await self.framing.read(self.reader)))
+
+    async def action(self, action):
+        await action.send_action(self.writer, self.framing, self.codec)
+
+    async def receive(self):
+        while True:
+            msg = await self.read()
+            if msg.type_ == TypeMessage.message and msg.content.startswith(self.tag):
+                self.received.add(msg.content)
+
+    async def send(self, messages: int, interval: float, index: int):
+        for i in range(messages):
+            await self.action(SendAction(command=Command.SEND, room=self.room_id,
+                                         message=f"{self.tag} {index} {i}", token=self.token))
+            await asyncio.sleep(interval)
+
+
+async def count_persisted(db_url: str, tag: str) -> int:
+    db = DbRepo(db_url)
+    async with db.async_session() as session:
+        count = await session.scalar(select(func.count()).where(Message.message.like(f"{tag} %")))
+    await db.async_engine.dispose()
+    return count
+
+
+async def run(args):
+    tag = f"cl-{uuid.uuid4().hex[:6]}"
+    room_ids = await prepare(args.db_url, args.rooms)
+    names = [f"n{i}" for i in range(args.nodes)]
+    cluster_nodes = ",".join(f"{name}=127.0.0.1:{args.cluster_port + i}" for i, name in enumerate(names))
+    env = dict(os.environ, DB_URL=args.db_url, CLUSTER_NODES=cluster_nodes,
+               CLUSTER_RETRY_INTERVAL=str(args.retry_interval))
+    nodes = [
+        subprocess.Popen([sys.executable, "main_server.py", "--node", name, "--port", str(args.port + i)], env=env)
+        for i, name in enumerate(names)
+    ]
+    try:
+        for i in range(args.nodes):
+            wait_port(args.port + i)
+        # время на загрузку членств и установку каналов между узлами
+        await asyncio.sleep(2)
+
+        # к последнему узлу клиенты не подключаются - его и остановим
+        client_ports = [args.port + i for i in range(max(1, args.nodes - 1))]
+        clients = [
+            Client(client_ports[n % len(client_ports)], room_id, tag)
+            for n, room_id in enumerate(r for r in room_ids for _ in range(args.members))
+        ]
+        for client in clients:
+            await client.connect()
+        receivers = [asyncio.create_task(client.receive()) for client in clients]
+
+        interval = 1 / args.rate
+        start = time.perf_counter()
+        senders = asyncio.gather(*(client.send(args.messages, interval, n) for n, client in enumerate(clients)))
+        if not args.no_kill and args.nodes > 1:
+            await asyncio.sleep(args.messages * interval / 2)
+            nodes[-1].terminate()
+            print(f"узел {names[-1]} остановлен через {time.perf_counter() - start:.2f} с")
+        await senders
+        # ждём переотправок после перебалансировки
+        await asyncio.sleep(args.retry_interval * 3)
+        elapsed = time.perf_counter() - start
+        for task in receivers:
+            task.cancel()
+    finally:
+        for node in nodes:
+            node.terminate()
+            node.wait()
+
+    sent = len(clients) * args.messages
+    expected = sent * args.members
+    delivered = sum(len(client.received) for client in clients)
+    persisted = await count_persisted(args.db_url, tag)
+    print(f"узлов {args.nodes}, клиентов {len(clients)}, отправлено {sent} за {elapsed:.2f} с")
+    print(f"доставлено {delivered}/{expected}, записано в БД {persisted}/{sent}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--cluster-port", type=int, default=9900)
+    parser.add_argument("--rooms", type=int, default=12)
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=20, help="сообщений в секунду на клиента")
+    parser.add_argument("--retry-interval", type=float, default=0.5)
+    parser.add_argument("--no-kill", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Сравнение кодеков: сначала проверка, что каждое действие из ActionUnion и каждое
+# сообщение из AnyMessage проходят кодирование/декодирование без потерь (и что
+# образцы есть для каждого члена объединений), затем
+# скорость encode/decode и размер на проводе для InitMessage на N пользователей.
+# Запуск: python -m benchmarks.bench_codec [число_пользователей]
+import sys
+import time
+import typing
+
+from protocol.codec import CODECS, Codec
+from action.schemas import (
+    adapter, ActionUnion, Command, JoinChatAction, JoinGroupAction, JoinUserAction, JoinServerAction,
+    SendAction, LeaveAction, RegisterAction, AuthorizeAction, HistoryAction, HeartbeatAction, StatsAction,
+)
+from protocol.messages import (
+    message_adapter, AnyMessage, Message, UpdateMessage, InitMessage, TokenMessage, JoinChatMessage,
+    ErrorMessage, HistoryMessage, HeartbeatMessage, StatsMessage, PresenceMessage, UpdateKind, UserBrief,
+    RoomBrief,
+)
+
+TOKEN = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJpZCI6MSwidXNlcm5hbWUiOiJhIn0.sig"
+
+
+def sample_actions() -> list:
+    return [
+        JoinChatAction(command=Command.JOIN_CHAT, room=1, token=TOKEN, message="привет", after_id=7),
+        JoinGroupAction(command=Command.JOIN_GROUP, room=2, token=TOKEN),
+        JoinUserAction(command=Command.JOIN_USER, user_id=3, token=TOKEN),
+        JoinServerAction(command=Command.JOIN_SERVER, token=TOKEN, directory_version="ab12cd34:5"),
+        SendAction(command=Command.SEND, room=1, token=TOKEN, message="текст <END>\n"),
+        LeaveAction(command=Command.LEAVE, room=1, token=TOKEN),
+        RegisterAction(command=Command.REGISTER, username="u", password="p"),
+        AuthorizeAction(command=Command.AUTHORIZE, username="u", password="p"),
+        HistoryAction(command=Command.HISTORY, room=1, token=TOKEN, before_id=100, limit=50),
+        HeartbeatAction(command=Command.HEARTBEAT, nonce=42, reply=True),
+        StatsAction(command=Command.STATS, token=TOKEN),
+    ]
+
+
+def make_message(i: int = 0) -> Message:
+    return Message(id=i + 1, content=f"сообщение {i}", from_=1, from_username="a", room_id=1, time_=1700000000.5 + i)
+
+
+def make_init(users: int) -> InitMessage:
+    briefs = [UserBrief(id=i, username=f"user_{i}") for i in range(users)]
+    return InitMessage(
+        self_user={"id": 0, "username": "user_0"},
+        rooms=[RoomBrief(room_id=1, title="Общий", users=briefs[:50])],
+        all_users=briefs,
+        online_users=briefs[::3],
+    )
+
+
+def sample_messages() -> list:
+    return [
+        make_message(),
+        UpdateMessage(kind=UpdateKind.user_online, payload={"id": 1, "username": "a"}),
+        make_init(10),
+        TokenMessage(content=TOKEN),
+        JoinChatMessage(content="", room_id=1, messages=[make_message(i) for i in range(3)], has_more=True),
+        HistoryMessage(content="", room_id=1, before_id=4, messages=[make_message(i) for i in range(3)]),
+        ErrorMessage(content="ошибка"),
+        HeartbeatMessage(nonce=42),
+        StatsMessage(stats={"connections": 3, "rooms": {"1": 2}, "rtt_ms": 1.5}),
+        PresenceMessage(online=[UserBrief(id=1, username="a")], offline=[UserBrief(id=2, username="б")]),
+    ]
+
+
+def union_members(union) -> set[type]:
+    # Annotated[Union[...], Field(...)] -> классы из Union
+    return set(typing.get_args(typing.get_args(union)[0]))
+
+
+def check_coverage():
+    # новый тип в ActionUnion/AnyMessage без образца здесь - ошибка, а не тихий пропуск
+    for union, samples in ((ActionUnion, sample_actions()), (AnyMessage, sample_messages())):
+        missing = union_members(union) - {type(sample) for sample in samples}
+        assert not missing, f"нет образцов для {sorted(cls.__name__ for cls in missing)}"
+
+
+def check_round_trip(codec: Codec):
+    for action in sample_actions():
+        decoded = adapter.validate_python(codec.loads(action._payload(codec)))
+        assert decoded == action, (codec.name, action)
+    for message in sample_messages():
+        decoded = message_adapter.validate_python(codec.loads(message._payload(codec)))
+        assert decoded == message, (codec.name, message)
+
+
+def bench(codec: Codec, message: InitMessage, repeat: int = 5) -> tuple[float, float, int]:
+    data = message.model_dump(mode="json")
+    payload = codec.dumps(data)
+    encode = decode = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        codec.dumps(data)
+        encode = min(encode, time.perf_counter() - start)
+        start = time.perf_counter()
+        codec.loads(payload)
+        decode = min(decode, time.perf_counter() - start)
+    return encode, decode, len(payload)
+
+
+def main(users: int):
+    check_coverage()
+    for codec in CODECS.values():
+        check_round_trip(codec)
+    print(f"round-trip OK: {', '.join(CODECS)}")
+
+    message = make_init(users)
+    print(f"InitMessage, {users} пользователей")
+    print(f"{'кодек':>8} | {'encode, мс':>10} | {'decode, мс':>10} | {'encode, МБ/с':>12} | {'байт':>9}")
+    for codec in CODECS.values():
+        encode, decode, size = bench(codec, message)
+        print(f"{codec.name:>8} | {encode * 1e3:>10.2f} | {decode * 1e3:>10.2f} | "
+              f"{size / encode / 1e6:>12.1f} | {size:>9}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
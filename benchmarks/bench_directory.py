@@ -0,0 +1,66 @@
+# Стоимость полного InitMessage на один вход при большом справочнике:
+# до - UserBrief на каждого пользователя, model_dump и сериализация всего списка,
+# после - SplicedFrame с заранее закодированным снимком Directory (склейка байтов).
+# Запуск: python -m benchmarks.bench_directory [число_пользователей ...]
+import sys
+import time
+
+from protocol.codec import CODECS
+from protocol.messages import InitMessage, SplicedFrame, TypeMessage, UserBrief
+from server.directory import Directory
+
+
+def make_directory(users: int) -> Directory:
+    directory = Directory(log_size=1000)
+    for user_id in range(1, users + 1):
+        directory.add_user(user_id, f"user_{user_id:06d}")
+    return directory
+
+
+def init_message(all_users: list[UserBrief]) -> InitMessage:
+    return InitMessage(
+        type=TypeMessage.init,
+        self_user={"id": 1, "username": "user_000001"},
+        rooms=[],
+        all_users=all_users,
+        online_users=[],
+        directory_version="bench:1",
+    )
+
+
+def full_encode(directory: Directory, codec) -> bytes:
+    all_users = [UserBrief(id=user_id, username=name) for user_id, name in directory.users.items()]
+    return init_message(all_users).to_frame().payload(codec)
+
+
+def spliced(directory: Directory, codec) -> bytes:
+    return SplicedFrame(init_message([]), {"all_users": directory.users_fragment}).payload(codec)
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 50_000]
+    for size in sizes:
+        directory = make_directory(size)
+        for codec in CODECS.values():
+            # оба пути дают одно и то же после декодирования
+            assert codec.loads(full_encode(directory, codec)) == codec.loads(spliced(directory, codec))
+            before = best_of(lambda: full_encode(directory, codec), 5)
+            after = best_of(lambda: spliced(directory, codec), 20)
+            print(
+                f"{size:>6} пользователей, {codec.name:>7}: "
+                f"{len(spliced(directory, codec)) / 1024:8.1f} КиБ, "
+                f"до {before * 1e3:8.2f} мс, после {after * 1e3:6.3f} мс, x{before / after:.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Стоимость рассылки одного сообщения в комнату на получателя:
+# до - _to_bytes() на каждого получателя, после - один Frame на всех
+# (для каждого получателя берётся frame.wire() - кэш уже упакованного кадра).
+# Запуск: python -m benchmarks.bench_frame [размер_комнаты ...]
+import sys
+import time
+
+from protocol.framing import LengthPrefixedFraming
+from protocol.messages import Message, TypeMessage, Frame
+
+
+def make_message() -> Message:
+    return Message(
+        type=TypeMessage.message,
+        content="Привет всем! " * 8,
+        from_=42,
+        from_username="i_vanya0956",
+        room_id=7,
+        time_=time.time(),
+    )
+
+
+def per_recipient(room_size: int, repeat: int) -> float:
+    message = make_message()
+    best = float("inf")
+    for _ in range(repeat):
+        out = []
+        start = time.perf_counter()
+        for _ in range(room_size):
+            out.append(message._to_bytes())
+        best = min(best, time.perf_counter() - start)
+    return best / room_size
+
+
+def shared_frame(room_size: int, repeat: int) -> float:
+    message = make_message()
+    framing = LengthPrefixedFraming()
+    best = float("inf")
+    for _ in range(repeat):
+        out = []
+        start = time.perf_counter()
+        frame = Frame(message)
+        for _ in range(room_size):
+            out.append(frame.wire(framing))
+        best = min(best, time.perf_counter() - start)
+    return best / room_size
+
+
+def main(sizes: list[int], repeat: int = 5):
+    print(f"{'получателей':>12} | {'до, мкс/получ.':>15} | {'после, мкс/получ.':>18} | {'ускорение':>9}")
+    for size in sizes:
+        before = per_recipient(size, repeat) * 1e6
+        after = shared_frame(size, repeat) * 1e6
+        print(f"{size:>12} | {before:>15.3f} | {after:>18.3f} | {before / after:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10, 100, 2000])
@@ -0,0 +1,173 @@
+# Задержка чата во время волны входов: чатеры шлют сообщения с заданной частотой,
+# а посередине прогона отдельный процесс открывает --logins соединений и разом
+# авторизуется (scrypt на каждого). Задержка "отправка -> доставка" считается
+# отдельно до волны, во время неё и после. Прогон повторяется для каждого
+# значения AUTH_WORKERS из --auth-workers (0 - scrypt прямо в event loop).
+# Нужна БД с теми же настройками, что у сервера (DB_URL или --db-url).
+# Запуск: python -m benchmarks.bench_login_burst [--db-url URL] [--logins N]
+#         [--chatters C] [--rooms R] [--rate MSG_PER_SEC] [--auth-workers 0,4]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from protocol.framing import client_handshake
+from action.passwords import hash_password
+from action.schemas import AuthorizeAction, Command
+from protocol.messages import TypeMessage, message_adapter
+from benchmarks.bench_workers import prepare, wait_port
+from benchmarks.loadgen import LoadClient, percentile, raise_nofile_limit
+from config import Config
+from db_model.db_repo import DbRepo
+from db_model.models import User
+
+PASSWORD = "burst"
+
+
+async def create_users(db_url: str, names: list[str]):
+    # Один хэш на всех: scrypt для тысячи пользователей здесь не нужен,
+    # проверять его при входе сервер всё равно будет для каждого
+    password_hash = hash_password(PASSWORD)
+    db = DbRepo(db_url)
+    async with db.async_session() as session:
+        session.add_all([User(username=name, password_hash=password_hash) for name in names])
+        await session.commit()
+    await db.async_engine.dispose()
+
+
+class TimedClient(LoadClient):
+    # Кроме задержки запоминает момент доставки, чтобы разнести её по фазам
+    async def receive(self):
+        prefix = f"{self.tag} "
+        while True:
+            msg = await self.read()
+            if msg.type_ == TypeMessage.message and msg.content.startswith(prefix):
+                now = time.time_ns()
+                sent_ns = int(msg.content.split(" ", 2)[1])
+                self.latencies.append((now, (now - sent_ns) / 1e6))
+
+
+async def login(port: int, username: str) -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        framing, codec = await client_handshake(reader, writer)
+        await AuthorizeAction(command=Command.AUTHORIZE, username=username, password=PASSWORD
+                              ).send_action(writer, framing, codec)
+        while True:
+            msg = message_adapter.validate_python(codec.loads(await framing.read(reader)))
+            if msg.type_ == TypeMessage.token:
+                return "ok"
+            if msg.type_ == TypeMessage.error:
+                return "rejected"
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return "failed"
+    finally:
+        writer.close()
+
+
+def burst_proc(port: int, names: list[str], result_queue):
+    raise_nofile_limit()
+
+    async def run():
+        start = time.time_ns()
+        results = await asyncio.gather(*(login(port, name) for name in names), return_exceptions=True)
+        end = time.time_ns()
+        counts = {"ok": 0, "rejected": 0, "failed": 0}
+        for result in results:
+            counts[result if isinstance(result, str) else "failed"] += 1
+        return start, end, counts
+
+    result_queue.put(asyncio.run(run()))
+
+
+def phase(latencies: list[tuple[int, float]], start: int, end: int) -> dict:
+    values = sorted(lat for at, lat in latencies if start <= at < end)
+    return {
+        "n": len(values),
+        "p50": round(percentile(values, 50), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(values[-1], 2) if values else 0.0,
+    }
+
+
+def run_case(args, auth_workers: int, room_ids: list[int]) -> dict:
+    tag = f"lb-{uuid.uuid4().hex[:6]}"
+    names = [f"{tag}-login-{i}" for i in range(args.logins)]
+    asyncio.run(create_users(args.db_url, names))
+    env = dict(os.environ, DB_URL=args.db_url, AUTH_WORKERS=str(auth_workers), METRICS_PORT="0")
+    server = subprocess.Popen([sys.executable, "main_server.py", "--port", str(args.port)], env=env)
+    try:
+        wait_port(args.port)
+
+        async def run():
+            clients = [
+                TimedClient("127.0.0.1", args.port, f"{tag}-chat-{i}", PASSWORD, room_ids[i % len(room_ids)], tag)
+                for i in range(args.chatters)
+            ]
+            await asyncio.gather(*(c.connect("register") for c in clients))
+            receivers = [asyncio.create_task(c.receive()) for c in clients]
+            deadline = time.monotonic() + args.before + args.during_max + args.after
+            senders = asyncio.gather(*(c.send(args.rate, deadline) for c in clients), return_exceptions=True)
+
+            await asyncio.sleep(args.before)
+            result_queue = multiprocessing.Queue()
+            burst = multiprocessing.Process(target=burst_proc, args=(args.port, names, result_queue))
+            burst.start()
+            burst_start, burst_end, counts = await asyncio.to_thread(result_queue.get)
+            await asyncio.to_thread(burst.join)
+            # после волны ещё args.after секунд обычной работы
+            await asyncio.sleep(args.after)
+            senders.cancel()
+            await asyncio.sleep(1)
+            for task in receivers:
+                task.cancel()
+            for client in clients:
+                client.close()
+            latencies = [item for c in clients for item in c.latencies]
+            return burst_start, burst_end, counts, latencies
+
+        burst_start, burst_end, counts, latencies = asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "auth_workers": auth_workers,
+        "logins": counts,
+        "burst_seconds": round((burst_end - burst_start) / 1e9, 2),
+        "before": phase(latencies, 0, burst_start),
+        "during": phase(latencies, burst_start, burst_end),
+        "after": phase(latencies, burst_end, time.time_ns()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--logins", type=int, default=1000)
+    parser.add_argument("--chatters", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=5.0, help="сообщений в секунду на чатера")
+    parser.add_argument("--before", type=float, default=3.0, help="секунд чата до волны")
+    parser.add_argument("--after", type=float, default=3.0, help="секунд чата после волны")
+    parser.add_argument("--during-max", type=float, default=120.0, help="предел длительности волны, сек")
+    parser.add_argument("--auth-workers", default=f"0,{Config.AUTH_WORKERS}")
+    args = parser.parse_args()
+
+    room_ids = asyncio.run(prepare(args.db_url, args.rooms))
+    for auth_workers in (int(w) for w in args.auth_workers.split(",")):
+        result = run_case(args, auth_workers, room_ids)
+        print(f"AUTH_WORKERS={result['auth_workers']}: входы {result['logins']} за {result['burst_seconds']} с")
+        for name in ("before", "during", "after"):
+            stats = result[name]
+            print(f"  {name:>6}: {stats['n']:>6} доставок, p50 {stats['p50']} мс, "
+                  f"p99 {stats['p99']} мс, max {stats['max']} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Пропускная способность сохранения сообщений: DbRepo.send_message (строка за строкой,
+# commit + refresh на каждое) против MessageWriter (многострочный INSERT пачками).
+# Отправители работают параллельно, как соединения на сервере.
+# Запуск: python -m benchmarks.bench_persist [--db-url URL] [--messages N] [--senders C]
+import argparse
+import asyncio
+import time
+import uuid
+
+from config import Config
+from db_model.db_repo import DbRepo
+from db_model.message_writer import MessageWriter
+from db_model.models import Base, User, ChatRoom
+
+
+async def prepare(db: DbRepo) -> tuple[int, int]:
+    async with db.async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with db.async_session() as session:
+        user = User(username=f"bench_{uuid.uuid4().hex[:8]}", password_hash="-")
+        room = ChatRoom(name="bench")
+        session.add_all([user, room])
+        await session.commit()
+        return user.id, room.id
+
+
+async def per_row(db: DbRepo, user_id: int, room_id: int, messages: int, senders: int) -> float:
+    async def sender(n: int):
+        for i in range(n):
+            await db.send_message(user_id, room_id, f"per-row {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(messages // senders) for _ in range(senders)))
+    return time.perf_counter() - start
+
+
+async def group_commit(db: DbRepo, user_id: int, room_id: int, messages: int, senders: int) -> float:
+    writer = MessageWriter(
+        db,
+        batch_size=Config.PERSIST_BATCH_SIZE,
+        flush_interval=Config.PERSIST_FLUSH_INTERVAL,
+        max_pending=Config.PERSIST_MAX_PENDING,
+    )
+    writer.start()
+
+    async def sender(n: int):
+        for i in range(n):
+            await writer.submit(user_id, room_id, f"group {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(messages // senders) for _ in range(senders)))
+    await writer.close()
+    return time.perf_counter() - start
+
+
+async def main(db_url: str, messages: int, senders: int):
+    db = DbRepo(db_url)
+    user_id, room_id = await prepare(db)
+    total = messages // senders * senders
+    before = await per_row(db, user_id, room_id, messages, senders)
+    after = await group_commit(db, user_id, room_id, messages, senders)
+    print(f"{total} сообщений, {senders} отправителей")
+    print(f"{'путь':>14} | {'сек':>7} | {'сообщ./сек':>10}")
+    print(f"{'send_message':>14} | {before:>7.2f} | {total / before:>10.0f}")
+    print(f"{'MessageWriter':>14} | {after:>7.2f} | {total / after:>10.0f}")
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.db_url, args.messages, args.senders))
@@ -0,0 +1,75 @@
+# Время и память прогрева Server.chats при старте: один потоковый запрос
+# комнат с участниками (Server.load_memberships).
+# Запуск: python -m benchmarks.bench_warmup --db-url URL --populate [--rooms 100000 --members 10]
+# --populate заполняет пустую БД: rooms пользователей, rooms комнат, по members участников в каждой
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from sqlalchemy import insert
+
+from config import Config
+from db_model.db_repo import DbRepo
+from db_model.models import Base, User, ChatRoom, Membership
+from server.server import Server
+
+CHUNK = 50_000
+
+
+async def populate(db: DbRepo, rooms: int, members: int):
+    async with db.async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for start in range(0, rooms, CHUNK):
+            ids = range(start + 1, min(start + CHUNK, rooms) + 1)
+            await conn.execute(insert(User), [{"id": i, "username": f"warm_{i}", "password_hash": "-"} for i in ids])
+            await conn.execute(insert(ChatRoom), [{"id": i, "name": f"room {i}"} for i in ids])
+        rows = []
+        for room_id in range(1, rooms + 1):
+            for k in range(members):
+                rows.append({"id_room": room_id, "id_user": (room_id + k * 7919) % rooms + 1})
+            if len(rows) >= CHUNK:
+                await conn.execute(insert(Membership), rows)
+                rows = []
+        if rows:
+            await conn.execute(insert(Membership), rows)
+
+
+async def measure(db: DbRepo, trace_memory: bool) -> tuple[float, int, int, int, int]:
+    server = Server(db)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await server.load_memberships()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    current = 0
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    memberships = sum(len(m) for m in server.chats.values())
+    return elapsed, len(server.chats), memberships, current, peak
+
+
+async def main(db_url: str, do_populate: bool, rooms: int, members: int):
+    db = DbRepo(db_url)
+    if do_populate:
+        start = time.perf_counter()
+        await populate(db, rooms, members)
+        print(f"БД заполнена за {time.perf_counter() - start:.1f} с")
+    elapsed, room_count, memberships, _, _ = await measure(db, trace_memory=False)
+    _, _, _, current, peak = await measure(db, trace_memory=True)
+    print(f"комнат: {room_count}, участий: {memberships}")
+    print(f"время прогрева: {elapsed:.2f} с")
+    print(f"память Server.chats: {current / 2**20:.1f} МиБ, пик во время загрузки: {peak / 2**20:.1f} МиБ")
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--populate", action="store_true")
+    parser.add_argument("--rooms", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.db_url, args.populate, args.rooms, args.members))
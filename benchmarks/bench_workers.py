@@ -0,0 +1,177 @@
+# Масштабирование сервера по ядрам: для 1, 2, 4 ... воркеров запускает
+# main_server.py --workers N, подключает клиентов из нескольких процессов,
+# рассаживает их по групповым комнатам и считает доставленные сообщения в секунду.
+# Клиенты одной комнаты попадают на разные воркеры, так что меряется и шина.
+# Нужна БД с теми же настройками, что у сервера (DB_URL или --db-url).
+# Запуск: python -m benchmarks.bench_workers [--db-url URL] [--max-workers N]
+#         [--rooms R] [--members M] [--messages K] [--client-procs P]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from protocol.framing import client_handshake
+from action.schemas import Command, RegisterAction, JoinChatAction, SendAction
+from protocol.messages import TypeMessage, message_adapter
+from config import Config
+from db_model.db_repo import DbRepo
+from db_model.models import Base, ChatRoom
+
+PREFIX = "bench-w"
+
+
+async def prepare(db_url: str, rooms: int) -> list[int]:
+    db = DbRepo(db_url)
+    async with db.async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with db.async_session() as session:
+        new_rooms = [ChatRoom(name=f"bench-{i}") for i in range(rooms)]
+        session.add_all(new_rooms)
+        await session.commit()
+        ids = [room.id for room in new_rooms]
+    await db.async_engine.dispose()
+    return ids
+
+
+async def client(port: int, room_id: int, messages: int, expected: int,
+                 ready: asyncio.Event, go: asyncio.Event) -> tuple[int, float]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    framing, codec = await client_handshake(reader, writer)
+    name = f"{PREFIX}-{uuid.uuid4().hex[:10]}"
+    await RegisterAction(command=Command.REGISTER, username=name, password="bench").send_action(writer, framing, codec)
+    token = None
+    while token is None:
+        msg = message_adapter.validate_python(codec.loads(await framing.read(reader)))
+        if msg.type_ == TypeMessage.token:
+            token = msg.content
+    await JoinChatAction(command=Command.JOIN_CHAT, room=room_id, token=token).send_action(writer, framing, codec)
+    while True:
+        msg = message_adapter.validate_python(codec.loads(await framing.read(reader)))
+        if msg.type_ == TypeMessage.join_chat:
+            break
+    ready.set()
+    await go.wait()
+
+    start = time.perf_counter()
+    received = 0
+
+    async def receive():
+        nonlocal received
+        while received < expected:
+            msg = message_adapter.validate_python(codec.loads(await framing.read(reader)))
+            if msg.type_ == TypeMessage.message and msg.content.startswith(PREFIX):
+                received += 1
+
+    receiver = asyncio.create_task(receive())
+    for i in range(messages):
+        await SendAction(command=Command.SEND, room=room_id, message=f"{PREFIX} {i}", token=token
+                         ).send_action(writer, framing, codec)
+    try:
+        await asyncio.wait_for(receiver, 30)
+    except TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return received, elapsed
+
+
+def client_proc(port: int, assignments: list[int], members: int, messages: int, barrier, result_queue):
+    async def run():
+        go = asyncio.Event()
+        events = [asyncio.Event() for _ in assignments]
+        tasks = [
+            asyncio.create_task(client(port, room_id, messages, members * messages, ready, go))
+            for room_id, ready in zip(assignments, events)
+        ]
+        for event in events:
+            await event.wait()
+        await asyncio.to_thread(barrier.wait)
+        go.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    result_queue.put((sum(r for r, _ in results), max(e for _, e in results)))
+
+
+def wait_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise Exception(f"Сервер не поднялся на порту {port}")
+
+
+def run_case(args, workers: int) -> dict:
+    room_ids = asyncio.run(prepare(args.db_url, args.rooms))
+    env = dict(os.environ, DB_URL=args.db_url)
+    server = subprocess.Popen(
+        [sys.executable, "main_server.py", "--workers", str(workers), "--port", str(args.port)],
+        env=env,
+    )
+    try:
+        wait_port(args.port)
+        # время на загрузку членств и поднятие шины во всех воркерах
+        time.sleep(1 + 0.2 * workers)
+        assignments = [room_id for room_id in room_ids for _ in range(args.members)]
+        slices = [assignments[i::args.client_procs] for i in range(args.client_procs)]
+        barrier = multiprocessing.Barrier(len(slices))
+        result_queue = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=client_proc,
+                args=(args.port, part, args.members, args.messages, barrier, result_queue),
+            )
+            for part in slices
+        ]
+        for proc in procs:
+            proc.start()
+        results = [result_queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    delivered = sum(r for r, _ in results)
+    elapsed = max(e for _, e in results)
+    expected = len(assignments) * args.members * args.messages
+    return {
+        "workers": workers,
+        "delivered": delivered,
+        "expected": expected,
+        "seconds": round(elapsed, 3),
+        "delivered_per_sec": round(delivered / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--client-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    args = parser.parse_args()
+
+    workers = 1
+    while workers <= args.max_workers:
+        result = run_case(args, workers)
+        print(
+            f"воркеров {result['workers']:>2}: доставлено {result['delivered']}/{result['expected']} "
+            f"за {result['seconds']} с, {result['delivered_per_sec']} сообщ/с"
+        )
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# Нагрузочный генератор без GUI: открывает много соединений (протокол v2),
+# регистрирует или авторизует пользователей, рассаживает их по комнатам и шлёт
+# сообщения с заданной частотой. В текст сообщения вшито время отправки, поэтому
+# получатель считает задержку "отправка -> доставка". Итог - JSON с пропускной
+# способностью и p50/p95/p99, удобный для сравнения прогонов.
+# Сервер и БД локальные: комнаты создаются в БД по --db-url (или задаются --room-ids).
+# Запуск: python -m benchmarks.loadgen [--host H] [--port P] [--connections N]
+#         [--procs K] [--rooms R] [--rate MSG_PER_SEC] [--duration S]
+#         [--auth register|authorize] [--user-prefix PREFIX] [--output FILE]
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+import uuid
+
+from protocol.framing import client_handshake
+from action.schemas import AuthorizeAction, Command, RegisterAction, JoinChatAction, SendAction
+from protocol.messages import TypeMessage, message_adapter
+from benchmarks.bench_workers import prepare
+from config import Config
+
+
+class LoadClient:
+
+    def __init__(self, host: str, port: int, username: str, password: str, room_id: int, tag: str):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.room_id = room_id
+        self.tag = tag
+        self.sent = 0
+        self.latencies: list[float] = []
+
+    async def read(self):
+        return message_adapter.validate_python(self.codec.loads(await self.framing.read(self.reader)))
+
+    async def action(self, action):
+        await action.send_action(self.writer, self.framing, self.codec)
+
+    async def connect(self, auth: str):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.framing, self.codec = await client_handshake(self.reader, self.writer)
+        action_cls = RegisterAction if auth == "register" else AuthorizeAction
+        command = Command.REGISTER if auth == "register" else Command.AUTHORIZE
+        await self.action(action_cls(command=command, username=self.username, password=self.password))
+        self.token = None
+        while self.token is None:
+            msg = await self.read()
+            if msg.type_ == TypeMessage.token:
+                self.token = msg.content
+        await self.action(JoinChatAction(command=Command.JOIN_CHAT, room=self.room_id, token=self.token))
+        while (await self.read()).type_ != TypeMessage.join_chat:
+            pass
+
+    async def receive(self):
+        prefix = f"{self.tag} "
+        while True:
+            msg = await self.read()
+            if msg.type_ == TypeMessage.message and msg.content.startswith(prefix):
+                sent_ns = int(msg.content.split(" ", 2)[1])
+                self.latencies.append((time.time_ns() - sent_ns) / 1e6)
+
+    async def send(self, rate: float, deadline: float):
+        # равномерный поток без накопления дрейфа; старт со случайным сдвигом
+        interval = 1 / rate
+        next_at = time.monotonic() + interval * (hash(self.username) % 1000) / 1000
+        while True:
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            if time.monotonic() >= deadline:
+                return
+            await self.action(SendAction(command=Command.SEND, room=self.room_id,
+                                         message=f"{self.tag} {time.time_ns()}", token=self.token))
+            self.sent += 1
+            next_at += interval
+
+    def close(self):
+        self.writer.close()
+
+
+def raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def load_proc(args, tag: str, users: list[tuple[str, int]], barrier, result_queue):
+    raise_nofile_limit()
+
+    async def run():
+        clients = [LoadClient(args.host, args.port, name, args.password, room_id, tag) for name, room_id in users]
+        errors = 0
+        connected = []
+        # подключаемся пачками, чтобы не упереться в backlog сервера
+        for i in range(0, len(clients), args.connect_batch):
+            batch = clients[i:i + args.connect_batch]
+            results = await asyncio.gather(*(c.connect(args.auth) for c in batch), return_exceptions=True)
+            for client, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    errors += 1
+                else:
+                    connected.append(client)
+        receivers = [asyncio.create_task(c.receive()) for c in connected]
+        await asyncio.to_thread(barrier.wait)
+
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*(c.send(args.rate, deadline) for c in connected), return_exceptions=True)
+        # ждём доставки того, что ещё в пути
+        await asyncio.sleep(args.drain)
+        for task in receivers:
+            task.cancel()
+        for client in connected:
+            client.close()
+
+        sent_by_room: dict[int, int] = {}
+        members_by_room: dict[int, int] = {}
+        for client in connected:
+            sent_by_room[client.room_id] = sent_by_room.get(client.room_id, 0) + client.sent
+            members_by_room[client.room_id] = members_by_room.get(client.room_id, 0) + 1
+        return {
+            "connected": len(connected),
+            "errors": errors,
+            "sent_by_room": sent_by_room,
+            "members_by_room": members_by_room,
+            "latencies": [lat for c in connected for lat in c.latencies],
+        }
+
+    result_queue.put(asyncio.run(run()))
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize(args, room_ids: list[int], results: list[dict], elapsed: float) -> dict:
+    sent_by_room: dict[int, int] = {}
+    members_by_room: dict[int, int] = {}
+    for result in results:
+        for room_id, sent in result["sent_by_room"].items():
+            sent_by_room[room_id] = sent_by_room.get(room_id, 0) + sent
+        for room_id, members in result["members_by_room"].items():
+            members_by_room[room_id] = members_by_room.get(room_id, 0) + members
+    latencies = sorted(lat for r in results for lat in r["latencies"])
+    sent = sum(sent_by_room.values())
+    # каждое сообщение доходит до всех участников комнаты, включая отправителя
+    expected = sum(sent * members_by_room[room_id] for room_id, sent in sent_by_room.items())
+    return {
+        "config": {
+            "host": args.host,
+            "port": args.port,
+            "connections": args.connections,
+            "procs": args.procs,
+            "rooms": len(room_ids),
+            "rate": args.rate,
+            "duration": args.duration,
+            "auth": args.auth,
+        },
+        "connected": sum(r["connected"] for r in results),
+        "connect_errors": sum(r["errors"] for r in results),
+        "sent": sent,
+        "delivered": len(latencies),
+        "expected_delivered": expected,
+        "elapsed": round(elapsed, 3),
+        "sent_per_sec": round(sent / args.duration, 1),
+        "delivered_per_sec": round(len(latencies) / args.duration, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+            "mean": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--db-url", default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--room-ids", default="", help="готовые комнаты через запятую вместо создания")
+    parser.add_argument("--rate", type=float, default=1.0, help="сообщений в секунду на соединение")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="ожидание доставки после отправки, сек")
+    parser.add_argument("--auth", choices=("register", "authorize"), default="register")
+    parser.add_argument("--user-prefix", default=None,
+                        help="имена пользователей PREFIX-0..N-1; для --auth authorize - уже зарегистрированные")
+    parser.add_argument("--password", default="loadgen")
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--output", default=None, help="файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if args.room_ids:
+        room_ids = [int(room_id) for room_id in args.room_ids.split(",")]
+    else:
+        room_ids = asyncio.run(prepare(args.db_url, args.rooms))
+    tag = f"lg-{uuid.uuid4().hex[:6]}"
+    prefix = args.user_prefix or tag
+    users = [(f"{prefix}-{i}", room_ids[i % len(room_ids)]) for i in range(args.connections)]
+
+    procs = min(args.procs, len(users))
+    barrier = multiprocessing.Barrier(procs + 1)
+    result_queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=load_proc, args=(args, tag, users[i::procs], barrier, result_queue))
+        for i in range(procs)
+    ]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    results = [result_queue.get() for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    report = json.dumps(summarize(args, room_ids, results, elapsed), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 import asyncio
 import json
 
-from action.schemas_message import END_MARKER, InitMessage, TokenMessage, UpdateMessage
-from action.schemas import RegisterAction, AuthorizeAction, JoinServerAction, Command
+from protocol.messages import END_MARKER, InitMessage, TokenMessage, UpdateMessage
+from protocol.actions import RegisterAction, AuthorizeAction, JoinServerAction, Command
 
 
 async def send_messages(writer):
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 import dotenv
 
@@ -9,5 +10,94 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DB_URL")
     SECRET_KEY = os.environ.get("SECRET_KEY")
 
+    # Адрес сервера и число процессов-воркеров на одном порту (SO_REUSEPORT, только Linux/BSD);
+    # BUS_DIR - каталог Unix-сокетов шины между воркерами
+    SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT = int(os.environ.get("SERVER_PORT", 8888))
+    WORKERS = int(os.environ.get("WORKERS", 1))
+    BUS_DIR = os.environ.get("BUS_DIR", tempfile.gettempdir())
+
+    # Кластер: имя этого узла и все узлы "имя=host:port,..." (адреса межузловых каналов);
+    # неподтверждённые события переотправляются раз в CLUSTER_RETRY_INTERVAL секунд
+    CLUSTER_NODE = os.environ.get("CLUSTER_NODE")
+    CLUSTER_NODES = os.environ.get("CLUSTER_NODES", "")
+    CLUSTER_RETRY_INTERVAL = float(os.environ.get("CLUSTER_RETRY_INTERVAL", 1.0))
+
+    # Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 - выключено);
+    # ADMIN_USERS - имена пользователей, которым доступна команда STATS;
+    # METRICS_TOKEN - пароль на POST /loglevel (Authorization: Bearer ...), без него
+    # менять уровни можно только с loopback-адресов
+    METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+    ADMIN_USERS = [name for name in os.environ.get("ADMIN_USERS", "").split(",") if name]
+
+    # Исходящая очередь на каждое соединение и политика для медленных клиентов:
+    # drop_oldest | disconnect | block (ждать место не дольше SLOW_CONSUMER_TIMEOUT секунд)
+    OUTBOUND_QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", 1024))
+    SLOW_CONSUMER_POLICY = os.environ.get("SLOW_CONSUMER_POLICY", "drop_oldest")
+    SLOW_CONSUMER_TIMEOUT = float(os.environ.get("SLOW_CONSUMER_TIMEOUT", 5.0))
+
+    # Максимальный размер кадра (байт) для протокола v2 и буфера клиентов с END_MARKER
+    MAX_FRAME_SIZE = int(os.environ.get("MAX_FRAME_SIZE", 16 * 1024 * 1024))
+
+    # Сколько секунд ждём hello от клиента v2 после MAGIC (0 - без ограничения);
+    # молчащее дольше соединение считается клиентом v1 с END_MARKER
+    HANDSHAKE_TIMEOUT = float(os.environ.get("HANDSHAKE_TIMEOUT", 10))
+
+    # Кодеки, которые сервер готов согласовать с клиентами v2 (json доступен всегда)
+    WIRE_CODECS = os.environ.get("WIRE_CODECS", "msgpack,orjson,json").split(",")
+
+    # LRU проверенных JWT: размер (0 - выключен) и время жизни записи в секундах
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10_000))
+    TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+
+    # Кэш пользователей и комнат перед БД: размер (0 - без кэша) и TTL в секундах
+    DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", 50_000))
+    DB_CACHE_TTL = float(os.environ.get("DB_CACHE_TTL", 60))
+
+    # История чата отдаётся страницами: размер страницы по умолчанию и максимальный
+    HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+    HISTORY_MAX_PAGE = int(os.environ.get("HISTORY_MAX_PAGE", 500))
+
+    # Групповая запись сообщений: размер пачки, максимальная задержка сброса (сек)
+    # и предел очереди, после которого отправители ждут БД
+    PERSIST_BATCH_SIZE = int(os.environ.get("PERSIST_BATCH_SIZE", 500))
+    PERSIST_FLUSH_INTERVAL = float(os.environ.get("PERSIST_FLUSH_INTERVAL", 0.05))
+    PERSIST_MAX_PENDING = int(os.environ.get("PERSIST_MAX_PENDING", 10_000))
+
+    # Heartbeat для клиентов v2: интервал (сек, 0 - выключен) и сколько интервалов
+    # тишины терпим до разрыва; IDLE_TIMEOUT - отключение без действий (сек, 0 - выключено).
+    # По умолчанию выключено: клиент, который только читает, тоже живой, а мёртвые
+    # соединения и так снимает heartbeat. Клиент не переподключается сам
+    HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", 15))
+    HEARTBEAT_MISSES = int(os.environ.get("HEARTBEAT_MISSES", 3))
+    IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 0))
+
+    # Изменения присутствия (online/offline) копятся столько секунд и рассылаются
+    # одним дайджестом (0 - рассылать каждое изменение сразу)
+    PRESENCE_INTERVAL = float(os.environ.get("PRESENCE_INTERVAL", 0.25))
+
+    # Сколько последних изменений справочника пользователей помнит сервер:
+    # клиенту, отставшему сильнее, InitMessage приходит полным снимком
+    DIRECTORY_LOG_SIZE = int(os.environ.get("DIRECTORY_LOG_SIZE", 10_000))
+
+    # Пароли: параметры scrypt (при их смене хэши пересчитываются при входе);
+    # пул потоков для scrypt и подписи токенов (0 - в event loop) и предел одновременных входов
+    SCRYPT_N = int(os.environ.get("SCRYPT_N", 2 ** 14))
+    SCRYPT_R = int(os.environ.get("SCRYPT_R", 8))
+    SCRYPT_P = int(os.environ.get("SCRYPT_P", 1))
+    AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", min(4, os.cpu_count() or 1)))
+    AUTH_MAX_PENDING = int(os.environ.get("AUTH_MAX_PENDING", 256))
+
+    # Логирование: уровень по умолчанию и уровни отдельных логгеров "Server=DEBUG,Cluster=WARNING"
+    # (меняются на лету через POST /loglevel на порту метрик);
+    # LOG_PAYLOAD_EVERY - писать содержимое каждого N-го входящего кадра (0 - никогда);
+    # LOG_FORMAT - text (строка с полями key=value) или json (JSON-объект на строку)
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+    LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+    LOG_PAYLOAD_EVERY = int(os.environ.get("LOG_PAYLOAD_EVERY", 0))
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
 if __name__ == "__main__":
     print(Config.SQLALCHEMY_DATABASE_URI)
\ No newline at end of file
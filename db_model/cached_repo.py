@@ -0,0 +1,75 @@
+from typing import Sequence
+
+from db_model.db_repo import DbRepo
+from db_model.models import User, ChatRoom
+from utils.cache import TTLCache
+
+
+class CachedDbRepo(DbRepo):
+    # Read-through кэш пользователей и комнат поверх DbRepo.
+    # Записи сбрасываются явно при изменениях и по TTL
+
+    ALL_USERS = ("all_users",)
+
+    def __init__(self, db_url: str, cache_size: int, cache_ttl: float):
+        super().__init__(db_url)
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    async def get_user_by_id(self, user_id: int):
+        key = ("user", user_id)
+        user = self.cache.get(key)
+        if user is None:
+            user = await super().get_user_by_id(user_id)
+            if user is not None:
+                self.cache.put(key, user)
+        return user
+
+    async def get_room(self, room_id: int):
+        key = ("room", room_id)
+        room = self.cache.get(key)
+        if room is None:
+            room = await super().get_room(room_id)
+            if room is not None:
+                self.cache.put(key, room)
+        return room
+
+    async def get_all_users(self) -> Sequence[User]:
+        users = self.cache.get(self.ALL_USERS)
+        if users is None:
+            users = await super().get_all_users()
+            self.cache.put(self.ALL_USERS, users)
+        return users
+
+    async def get_users_in_room(self, room_id: int) -> Sequence[User]:
+        key = ("room_users", room_id)
+        users = self.cache.get(key)
+        if users is None:
+            users = await super().get_users_in_room(room_id)
+            self.cache.put(key, users)
+        return users
+
+    async def new_user(self, username: str, password_hash: str):
+        new_user = await super().new_user(username, password_hash)
+        self.cache.invalidate(self.ALL_USERS)
+        self.cache.put(("user", new_user.id), new_user)
+        return new_user
+
+    async def set_password_hash(self, user_id: int, password_hash: str):
+        await super().set_password_hash(user_id, password_hash)
+        self.cache.invalidate(("user", user_id))
+
+    async def new_room_privat(self, user_id: int, username: str, other_user_id: int) -> ChatRoom | None:
+        room = await super().new_room_privat(user_id, username, other_user_id)
+        if room is not None:
+            self.invalidate_room(room.id)
+        return room
+
+    async def add_membership(self, user_id: int, room_id: int):
+        await super().add_membership(user_id, room_id)
+        self.invalidate_room(room_id)
+
+    def invalidate_room(self, room_id: int):
+        self.cache.invalidate(("room", room_id), ("room_users", room_id))
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
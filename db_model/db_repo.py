@@ -1,13 +1,11 @@
-import hashlib
-from typing import Optional, Sequence
+from typing import Optional, Sequence, AsyncIterator
 
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, Row
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import InstrumentedAttribute, joinedload
 
-from db_model.models import User, ChatRoom, Membership, Message, PrivateRoom
-from action.schemas import RegisterAction, AuthorizeAction, JoinUserAction, SendAction
-from action.auth_token import decode_token
+from db_model.models import Base, User, ChatRoom, Membership, Message, PrivateRoom
 from utils.logger import get_logger
 
 
@@ -20,41 +18,50 @@ class DbRepo:
         )
         self.log = get_logger(self.__class__.__name__, to_file=True)
 
-    async def new_user(self, action: RegisterAction):
+    async def ensure_indexes(self):
+        # Индексы, объявленные в моделях, для баз, созданных до их появления
+        # (ix_messages_room_id_id нужен keyset-пагинации истории). IF NOT EXISTS -
+        # шаг безопасно повторяется при каждом старте и в каждом воркере
+        async with self.async_engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    await conn.execute(CreateIndex(index, if_not_exists=True))
+
+    # Пароли хэширует вызывающая сторона (CredentialPool): здесь только хранение хэшей
+    async def new_user(self, username: str, password_hash: str):
         async with self.async_session() as session:
-            hash_password = hashlib.sha256(action.password.encode()).hexdigest()
             new_user = User(
-                username=action.username,
-                password_hash=hash_password,
+                username=username,
+                password_hash=password_hash,
             )
             session.add(new_user)
             await session.commit()
             await session.refresh(new_user)
             return new_user
 
-    async def get_user(self, action: AuthorizeAction):
+    async def get_user(self, username: str):
         async with self.async_session() as session:
-            hash_password = hashlib.sha256(action.password.encode()).hexdigest()
-            stmt = select(User).where(User.username == action.username)
+            stmt = select(User).where(User.username == username)
             user = await session.execute(stmt)
             user = user.scalars().first()
             if user is None:
-                raise Exception(f'User {action.username} not found')
-            if user.password_hash != hash_password:
-                raise Exception(f'Password mismatch')
+                raise Exception(f'User {username} not found')
             return user
 
-    async def new_room_privat(self, action: JoinUserAction) -> ChatRoom | None:
+    async def set_password_hash(self, user_id: int, password_hash: str):
         async with self.async_session() as session:
-            payload = decode_token(action.token)
-            username = payload['username']
-            stmt = select(User).where(User.id == action.user_id)
+            await session.execute(update(User).where(User.id == user_id).values(password_hash=password_hash))
+            await session.commit()
+
+    async def new_room_privat(self, user_id: int, username: str, other_user_id: int) -> ChatRoom | None:
+        async with self.async_session() as session:
+            stmt = select(User).where(User.id == other_user_id)
             user_2 = await session.execute(stmt)
             user_2 = user_2.scalars().first()
             if user_2 is None:
-                raise Exception(f"User with ID {action.user_id} not found")
+                raise Exception(f"User with ID {other_user_id} not found")
             tup_user_1, tup_user_2 = sorted(
-                [(payload['id'], payload['username']),
+                [(user_id, username),
                  (user_2.id, user_2.username)],
                 key=lambda p: p[0],
             )
@@ -67,7 +74,7 @@ class DbRepo:
             existing_private_room = existing_private_room.scalars().first()
             if existing_private_room:
                 self.log.info(
-                    f"Найдена существующая комната[{existing_private_room.room_id}] между {id_1}, {id_2}"
+                    "Найдена существующая комната[%s] между %s, %s", existing_private_room.room_id, id_1, id_2
                 )
                 chat_room = await session.get(ChatRoom, existing_private_room.room_id)
                 return chat_room
@@ -85,7 +92,7 @@ class DbRepo:
             await session.commit()
             session.add(PrivateRoom(user1_id=id_1, user2_id=id_2, room_id=new_chat_room.id))
             await session.commit()
-            self.log.info(f"Создана новая комната {new_chat_room.id} между {id_1} и {id_2}")
+            self.log.info("Создана новая комната %s между %s и %s", new_chat_room.id, id_1, id_2)
             await session.refresh(new_chat_room)
             return new_chat_room
 
@@ -101,13 +108,34 @@ class DbRepo:
             await session.refresh(new_message)
             return new_message
 
-    async def get_room(self, action: SendAction):
+    async def insert_messages(self, rows: list[dict]) -> list[int]:
+        # Пачка сообщений одним многострочным INSERT в одной транзакции
+        async with self.async_session() as session:
+            stmt = insert(Message).returning(Message.id, sort_by_parameter_order=True)
+            result = await session.execute(stmt, rows)
+            ids = list(result.scalars())
+            await session.commit()
+            return ids
+
+    async def get_room(self, room_id: int):
         async with self.async_session() as session:
-            stmt = select(ChatRoom).where(ChatRoom.id == action.room)
+            stmt = select(ChatRoom).where(ChatRoom.id == room_id)
             room = await session.execute(stmt)
             room = room.scalars().first()
             return room
 
+    async def is_private_room(self, room_id: int) -> bool:
+        async with self.async_session() as session:
+            stmt = select(PrivateRoom.room_id).where(PrivateRoom.room_id == room_id)
+            result = await session.execute(stmt)
+            return result.first() is not None
+
+    async def is_member(self, user_id: int, room_id: int) -> bool:
+        async with self.async_session() as session:
+            stmt = select(Membership.id_room).where(Membership.id_user == user_id, Membership.id_room == room_id)
+            result = await session.execute(stmt)
+            return result.first() is not None
+
     async def get_user_by_id(self, user_id: int):
         async with self.async_session() as session:
             stmt = select(User).where(User.id == user_id)
@@ -138,13 +166,33 @@ class DbRepo:
             return result.all()
 
 
-    async def get_messages(self, room_id: int) -> Sequence[Message]:
+    async def get_messages(self,
+                           room_id: int,
+                           limit: int,
+                           before_id: Optional[int] = None,
+                           after_id: Optional[int] = None) -> Sequence[Row]:
+        # Keyset-пагинация: новые первыми, страница старше before_id и/или новее after_id
         async with self.async_session() as session:
-            stmt = select(Message).where(Message.room_id == room_id).options(
-                joinedload(Message.user)
+            stmt = (
+                select(
+                    Message.id,
+                    Message.user_id,
+                    Message.room_id,
+                    Message.message,
+                    Message.timestamp,
+                    User.username,
+                )
+                .join(User, User.id == Message.user_id)
+                .where(Message.room_id == room_id)
+                .order_by(Message.id.desc())
+                .limit(limit)
             )
+            if before_id is not None:
+                stmt = stmt.where(Message.id < before_id)
+            if after_id is not None:
+                stmt = stmt.where(Message.id > after_id)
             result = await session.execute(stmt)
-            return result.scalars().all()
+            return result.all()
 
     async def get_users_in_room(self, room_id: int) -> Sequence[User]:
         async with self.async_session() as session:
@@ -157,6 +205,24 @@ class DbRepo:
             result = await session.scalars(stmt)
             return result.all()
 
+    async def stream_memberships(self, batch_size: int = 10_000) -> AsyncIterator[Sequence[Row]]:
+        # Одним запросом все комнаты с участниками; у пустых комнат id_user = None.
+        # Строки приходят пачками через серверный курсор, без ORM-обработки
+        async with self.async_engine.connect() as conn:
+            stmt = (
+                select(ChatRoom.id, Membership.id_user)
+                .outerjoin(Membership, Membership.id_room == ChatRoom.id)
+                .execution_options(yield_per=batch_size)
+            )
+            result = await conn.stream(stmt)
+            async for partition in result.partitions():
+                yield partition
+
+    async def add_membership(self, user_id: int, room_id: int):
+        async with self.async_session() as session:
+            await session.merge(Membership(id_user=user_id, id_room=room_id))
+            await session.commit()
+
     async def get_rooms(self) -> Sequence[ChatRoom]:
         async with self.async_session() as session:
             stmt = select(ChatRoom)
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+
+from db_model.db_repo import DbRepo
+from utils.logger import get_logger
+
+
+class MessageWriter:
+    # Write-behind для сообщений чата: очередь с ограничением (backpressure для
+    # отправителей) и сброс пачками - многострочный INSERT в одной транзакции,
+    # когда набралось batch_size строк или прошло flush_interval секунд
+
+    def __init__(self,
+                 db: DbRepo,
+                 batch_size: int,
+                 flush_interval: float,
+                 max_pending: int,
+                 retries: int = 3):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.flushed = 0
+        self.batches = 0
+        self._queue: asyncio.Queue[tuple[dict, asyncio.Future] | None] = asyncio.Queue(maxsize=max_pending)
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, user_id: int, room_id: int, message: str) -> asyncio.Future:
+        # Ждёт, только если очередь заполнена (БД не успевает);
+        # возвращает future с id сохранённого сообщения
+        if self._closing:
+            raise Exception("Сохранение сообщений остановлено")
+        row = {
+            "user_id": user_id,
+            "room_id": room_id,
+            "message": message,
+            "timestamp": datetime.datetime.now(),
+        }
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    item = self._queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except TimeoutError:
+                        break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[dict, asyncio.Future]]):
+        rows = [row for row, _ in batch]
+        for attempt in range(1, self.retries + 1):
+            try:
+                ids = await self.db.insert_messages(rows)
+                break
+            except Exception as e:
+                self.log.error("Не удалось сохранить %s сообщений (попытка %s): %s", len(rows), attempt, e)
+                if attempt == self.retries:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                            # ошибка уже в логе; ждать future не обязательно
+                            future.exception()
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        for (_, future), message_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(message_id)
+        self.flushed += len(rows)
+        self.batches += 1
+
+    async def close(self):
+        # Новые сообщения больше не принимаются, всё, что уже в очереди, сбрасывается в БД
+        if self._closing:
+            return
+        self._closing = True
+        if self._task:
+            await self._queue.put(None)
+            await self._task
+        batch = []
+        while not self._queue.empty():
+            if item := self._queue.get_nowait():
+                batch.append(item)
+        if batch:
+            await self._flush(batch)
+        self.log.info("Сохранение сообщений остановлено, записано %s в %s пачках", self.flushed, self.batches)
@@ -1,7 +1,7 @@
 import datetime
 from typing import List
 
-from sqlalchemy import ForeignKey, UniqueConstraint, engine
+from sqlalchemy import ForeignKey, UniqueConstraint, Index, engine
 from sqlalchemy.orm import Mapped, mapped_column, relationship, DeclarativeBase
 
 
@@ -77,6 +77,11 @@ class Message(Base):
     message: Mapped[str]
     timestamp: Mapped[datetime.datetime] = mapped_column(default=datetime.datetime.now)
 
+    # Для keyset-пагинации истории: WHERE room_id = ? AND id < ? ORDER BY id DESC
+    __table_args__ = (
+        Index('ix_messages_room_id_id', 'room_id', 'id'),
+    )
+
     user: Mapped[User] = relationship(
         back_populates='messages'
     )
@@ -1,27 +1,66 @@
 import asyncio
-import json
+import collections
+import itertools
 import threading
-from concurrent.futures.thread import ThreadPoolExecutor
+import time
 from queue import Queue
+from typing import Callable
 
-from action.schemas_message import Message, UpdateMessage, InitMessage, TokenMessage, END_MARKER, message_adapter, \
-    BaseMessage
-from server.server import Action
+from protocol.codec import Codec
+from protocol.framing import Framing, client_handshake, DEFAULT_MAX_FRAME_SIZE
+from protocol.actions import Action, HeartbeatAction, Command
+from protocol.messages import Message, UpdateMessage, InitMessage, TokenMessage, message_adapter, \
+    BaseMessage, HeartbeatMessage
 from gui_client.client_logger import get_logger
 
 SERVER_HOST = "192.168.3.38"
 SERVER_PORT = 8888
+# как часто клиент сам измеряет время до сервера и обратно, сек
+PING_INTERVAL = 15.0
 
 
 class AsyncConnector:
-    def __init__(self, out_q: Queue, in_q: Queue, loop: asyncio.AbstractEventLoop):
+    def __init__(self,
+                 in_q: Queue,
+                 loop: asyncio.AbstractEventLoop,
+                 notify: Callable[[], None] | None = None):
         self.reader: asyncio.StreamReader | None = None
         self.writer: asyncio.StreamWriter | None = None
-        self.out_q: Queue = out_q
+        self.framing: Framing | None = None
+        self.codec: Codec | None = None
         self.in_q: Queue = in_q
         self.loop = loop
+        # будит интерфейс после in_q.put - вместо опроса очереди по таймеру
+        self.notify = notify
         self.log = get_logger(self.__class__.__name__, to_file=True)
-        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Исходящие живут только в потоке loop: send() передаёт действие через
+        # call_soon_threadsafe, а отправитель забирает всё накопленное разом
+        # и пишет одним write
+        self._pending: collections.deque[Action] = collections.deque()
+        self._ready = asyncio.Event()
+        self._send_task: asyncio.Task | None = None
+        self._receiver_task: asyncio.Task | None = None
+        self._ping_task: asyncio.Task | None = None
+        self._nonce = itertools.count(1)
+        self._pings: dict[int, float] = {}
+        self.sent = 0
+        self.writes = 0
+        # последнее и сглаженное время до сервера и обратно, сек
+        self.rtt: float | None = None
+        self.rtt_avg: float | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "sent": self.sent,
+            "writes": self.writes,
+            "rtt_ms": None if self.rtt is None else round(self.rtt * 1e3, 1),
+            "rtt_avg_ms": None if self.rtt_avg is None else round(self.rtt_avg * 1e3, 1),
+        }
 
     def start(self):
         asyncio.run_coroutine_threadsafe(
@@ -29,39 +68,77 @@ class AsyncConnector:
             self.loop
         )
 
+    def send(self, action: Action):
+        # вызывается из потока интерфейса
+        self.loop.call_soon_threadsafe(self._enqueue, action)
+
+    def _enqueue(self, action: Action):
+        self._pending.append(action)
+        self._ready.set()
+
     async def _start(self):
         self.reader, self.writer = await asyncio.open_connection(SERVER_HOST, SERVER_PORT)
+        self.framing, self.codec = await client_handshake(self.reader, self.writer, DEFAULT_MAX_FRAME_SIZE)
         self._send_task = self.loop.create_task(self._sender())
         self._receiver_task = self.loop.create_task(self._receiver())
-        self.log.info(f"Подключен к серверу по адресу: {SERVER_HOST}:{SERVER_PORT}")
+        self._ping_task = self.loop.create_task(self._pinger())
+        self.log.info(f"Подключен к серверу по адресу: {SERVER_HOST}:{SERVER_PORT}, кодек {self.codec.name}")
 
     async def _sender(self):
         while True:
-            action: Action | None = await self.loop.run_in_executor(
-                self._executor,
-                self.out_q.get
-            )
-            if action is None:
-                break
-            self.log.info(f"Отправка {action}")
-            await action.send_action(writer=self.writer)
+            await self._ready.wait()
+            self._ready.clear()
+            # всё, что накопилось за время прошлого drain, уходит одним write
+            batch = list(self._pending)
+            self._pending.clear()
+            self.log.debug("Отправка %s действий: %s", len(batch), batch)
+            self.writer.write(b"".join(action._to_bytes(self.framing, self.codec) for action in batch))
+            self.sent += len(batch)
+            self.writes += 1
+            await self.writer.drain()
+
+    async def _pinger(self):
+        while True:
+            self.ping()
+            await asyncio.sleep(PING_INTERVAL)
+
+    def ping(self):
+        # RTT идёт через ту же очередь, что и действия пользователя
+        nonce = next(self._nonce)
+        self._pings[nonce] = time.perf_counter()
+        self._enqueue(HeartbeatAction(command=Command.HEARTBEAT, nonce=nonce))
+
+    def _pong(self, nonce: int):
+        sent = self._pings.pop(nonce, None)
+        if sent is None:
+            return
+        self.rtt = time.perf_counter() - sent
+        self.rtt_avg = self.rtt if self.rtt_avg is None else self.rtt_avg * 0.8 + self.rtt * 0.2
+        self.log.debug("RTT %.1f мс, в очереди %s", self.rtt * 1e3, self.queue_depth)
 
     async def _receiver(self):
         try:
             while True:
-                msg = await self.reader.readuntil(END_MARKER)
-                self.log.info(f"Пришло сообщение: {msg}")
-                data = msg.removesuffix(END_MARKER)
-                message: BaseMessage = message_adapter.validate_python(json.loads(data.decode()))
+                data = await self.framing.read(self.reader)
+                self.log.debug("Пришло сообщение: %s", data)
+                message: BaseMessage = message_adapter.validate_python(self.codec.loads(data))
+                if isinstance(message, HeartbeatMessage):
+                    # heartbeat обслуживается здесь же, интерфейсу он не нужен
+                    if message.reply:
+                        self._pong(message.nonce)
+                    else:
+                        self._enqueue(HeartbeatAction(command=Command.HEARTBEAT, nonce=message.nonce, reply=True))
+                    continue
                 self.in_q.put(message)
-        except (asyncio.CancelledError, ConnectionError) as e:
+                if self.notify:
+                    self.notify()
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError) as e:
             self.log.info(f"{str(e)}")
 
     def shutdown(self):
-        self.out_q.put(None)
-        self._receiver_task.cancel()
-        self._executor.shutdown(wait=False)
-        self._send_task.cancel()
+        for task in (self._receiver_task, self._send_task, self._ping_task):
+            if task:
+                task.cancel()
 
 
 class LoopThread(threading.Thread):
@@ -1,21 +1,30 @@
 import asyncio
-from datetime import datetime
 import json
 import os
+import threading
+import time
 import tkinter as tk
 from pathlib import Path
 from queue import Queue, Empty
 from tkinter import ttk
 
-from action.auth_token import decode_token
-from action.schemas_message import BaseMessage, TokenMessage, InitMessage, JoinChatMessage, UpdateMessage, Message
+from protocol.token import token_claims
+from protocol.messages import BaseMessage, TokenMessage, InitMessage, JoinChatMessage, UpdateMessage, Message, \
+    ErrorMessage, HistoryMessage, PresenceMessage, RoomBrief, UpdateKind, UserBrief
 from gui_client.async_connector import AsyncConnector
 from gui_client.client_logger import get_logger
-from server.server import Action
-from action.schemas import RegisterAction, JoinServerAction, Command, JoinUserAction, JoinChatAction, SendAction
+from gui_client.gui_tk.message_frame import MessageList
+from gui_client.gui_tk.sidebar import SidebarList
+from gui_client.history_cache import HistoryCache
+from protocol.actions import Action, RegisterAction, JoinServerAction, Command, JoinUserAction, JoinChatAction, \
+    SendAction, HistoryAction
 
 CFG_PATH = Path(os.getenv("ONLINECHAT_CFG", Path.home() / ".onlinechat/config.json"))
+DIRECTORY_PATH = CFG_PATH.parent / "directory.json"
 logger = get_logger('Интерфейс')
+# Сколько секунд за один заход интерфейс разбирает входящие сообщения:
+# остальное время кадра остаётся на ввод и перерисовку
+PUMP_BUDGET = float(os.getenv("ONLINECHAT_PUMP_BUDGET", 0.008))
 
 
 class AppConfig:
@@ -34,6 +43,61 @@ class AppConfig:
     def set(self, k, v): self.data[k] = v
 
 
+class DirectoryCache:
+    # Справочник пользователей и комнат между запусками: с версией из прошлого
+    # InitMessage сервер присылает только изменения (InitMessage.delta)
+    def __init__(self, path: Path = DIRECTORY_PATH):
+        self.path = path
+        self.user_id: int | None = None
+        self.version: str | None = None
+        self.users: dict[int, str] = {}
+        self.online: set[int] = set()
+        self.rooms: dict[int, RoomBrief] = {}
+        if path.exists():
+            data = json.loads(path.read_text())
+            self.user_id = data["user_id"]
+            self.version = data["version"]
+            self.users = {int(uid): name for uid, name in data["users"].items()}
+            self.online = set(data["online"])
+            self.rooms = {room["room_id"]: RoomBrief.model_validate(room) for room in data["rooms"]}
+
+    def version_for(self, user_id: int | None) -> str | None:
+        # комнаты в справочнике свои у каждого пользователя
+        return self.version if user_id is not None and user_id == self.user_id else None
+
+    def apply(self, msg: InitMessage):
+        if not msg.delta:
+            self.users, self.online, self.rooms = {}, set(), {}
+        self.users.update((user.id, user.username) for user in msg.all_users)
+        for user_id in msg.removed_users:
+            self.users.pop(user_id, None)
+            self.online.discard(user_id)
+        self.online.update(user.id for user in msg.online_users)
+        self.online.difference_update(user.id for user in msg.offline_users)
+        self.rooms.update((room.room_id, room) for room in msg.rooms)
+        self.user_id = msg.self_user["id"]
+        self.version = msg.directory_version
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps({
+            "user_id": self.user_id,
+            "version": self.version,
+            "users": self.users,
+            "online": sorted(self.online),
+            "rooms": [room.model_dump() for room in self.rooms.values()],
+        }))
+
+
+def user_text(username: str, online: bool) -> str:
+    return f"{username}-online" if online else username
+
+
+def room_text(title: str, users: list) -> str:
+    return f"{title}\nУчастников: {len(users)}"
+
+
 class MainFrame(ttk.Frame):
 
     def __init__(self, parent, loop: asyncio.AbstractEventLoop, in_q: Queue, out_q: Queue, controller: 'App', **kwargs):
@@ -47,11 +111,17 @@ class MainFrame(ttk.Frame):
         self.label = tk.Label(self, text="OnlineChat-mainFrame")
         self.label.pack(side="top", fill="x")
 
-        self.side_bar = ttk.Frame(self, borderwidth=2, relief="ridge")
-        self.side_bar.pack(side="left", fill="x")
+        # ── пользователи и комнаты: модели по id в виртуальных списках ──
+        self.side_bar = SidebarList(
+            self,
+            on_click=lambda u_id: self.controller.send_action(self.create_join_user_action(u_id)),
+            borderwidth=2, relief="ridge",
+        )
+        self.side_bar.pack(side="left", fill="y")
 
-        self.side_bar_2 = ttk.Frame(self, borderwidth=2, relief="ridge")
-        self.side_bar_2.pack(side="left", fill="x")
+        self.side_bar_2 = SidebarList(self, on_click=self.create_join_chat_action, lines=2,
+                                      borderwidth=2, relief="ridge")
+        self.side_bar_2.pack(side="left", fill="y")
 
         self.main_frame = ttk.Frame(self, borderwidth=2, relief="ridge")
         self.main_frame.pack(side="left", fill="x", padx=10)
@@ -62,95 +132,100 @@ class MainFrame(ttk.Frame):
             "<Return>",
             self.send_message
         )
-        # ── создаём Canvas и Scrollbar ──
-        self.canvas = tk.Canvas(self.main_frame, borderwidth=0, highlightthickness=0)
-        self.vsb = tk.Scrollbar(self.main_frame, orient="vertical", command=self.canvas.yview)
-        self.canvas.configure(yscrollcommand=self.vsb.set)
-
-        self.vsb.pack(side="right", fill="y")
-        self.canvas.pack(side="left", fill="both", expand=True)
-
-        # ── внутренний фрейм для сообщений ──
-        self.msg_container = ttk.Frame(self.canvas)
-        self.container_id = self.canvas.create_window(
-            (0, 0), window=self.msg_container, anchor="nw"
-        )
-
-        # ── обновление scrollregion при изменении содержимого ──
-        def on_frame_configure(event):
-            self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        # ── подгрузка более старых сообщений по запросу ──
+        self.older_button = ttk.Button(self.main_frame, text="Загрузить более ранние", command=self.load_older)
 
-        self.msg_container.bind("<Configure>", on_frame_configure)
+        # ── виртуальный список сообщений ──
+        self.message_list = MessageList(self.main_frame, is_own=lambda m: m.from_ == self.controller.user_id)
+        self.message_list.pack(side="top", fill="both", expand=True)
 
         # ── флаг текущей комнаты ──
 
-        self.chats = []
-        self.users: list[ttk.Label] = []
-
-    def init_process(self, msg: InitMessage):
-        online_id = [u.id for u in msg.online_users]
-        for child in self.side_bar.winfo_children():
-            child.destroy()
-        for child in self.side_bar_2.winfo_children():
-            child.destroy()
-
-        for user in msg.all_users:
-            text = user.username + '-online' if user.id in online_id else user.username
-            label = ttk.Label(self.side_bar, text=text)
-            label.pack(side="top", fill="x")
-            label.bind(
-                "<Button-1>",
-                lambda e, u_id=user.id: self.controller.send_action(self.create_join_user_action(u_id))
-            )
-            label.user_id = user.id
-            self.users.append(label)
-
-        for chat in msg.rooms:
-            text = f"{chat.title}\nУчастников: {len(chat.users)}"
-            label = ttk.Label(self.side_bar_2, text=text)
-            label.pack(side="top", fill="x", padx=5)
-            label.bind(
-                "<Button-1>",
-                lambda e, chat_id=chat.room_id: self.create_join_chat_action(chat_id)
-            )
-            label.chat_id = chat.room_id
-            self.chats.append(label)
+        self.has_more = False
+
+    @property
+    def messages(self) -> list[Message]:
+        return self.message_list.messages
+
+    def init_process(self, directory: DirectoryCache):
+        self.side_bar.set_items(
+            (user_id, user_text(username, user_id in directory.online))
+            for user_id, username in directory.users.items()
+        )
+        self.side_bar_2.set_items((room.room_id, room_text(room.title, room.users)) for room in directory.rooms.values())
 
     def create_join_chat_action(self, room_id):
         if self.controller.room_id == room_id:
             return
-        else:
-            self.controller.send_action(
-                JoinChatAction(
-                    command=Command.JOIN_CHAT,
-                    room=room_id,
-                    token=self.controller.token,
-                )
+        after_id = None
+        if cache := self.controller.history_cache:
+            # сразу показываем то, что уже есть локально, у сервера - только новое
+            self.controller.room_id = room_id
+            self.show_messages(cache.messages(room_id), cache.has_more(room_id))
+            after_id = cache.last_id(room_id)
+        self.controller.send_action(
+            JoinChatAction(
+                command=Command.JOIN_CHAT,
+                room=room_id,
+                token=self.controller.token,
+                after_id=after_id,
             )
+        )
 
     def open_chat(self, msg: JoinChatMessage):
-        self.controller.room_id = msg.messages[0].room_id
-        messages = sorted(msg.messages, key=lambda m: m.time_)
-        for child in self.msg_container.winfo_children():
-            child.destroy()
-        for m in messages:
-            bubble = ttk.Frame(self.msg_container)
-            bubble.pack(fill="x", pady=2, padx=5)
-
-            text = f"{m.content}\n[{datetime.fromtimestamp(m.time_).strftime('%H:%M:%S')}]"
-            lbl = ttk.Label(bubble, text=text, wraplength=300, justify="left",
-                            background="#e1ffc7" if m.from_ == self.controller.user_id else "#ffffff",
-                            relief="ridge", padding=5)
-
-            if m.from_ == self.controller.user_id:
-                # свои сообщения справа
-                lbl.pack(side="right", anchor="e", padx=(50, 0))
-            else:
-                # чужие слева
-                lbl.pack(side="left", anchor="w", padx=(0, 50))
-
-            # прокрутить вниз
-            self.canvas.yview_moveto(1.0)
+        room_id = msg.room_id if msg.room_id is not None else msg.messages[0].room_id
+        cache = self.controller.history_cache
+        if cache is None:
+            messages, has_more = sorted(msg.messages, key=lambda m: m.time_), msg.has_more
+        else:
+            if msg.after_id is None or msg.has_more:
+                # в кэше ничего не было или между ним и новой страницей разрыв - начинаем заново
+                cache.reset(room_id)
+                cache.set_has_more(room_id, msg.has_more)
+            cache.store(room_id, msg.messages)
+            # страница JoinChatMessage идёт без пропусков от after_id (или это
+            # последние сообщения комнаты после reset) - до её конца кэш полный
+            ids = [m.id for m in msg.messages if m.id is not None]
+            cache.set_synced(room_id, max(ids, default=msg.after_id or 0))
+            messages, has_more = cache.messages(room_id), cache.has_more(room_id)
+        # сообщения из живой рассылки (без id), которых ещё нет в истории, оставляем
+        if self.controller.room_id == room_id:
+            fresh = {(m.from_, m.content) for m in msg.messages}
+            messages += [m for m in self.messages if m.id is None and (m.from_, m.content) not in fresh]
+        self.controller.room_id = room_id
+        self.show_messages(messages, has_more)
+
+    def show_messages(self, messages: list[Message], has_more: bool):
+        self.set_has_more(has_more)
+        self.message_list.set_messages(messages)
+
+    def load_older(self):
+        if not self.messages or self.messages[0].id is None:
+            return
+        self.controller.send_action(
+            HistoryAction(
+                command=Command.HISTORY,
+                room=self.controller.room_id,
+                before_id=self.messages[0].id,
+                token=self.controller.token,
+            )
+        )
+
+    def prepend_history(self, msg: HistoryMessage):
+        if cache := self.controller.history_cache:
+            cache.store(msg.room_id, msg.messages)
+            cache.set_has_more(msg.room_id, msg.has_more)
+        if self.controller.room_id != msg.room_id:
+            return
+        self.set_has_more(msg.has_more)
+        self.message_list.prepend(msg.messages)
+
+    def set_has_more(self, has_more: bool):
+        self.has_more = has_more
+        if has_more:
+            self.older_button.pack(side="top", fill="x", before=self.message_list)
+        else:
+            self.older_button.pack_forget()
 
     def create_join_user_action(self, user_id):
         return JoinUserAction(
@@ -159,32 +234,24 @@ class MainFrame(ttk.Frame):
             token=self.controller.token
         )
 
+    def proc_presence_msg(self, msg: PresenceMessage):
+        for user in msg.online:
+            self.side_bar.upsert(user.id, user_text(user.username, True))
+        for user in msg.offline:
+            self.side_bar.upsert(user.id, user_text(user.username, False))
+
     def proc_update_msg(self, msg: UpdateMessage):
         match msg.kind:
             case "user_online":
-                for user_label in self.users:
-                    if user_label.user_id == msg.payload['id']:
-                        user_label.config(text=f"{msg.payload['username']}-online")
+                self.side_bar.upsert(msg.payload['id'], user_text(msg.payload['username'], True))
 
             case "user_offline":
-                for user_label in self.users:
-                    if user_label.user_id == msg.payload['id']:
-                        user_label.config(text=f"{msg.payload['username']}")
+                self.side_bar.upsert(msg.payload['id'], user_text(msg.payload['username'], False))
 
             case "new_room":
-                if self.controller.user_id in msg.payload['users']:
-                    title = msg.payload['title']
-                    room_id = msg.payload['id']
-                    users = msg.payload['users']
-                    text = f"{title}\nУчастников: {len(users)}"
-                    label = ttk.Label(self.side_bar_2, text=text)
-                    label.pack(side="top", fill="x", padx=5)
-                    label.bind(
-                        "<Button-1>",
-                        lambda e, chat_id=room_id: self.create_join_chat_action(chat_id)
-                    )
-                    label.chat_id = room_id
-                    self.chats.append(label)
+                # users - список UserBrief в виде словарей, не id
+                if any(u['id'] == self.controller.user_id for u in msg.payload['users']):
+                    self.side_bar_2.upsert(msg.payload['id'], room_text(msg.payload['title'], msg.payload['users']))
 
             case 'update_room':
                 pass
@@ -203,23 +270,7 @@ class MainFrame(ttk.Frame):
 
     def new_message(self, m: Message):
         if self.controller.room_id == m.room_id:
-            bubble = ttk.Frame(self.msg_container)
-            bubble.pack(fill="x", pady=2, padx=5)
-
-            text = f"{m.content}\n[{datetime.fromtimestamp(m.time_).strftime('%H:%M:%S')}]"
-            lbl = ttk.Label(bubble, text=text, wraplength=300, justify="left",
-                            background="#e1ffc7" if m.from_ == self.controller.user_id else "#ffffff",
-                            relief="ridge", padding=5)
-
-            if m.from_ == self.controller.user_id:
-                # свои сообщения справа
-                lbl.pack(side="right", anchor="e", padx=(50, 0))
-            else:
-                # чужие слева
-                lbl.pack(side="left", anchor="w", padx=(0, 50))
-
-            # прокрутить вниз
-            self.canvas.yview_moveto(1.0)
+            self.message_list.append(m)
 
 
 
@@ -283,9 +334,18 @@ class App(tk.Tk):
         self.loop = loop
 
 
-        self.async_connector = AsyncConnector(loop=self.loop, in_q=self.in_q, out_q=self.out_q)
+        # входящие будят интерфейс виртуальным событием; флаг не даёт
+        # ставить событие на каждое сообщение, пока прошлое не разобрано
+        self._wakeup = threading.Event()
+        # event_generate из чужого потока до mainloop (и после него) не ставит
+        # событие, а ждёт около секунды и бросает RuntimeError - поток asyncio
+        # стоял бы всё это время. Пока mainloop не запущен, будить не нужно:
+        # пришедшее разберёт pump из after_idle
+        self._mainloop_running = False
+        self.bind("<<InQueue>>", lambda e: self.pump())
+        self.async_connector = AsyncConnector(loop=self.loop, in_q=self.in_q, notify=self.wake)
         self.async_connector.start()
-        self.after(50, self.poll_in)
+        self.after_idle(self._mainloop_started)
 
         self.frames: dict[str, ttk.Frame] = {}
         self.container = ttk.Frame(self);
@@ -299,12 +359,17 @@ class App(tk.Tk):
         self.username = None
         self.user_id = None
         self.cfg = AppConfig()
+        self.directory = DirectoryCache()
+        self.history_cache: HistoryCache | None = None
+        self.history_cache_path: Path | None = None
         if token := self.cfg.get('token'):
             logger.info(f"Есть {token}")
             self.token = token
-            self.send_action(
-                JoinServerAction(command=Command.JOIN_SERVER, token=token)
-            )
+            self.send_action(JoinServerAction(
+                command=Command.JOIN_SERVER,
+                token=token,
+                directory_version=self.directory.version_for(self.cfg.get('id')),
+            ))
         else:
             self.show_page('RegisterFrame')
 
@@ -312,17 +377,59 @@ class App(tk.Tk):
         self.room_id: int | None = None
 
     def send_action(self, action: Action):
-        self.out_q.put(action)
+        self.async_connector.send(action)
+
+    def _mainloop_started(self):
+        # after_idle выполняется уже внутри mainloop; флаг ставится до pump,
+        # поэтому сообщение не потеряется между проверкой флага в wake и разбором
+        self._mainloop_running = True
+        self.pump()
 
-    def poll_in(self):
+    def wake(self):
+        # вызывается из потока asyncio
+        if self._wakeup.is_set():
+            return
+        self._wakeup.set()
+        if not self._mainloop_running:
+            return
         try:
-            while True:
-                msg: BaseMessage = self.in_q.get_nowait()
-                logger.info(f"Прочитано сообщение интерфейсом: {msg}")
-                self.process_msg(msg)
-        except Empty:
+            self.event_generate("<<InQueue>>", when="tail")
+        except (RuntimeError, tk.TclError):
+            # окно закрывается - разбирать очередь уже некому
             pass
-        self.after(20, self.poll_in)
+
+    def pump(self):
+        # Разбор in_q в пределах PUMP_BUDGET. Присутствие за пачку схлопывается:
+        # для каждого пользователя применяется только последнее состояние
+        self._wakeup.clear()
+        deadline = time.perf_counter() + PUMP_BUDGET
+        presence: dict[int, tuple[str, bool]] = {}
+        while time.perf_counter() < deadline:
+            try:
+                msg: BaseMessage = self.in_q.get_nowait()
+            except Empty:
+                break
+            logger.debug("Прочитано сообщение интерфейсом: %s", msg)
+            match msg:
+                case PresenceMessage():
+                    presence.update((user.id, (user.username, True)) for user in msg.online)
+                    presence.update((user.id, (user.username, False)) for user in msg.offline)
+                case UpdateMessage(kind=UpdateKind.user_online | UpdateKind.user_offline):
+                    presence[msg.payload['id']] = (msg.payload['username'], msg.kind == UpdateKind.user_online)
+                case InitMessage():
+                    # снимок справочника новее накопленного присутствия
+                    presence.clear()
+                    self.process_msg(msg)
+                case _:
+                    self.process_msg(msg)
+        if presence:
+            self.proc_presence_msg(PresenceMessage(
+                online=[UserBrief(id=uid, username=name) for uid, (name, online) in presence.items() if online],
+                offline=[UserBrief(id=uid, username=name) for uid, (name, online) in presence.items() if not online],
+            ))
+        if not self.in_q.empty():
+            # бюджет кончился: продолжим после обработки ввода и перерисовки
+            self.after(1, self.pump)
 
     def show_page(self, name):
         page = self.frames[name]
@@ -336,14 +443,20 @@ class App(tk.Tk):
                 self.proc_init_msg(msg)
             case UpdateMessage():
                 self.proc_update_msg(msg)
+            case PresenceMessage():
+                self.proc_presence_msg(msg)
             case JoinChatMessage():
                 self.join_chat(msg)
+            case HistoryMessage():
+                self.history(msg)
             case Message():
                 self.new_message(msg)
+            case ErrorMessage():
+                logger.error(f"Ошибка сервера: {msg.content}")
 
     def proc_token_msg(self, msg: TokenMessage):
         self.token = msg.content
-        payload = decode_token(self.token)
+        payload = token_claims(self.token)
         self.username = payload.get("username")
         self.user_id = payload.get("id")
         self.cfg.set('token', self.token)
@@ -355,25 +468,48 @@ class App(tk.Tk):
         self.show_page('MainFrame')
         self.username = msg.self_user["username"]
         self.user_id = msg.self_user["id"]
+        self.open_history_cache(self.user_id)
+        self.directory.apply(msg)
         main_frame: MainFrame = self.frames['MainFrame']
-        main_frame.init_process(msg)
+        main_frame.init_process(self.directory)
 
 
+    def open_history_cache(self, user_id: int):
+        # у каждого пользователя свой файл: состав комнат у всех разный
+        path = CFG_PATH.parent / f"history-{user_id}.sqlite3"
+        if self.history_cache and self.history_cache_path == path:
+            return
+        if self.history_cache:
+            self.history_cache.close()
+        self.history_cache = HistoryCache(path)
+        self.history_cache_path = path
+
     def proc_update_msg(self, msg: UpdateMessage):
         main_frame: MainFrame = self.frames['MainFrame']
         main_frame.proc_update_msg(msg)
 
+    def proc_presence_msg(self, msg: PresenceMessage):
+        main_frame: MainFrame = self.frames['MainFrame']
+        main_frame.proc_presence_msg(msg)
+
     def join_chat(self, msg: JoinChatMessage):
         main_frame: MainFrame = self.frames['MainFrame']
         main_frame.open_chat(msg)
 
+    def history(self, msg: HistoryMessage):
+        main_frame: MainFrame = self.frames['MainFrame']
+        main_frame.prepend_history(msg)
+
     def new_message(self, msg: Message):
         main_frame: MainFrame = self.frames['MainFrame']
         main_frame.new_message(msg)
 
 
     def destroy(self):
+        self._mainloop_running = False
         if self.loop.is_running():
             self.loop.call_soon_threadsafe(self.async_connector.shutdown)
             self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.history_cache:
+            self.history_cache.close()
         super().destroy()
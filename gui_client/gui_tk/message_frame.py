@@ -1,6 +1,208 @@
+import bisect
+import math
+import tkinter.font as tkfont
 import tkinter.ttk as ttk
 import tkinter as tk
+from datetime import datetime
+from typing import Callable
 
+from protocol.messages import Message
 
 
+class MessageRow:
+    # Пузырь сообщения на Canvas: прямоугольник и текст. Строки переиспользуются
+    # при прокрутке - меняются только текст и координаты
+    __slots__ = ("rect", "text", "index")
 
+    def __init__(self, rect: int, text: int):
+        self.rect = rect
+        self.text = text
+        self.index: int | None = None
+
+
+class MessageList(ttk.Frame):
+    # Виртуальный список сообщений: на Canvas существуют только пузыри видимого
+    # окна плюс запас в один экран сверху и снизу, остальные сообщения - это
+    # только высота в self.heights. Высота сначала оценивается по длине текста,
+    # а при первом показе уточняется по bbox. Новое сообщение в конце не
+    # перекладывает весь список: добавляется одна высота и перерисовывается окно
+    PAD = 5
+    GAP = 2
+    MARGIN_X = 5
+    INDENT = 50
+    OWN_COLOR = "#e1ffc7"
+    OTHER_COLOR = "#ffffff"
+
+    def __init__(self, parent, is_own: Callable[[Message], bool], wraplength: int = 300, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.is_own = is_own
+        self.wraplength = wraplength
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.line_height = self.font.metrics("linespace")
+        self.char_width = max(1, self.font.measure("абвгдеabcdef0123") // 16)
+
+        self.canvas = tk.Canvas(self, borderwidth=0, highlightthickness=0)
+        self.vsb = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.on_scroll)
+        self.vsb.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+        self.canvas.configure(yscrollincrement=self.line_height)
+
+        self.messages: list[Message] = []
+        # высота каждого пузыря и смещение его верха; offsets[-1] - высота всего списка
+        self.heights: list[int] = []
+        self.offsets: list[int] = [0]
+        self.measured: list[bool] = []
+        self.rows: list[MessageRow] = []
+        self.shown: dict[int, MessageRow] = {}
+
+    # ── данные ──
+
+    def set_messages(self, messages: list[Message]):
+        self.messages = messages
+        self.heights = [self.estimate(m) for m in messages]
+        self.measured = [False] * len(messages)
+        self.reflow(0)
+        self.hide_rows()
+        self.scroll_to(1.0)
+
+    def append(self, m: Message):
+        stick = self.at_bottom()
+        self.messages.append(m)
+        self.heights.append(self.estimate(m))
+        self.measured.append(False)
+        self.offsets.append(self.offsets[-1] + self.heights[-1])
+        self.update_region()
+        if stick:
+            self.scroll_to(1.0)
+        else:
+            self.refresh()
+
+    def prepend(self, messages: list[Message]):
+        self.messages[:0] = messages
+        self.heights[:0] = [self.estimate(m) for m in messages]
+        self.measured[:0] = [False] * len(messages)
+        self.reflow(0)
+        # индексы сдвинулись - строки перепривязываются заново
+        self.hide_rows()
+        self.scroll_to(0.0)
+
+    # ── геометрия ──
+
+    def text_for(self, m: Message) -> str:
+        return f"{m.content}\n[{datetime.fromtimestamp(m.time_).strftime('%H:%M:%S')}]"
+
+    def estimate(self, m: Message) -> int:
+        # Оценка без обращения к Tk: строки текста с переносом по средней ширине символа
+        per_line = max(1, self.wraplength // self.char_width)
+        lines = 1 + sum(max(1, math.ceil(len(line) / per_line)) for line in m.content.split("\n"))
+        return lines * self.line_height + 2 * (self.PAD + self.GAP)
+
+    def reflow(self, start: int):
+        # Пересчёт смещений начиная с start
+        del self.offsets[start + 1:]
+        offset = self.offsets[start]
+        for height in self.heights[start:]:
+            offset += height
+            self.offsets.append(offset)
+        self.update_region()
+
+    def update_region(self):
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self.offsets[-1]))
+
+    def at_bottom(self) -> bool:
+        return self.canvas.yview()[1] >= 0.999
+
+    def scroll_to(self, fraction: float):
+        self.canvas.yview_moveto(fraction)
+        self.refresh()
+
+    def on_scroll(self, first, last):
+        self.vsb.set(first, last)
+        self.refresh()
+
+    # ── отрисовка окна ──
+
+    def refresh(self):
+        if not self.messages:
+            self.hide_rows()
+            return
+        view_height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0)
+        stick = self.at_bottom()
+        first = max(0, bisect.bisect_right(self.offsets, top - view_height) - 1)
+        last = min(len(self.messages), bisect.bisect_left(self.offsets, top + 2 * view_height))
+
+        # строки, ушедшие из окна, освобождаются для переиспользования
+        for index in [i for i in self.shown if not first <= i < last]:
+            row = self.shown.pop(index)
+            row.index = None
+            self.canvas.itemconfigure(row.rect, state="hidden")
+            self.canvas.itemconfigure(row.text, state="hidden")
+        free = [row for row in self.rows if row.index is None]
+
+        changed = None
+        shift = 0
+        for index in range(first, last):
+            row = self.shown.get(index)
+            if row is None:
+                row = free.pop() if free else self.new_row()
+                row.index = index
+                self.shown[index] = row
+                height = self.fill(row, self.messages[index])
+                if not self.measured[index]:
+                    self.measured[index] = True
+                    if height != self.heights[index]:
+                        if self.offsets[index + 1] <= top:
+                            shift += height - self.heights[index]
+                        self.heights[index] = height
+                        changed = index if changed is None else min(changed, index)
+        if changed is not None:
+            # точные высоты отличаются от оценки: сдвигаем хвост, а вид держим на месте
+            self.reflow(changed)
+            if stick or shift:
+                self.canvas.yview_moveto(1.0 if stick else (top + shift) / (self.offsets[-1] or 1))
+        for index, row in self.shown.items():
+            self.place(row, index)
+
+    def new_row(self) -> MessageRow:
+        rect = self.canvas.create_rectangle(0, 0, 0, 0, outline="#b0b0b0", state="hidden")
+        text = self.canvas.create_text(0, 0, anchor="nw", width=self.wraplength, justify="left",
+                                       font=self.font, state="hidden")
+        row = MessageRow(rect, text)
+        self.rows.append(row)
+        return row
+
+    def fill(self, row: MessageRow, m: Message) -> int:
+        # Текст и цвет строки; возвращает точную высоту пузыря
+        self.canvas.itemconfigure(row.text, text=self.text_for(m), state="normal")
+        self.canvas.itemconfigure(row.rect, fill=self.OWN_COLOR if self.is_own(m) else self.OTHER_COLOR,
+                                  state="normal")
+        x1, y1, x2, y2 = self.canvas.bbox(row.text)
+        return (y2 - y1) + 2 * (self.PAD + self.GAP)
+
+    def place(self, row: MessageRow, index: int):
+        x1, y1, x2, y2 = self.canvas.bbox(row.text)
+        width = x2 - x1
+        top = self.offsets[index] + self.GAP
+        if self.is_own(self.messages[index]):
+            # свои сообщения справа
+            left = max(self.INDENT, self.canvas.winfo_width() - self.MARGIN_X - width - 2 * self.PAD)
+        else:
+            # чужие слева
+            left = self.MARGIN_X
+        self.canvas.coords(row.text, left + self.PAD, top + self.PAD)
+        self.canvas.coords(row.rect, left, top, left + width + 2 * self.PAD,
+                           self.offsets[index + 1] - self.GAP)
+
+    def hide_rows(self):
+        for row in self.shown.values():
+            row.index = None
+            self.canvas.itemconfigure(row.rect, state="hidden")
+            self.canvas.itemconfigure(row.text, state="hidden")
+        self.shown.clear()
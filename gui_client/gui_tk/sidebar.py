@@ -0,0 +1,91 @@
+import tkinter.font as tkfont
+import tkinter.ttk as ttk
+import tkinter as tk
+from typing import Callable, Iterable
+
+
+class SidebarList(ttk.Frame):
+    # Список пользователей или комнат: строки одной высоты, поэтому видимое окно
+    # считается делением, а на Canvas есть только текст видимых строк.
+    # texts - модель по id, position - место id в списке: изменение строки O(1),
+    # новая строка добавляется в конец без пересборки остальных
+    PAD = 4
+
+    def __init__(self, parent, on_click: Callable[[int], None], lines: int = 1, width: int = 160, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.on_click = on_click
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.row_height = lines * self.font.metrics("linespace") + 2 * self.PAD
+
+        self.canvas = tk.Canvas(self, width=width, borderwidth=0, highlightthickness=0)
+        self.vsb = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.on_scroll, yscrollincrement=self.row_height)
+        self.vsb.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<Button-1>", self.click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+        self.texts: dict[int, str] = {}
+        self.order: list[int] = []
+        self.position: dict[int, int] = {}
+        # текстовые элементы Canvas для видимых строк и какой id в каждом сейчас
+        self.rows: list[int] = []
+        self.row_keys: list[int | None] = []
+        self.first = 0
+
+    def set_items(self, items: Iterable[tuple[int, str]]):
+        self.texts = dict(items)
+        self.order = list(self.texts)
+        self.position = {key: i for i, key in enumerate(self.order)}
+        self.row_keys = [None] * len(self.rows)
+        self.update_region()
+        self.canvas.yview_moveto(0.0)
+        self.refresh()
+
+    def upsert(self, key: int, text: str):
+        if key not in self.position:
+            self.position[key] = len(self.order)
+            self.order.append(key)
+            self.texts[key] = text
+            self.update_region()
+            self.refresh()
+        elif self.texts[key] != text:
+            self.texts[key] = text
+            # строка не видна - хватит модели, Canvas не трогаем
+            slot = self.position[key] - self.first
+            if 0 <= slot < len(self.rows) and self.row_keys[slot] == key:
+                self.canvas.itemconfigure(self.rows[slot], text=text)
+
+    def update_region(self):
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), len(self.order) * self.row_height))
+
+    def on_scroll(self, first, last):
+        self.vsb.set(first, last)
+        self.refresh()
+
+    def refresh(self):
+        self.first = int(self.canvas.canvasy(0) // self.row_height)
+        count = min(self.canvas.winfo_height() // self.row_height + 2, max(0, len(self.order) - self.first))
+        while len(self.rows) < count:
+            self.rows.append(self.canvas.create_text(self.PAD, 0, anchor="nw", font=self.font, state="hidden"))
+            self.row_keys.append(None)
+        for slot, item in enumerate(self.rows):
+            if slot >= count:
+                if self.row_keys[slot] is not None:
+                    self.row_keys[slot] = None
+                    self.canvas.itemconfigure(item, state="hidden")
+                continue
+            key = self.order[self.first + slot]
+            self.canvas.coords(item, self.PAD, (self.first + slot) * self.row_height + self.PAD)
+            if self.row_keys[slot] != key:
+                self.row_keys[slot] = key
+                self.canvas.itemconfigure(item, text=self.texts[key], state="normal")
+
+    def click(self, e: tk.Event):
+        index = int(self.canvas.canvasy(e.y) // self.row_height)
+        if 0 <= index < len(self.order):
+            self.on_click(self.order[index])
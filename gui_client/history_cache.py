@@ -0,0 +1,89 @@
+import sqlite3
+from pathlib import Path
+
+from protocol.messages import Message, TypeMessage
+
+
+class HistoryCache:
+    # Локальная история чатов в SQLite: сообщения по (комната, id).
+    # Чат открывается сразу из кэша, а у сервера запрашиваются только сообщения
+    # новее synced.last_id - id, до которого кэш совпадает с сервером без пропусков.
+    # Это не max(id): сообщение, попавшее в кэш в обход синхронизации, не должно
+    # скрыть пропущенные до него. rooms.has_more - есть ли на сервере
+    # сообщения старше самого старого закэшированного
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                room_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                from_id INTEGER NOT NULL,
+                from_username TEXT NOT NULL,
+                content TEXT NOT NULL,
+                time REAL NOT NULL,
+                PRIMARY KEY (room_id, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rooms (
+                room_id INTEGER PRIMARY KEY,
+                has_more INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS synced (
+                room_id INTEGER PRIMARY KEY,
+                last_id INTEGER NOT NULL
+            );
+        """)
+
+    def last_id(self, room_id: int) -> int | None:
+        # None - комната ещё не синхронизировалась, нужна полная загрузка
+        row = self.db.execute("SELECT last_id FROM synced WHERE room_id = ?", (room_id,)).fetchone()
+        return row and row[0]
+
+    def set_synced(self, room_id: int, last_id: int):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO synced VALUES (?, ?)", (room_id, last_id))
+
+    def messages(self, room_id: int) -> list[Message]:
+        rows = self.db.execute(
+            "SELECT id, from_id, from_username, content, time FROM messages WHERE room_id = ? ORDER BY id",
+            (room_id,),
+        )
+        return [
+            Message(
+                type=TypeMessage.message,
+                id=message_id,
+                from_=from_id,
+                from_username=from_username,
+                room_id=room_id,
+                content=content,
+                time_=time_,
+            )
+            for message_id, from_id, from_username, content, time_ in rows
+        ]
+
+    def store(self, room_id: int, messages: list[Message]):
+        # сообщения из живой рассылки приходят без id - их кэш получит при следующей синхронизации
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                [(room_id, m.id, m.from_, m.from_username, m.content, m.time_) for m in messages if m.id is not None],
+            )
+
+    def has_more(self, room_id: int) -> bool:
+        row = self.db.execute("SELECT has_more FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+        return bool(row and row[0])
+
+    def set_has_more(self, room_id: int, has_more: bool):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO rooms VALUES (?, ?)", (room_id, int(has_more)))
+
+    def reset(self, room_id: int):
+        with self.db:
+            self.db.execute("DELETE FROM messages WHERE room_id = ?", (room_id,))
+            self.db.execute("DELETE FROM rooms WHERE room_id = ?", (room_id,))
+            self.db.execute("DELETE FROM synced WHERE room_id = ?", (room_id,))
+
+    def close(self):
+        self.db.close()
@@ -1,8 +1,51 @@
+import argparse
 import asyncio
+import multiprocessing
+import signal
+import socket
 
+from config import Config
 from server.server import main
 
 
+def run(host: str, port: int, worker_id: int = 0, workers: int = 1, node: str | None = None):
+    try:
+        asyncio.run(main(host, port, worker_id, workers, node))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Сервер чата")
+    parser.add_argument("--host", default=Config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=Config.WORKERS,
+                        help="число процессов, слушающих один порт через SO_REUSEPORT")
+    parser.add_argument("--node", default=Config.CLUSTER_NODE,
+                        help="имя узла кластера из CLUSTER_NODES")
+    args = parser.parse_args()
+
+    if args.node:
+        run(args.host, args.port, node=args.node)
+    elif args.workers <= 1:
+        run(args.host, args.port)
+    else:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise Exception("Режим нескольких воркеров требует SO_REUSEPORT (Linux/BSD)")
+        # SIGTERM в запускающем процессе - как Ctrl+C: он передаёт SIGTERM воркерам
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        # Ядро само распределяет новые соединения между воркерами
+        processes = [
+            multiprocessing.Process(target=run, args=(args.host, args.port, i, args.workers))
+            for i in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
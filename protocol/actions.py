@@ -0,0 +1,122 @@
+import asyncio
+from enum import Enum
+from typing import Optional, Literal
+
+from pydantic import BaseModel
+
+from protocol.codec import Codec, JSON_CODEC
+from protocol.framing import Framing, MARKER_FRAMING
+
+
+class Command(str, Enum):
+    JOIN_CHAT = 'JOIN_CHAT'
+    JOIN_GROUP = 'JOIN_GROUP'
+    JOIN_USER = 'JOIN_USER'
+    SEND = 'SEND'
+    LEAVE = 'LEAVE'
+    JOIN_SERVER = 'JOIN_SERVER'
+    REGISTER = 'REGISTER'
+    AUTHORIZE = 'AUTHORIZE'
+    HISTORY = 'HISTORY'
+    HEARTBEAT = 'HEARTBEAT'
+    STATS = 'STATS'
+
+
+class BaseAction(BaseModel):
+    # Действие клиента в том виде, в каком оно идёт по сети. Обработчики
+    # (run) - в action.schemas у серверных наследников этих классов
+    token: str
+    command: Command
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.model_dump()}>'
+
+    def _payload(self, codec: Codec = JSON_CODEC) -> bytes:
+        return codec.dumps(self.model_dump(mode="json"))
+
+    def _to_bytes(self, framing: Framing = MARKER_FRAMING, codec: Codec = JSON_CODEC) -> bytes:
+        return framing.pack(self._payload(codec))
+
+    async def send_action(self,
+                          writer: 'asyncio.StreamWriter',
+                          framing: Framing = MARKER_FRAMING,
+                          codec: Codec = JSON_CODEC):
+        writer.write(self._to_bytes(framing, codec))
+        await writer.drain()
+
+
+# то, что клиент может отправить
+Action = BaseAction
+
+
+class RegisterAction(BaseAction):
+    command: Literal[Command.REGISTER]
+    username: str
+    password: str
+    token: Optional[str] = None
+
+
+class AuthorizeAction(BaseAction):
+    command: Literal[Command.AUTHORIZE]
+    username: str
+    password: str
+    token: Optional[str] = None
+
+
+class JoinServerAction(BaseAction):
+    command: Literal[Command.JOIN_SERVER]
+    # версия справочника из прошлого InitMessage: тогда придут только изменения
+    directory_version: Optional[str] = None
+
+
+class JoinChatAction(BaseAction):
+    command: Literal[Command.JOIN_CHAT]
+    room: int
+    message: Optional[str] = None
+    # последний id из локального кэша клиента: тогда придут только более новые сообщения
+    after_id: Optional[int] = None
+
+
+class JoinGroupAction(BaseAction):
+    command: Literal[Command.JOIN_GROUP]
+    room: int
+    message: Optional[str] = None
+
+
+class JoinUserAction(BaseAction):
+    command: Literal[Command.JOIN_USER]
+    user_id: int
+    message: Optional[str] = None
+
+
+class SendAction(BaseAction):
+    command: Literal[Command.SEND]
+    room: int
+    message: str
+
+
+class HistoryAction(BaseAction):
+    command: Literal[Command.HISTORY]
+    room: int
+    before_id: Optional[int] = None
+    limit: Optional[int] = None
+
+
+class HeartbeatAction(BaseAction):
+    # reply=False - клиент проверяет соединение и ждёт HeartbeatMessage(reply=True),
+    # reply=True - ответ клиента на HeartbeatMessage сервера
+    command: Literal[Command.HEARTBEAT]
+    nonce: int
+    reply: bool = False
+    token: Optional[str] = None
+
+
+class StatsAction(BaseAction):
+    # Метрики сервера; только для пользователей из ADMIN_USERS
+    command: Literal[Command.STATS]
+
+
+class LeaveAction(BaseAction):
+    command: Literal[Command.LEAVE]
+    room: int
+    message: Optional[str] = None
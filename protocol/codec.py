@@ -0,0 +1,118 @@
+import json
+import struct
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    name: str
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+    # Сборка из заранее закодированных кусков, без повторной сериализации
+    def array(self, items: list[bytes]) -> bytes:
+        # массив из уже закодированных элементов
+        raise NotImplementedError
+
+    def splice(self, payload: bytes, key: str, value: bytes) -> bytes:
+        # добавить в закодированный объект поле key с уже закодированным значением
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<Codec {self.name}>"
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def array(self, items: list[bytes]) -> bytes:
+        return b"[" + b",".join(items) + b"]"
+
+    def splice(self, payload: bytes, key: str, value: bytes) -> bytes:
+        separator = b"," if payload != b"{}" else b""
+        return payload[:-1] + separator + self.dumps(key) + b":" + value + b"}"
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+    def array(self, items: list[bytes]) -> bytes:
+        size = len(items)
+        if size < 16:
+            header = bytes([0x90 | size])
+        elif size < 1 << 16:
+            header = b"\xdc" + struct.pack(">H", size)
+        else:
+            header = b"\xdd" + struct.pack(">I", size)
+        return header + b"".join(items)
+
+    def splice(self, payload: bytes, key: str, value: bytes) -> bytes:
+        # у map меняется только число пар в заголовке
+        first = payload[0]
+        if 0x80 <= first <= 0x8e:
+            header, body = bytes([first + 1]), payload[1:]
+        elif first == 0x8f:
+            header, body = b"\xde" + struct.pack(">H", 16), payload[1:]
+        elif first == 0xde:
+            header, body = b"\xde" + struct.pack(">H", struct.unpack(">H", payload[1:3])[0] + 1), payload[3:]
+        else:
+            raise ValueError("Ожидался msgpack map")
+        return header + body + self.dumps(key) + value
+
+
+JSON_CODEC = JsonCodec()
+
+# Кодеки, доступные в этом окружении; stdlib json есть всегда
+CODECS: dict[str, Codec] = {JSON_CODEC.name: JSON_CODEC}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+# Порядок предпочтения клиента: компактный бинарный, быстрый JSON, stdlib JSON
+PREFERRED_CODECS: list[str] = [
+    name for name in (MsgpackCodec.name, OrjsonCodec.name, JsonCodec.name) if name in CODECS
+]
+
+
+def negotiate(offered: list[str], allowed: list[str] | None = None) -> Codec:
+    # Первый из предложенных клиентом кодеков, который есть у сервера
+    for name in offered:
+        if name in CODECS and (allowed is None or name in allowed):
+            return CODECS[name]
+    return JSON_CODEC
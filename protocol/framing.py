@@ -0,0 +1,124 @@
+import asyncio
+import json
+import struct
+
+from protocol.codec import Codec, CODECS, JSON_CODEC, PREFERRED_CODECS, negotiate
+from protocol.messages import END_MARKER
+
+# Первый байт 0x00 не может начинать JSON-кадр старого протокола,
+# поэтому по нему сервер отличает клиентов v2 от клиентов с END_MARKER
+MAGIC: bytes = b"\x00OC2"
+PROTOCOL_VERSION = 2
+DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+HEADER = struct.Struct("!I")
+
+# Необязательные возможности протокола v2, о которых договариваются в приветствии:
+# presence_digest - изменения присутствия приходят пачкой в PresenceMessage
+PRESENCE_DIGEST = "presence_digest"
+FEATURES = (PRESENCE_DIGEST,)
+
+
+class FrameTooLarge(Exception):
+    pass
+
+
+class Framing:
+    version: int
+    features: frozenset[str] = frozenset()
+
+    def pack(self, payload: bytes) -> bytes:
+        raise NotImplementedError
+
+    async def read(self, reader: asyncio.StreamReader) -> bytes:
+        raise NotImplementedError
+
+
+class MarkerFraming(Framing):
+    # Протокол v1: JSON + END_MARKER
+    version = 1
+
+    def __init__(self, prefix: bytes = b""):
+        # байты, уже прочитанные при определении версии протокола
+        self._prefix = prefix
+
+    def pack(self, payload: bytes) -> bytes:
+        return payload + END_MARKER
+
+    async def read(self, reader: asyncio.StreamReader) -> bytes:
+        data = await reader.readuntil(END_MARKER)
+        if self._prefix:
+            data, self._prefix = self._prefix + data, b""
+        return data.removesuffix(END_MARKER)
+
+
+class LengthPrefixedFraming(Framing):
+    # Протокол v2: 4 байта длины (big-endian) + полезная нагрузка
+    version = 2
+
+    def __init__(self, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+
+    def pack(self, payload: bytes) -> bytes:
+        return HEADER.pack(len(payload)) + payload
+
+    async def read(self, reader: asyncio.StreamReader) -> bytes:
+        (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if size > self.max_frame_size:
+            raise FrameTooLarge(f"Кадр {size} байт больше лимита {self.max_frame_size}")
+        return await reader.readexactly(size)
+
+
+MARKER_FRAMING = MarkerFraming()
+
+
+# Приветствие и ответ на него всегда в JSON: кодек ещё не выбран
+async def server_handshake(reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter,
+                           max_frame_size: int,
+                           allowed_codecs: list[str] | None = None,
+                           timeout: float | None = None) -> tuple[Framing, Codec]:
+    # Клиент v1 после подключения может молчать сколько угодно (ждёт ввода
+    # пользователя): тишина дольше timeout - это он, а не ошибка, дальше его
+    # ведут idle/heartbeat. Ограничение по времени - только на hello после MAGIC
+    try:
+        prefix = await asyncio.wait_for(reader.readexactly(len(MAGIC)), timeout)
+    except asyncio.TimeoutError:
+        return MarkerFraming(), JSON_CODEC
+    if prefix != MAGIC:
+        return MarkerFraming(prefix), JSON_CODEC
+
+    framing = LengthPrefixedFraming(max_frame_size)
+    hello = json.loads(await asyncio.wait_for(framing.read(reader), timeout))
+    framing.max_frame_size = min(max_frame_size, int(hello.get("max_frame_size", max_frame_size)))
+    codec = negotiate(hello.get("codecs", []), allowed_codecs)
+    framing.features = frozenset(hello.get("features", ())) & frozenset(FEATURES)
+    reply = {
+        "version": PROTOCOL_VERSION,
+        "max_frame_size": framing.max_frame_size,
+        "codec": codec.name,
+        "features": sorted(framing.features),
+    }
+    writer.write(framing.pack(json.dumps(reply).encode()))
+    await writer.drain()
+    return framing, codec
+
+
+async def client_handshake(reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter,
+                           max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                           codecs: list[str] | None = None,
+                           features: tuple[str, ...] = FEATURES) -> tuple[Framing, Codec]:
+    framing = LengthPrefixedFraming(max_frame_size)
+    hello = {
+        "version": PROTOCOL_VERSION,
+        "max_frame_size": max_frame_size,
+        "codecs": codecs or PREFERRED_CODECS,
+        "features": list(features),
+    }
+    writer.write(MAGIC + framing.pack(json.dumps(hello).encode()))
+    await writer.drain()
+    reply = json.loads(await framing.read(reader))
+    framing.max_frame_size = int(reply["max_frame_size"])
+    framing.features = frozenset(reply.get("features", ()))
+    return framing, CODECS[reply.get("codec", JSON_CODEC.name)]
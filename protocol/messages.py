@@ -0,0 +1,250 @@
+import asyncio
+from enum import Enum
+from typing import Literal, Annotated, Union, Optional, TYPE_CHECKING, Callable
+from pydantic import BaseModel, Field, TypeAdapter, ConfigDict
+
+from protocol.codec import Codec, JSON_CODEC
+
+if TYPE_CHECKING:
+    from protocol.framing import Framing
+    from server.connection import Connection
+
+END_MARKER: bytes = b"<END>\n"
+
+
+class TypeMessage(str, Enum):
+    token = "token"
+    message = "message"
+    update = "update"
+    init = "init"
+    join_chat = "join_chat"
+    error = "error"
+    history = "history"
+    heartbeat = "heartbeat"
+    stats = "stats"
+    presence = "presence"
+
+
+class UpdateKind(str, Enum):
+    user_online = "user_online"
+    user_offline = "user_offline"
+    new_room = "new_room"
+    update_room = "update_room"
+    new_message = "new_message"
+
+
+class BaseMessage(BaseModel):
+    type_: TypeMessage = Field(..., alias="type")
+    content: str
+
+    model_config = {
+        "populate_by_name": True,
+        "extra": "ignore"
+    }
+
+    def _payload(self, codec: Codec = JSON_CODEC) -> bytes:
+        return codec.dumps(self.model_dump(mode="json"))
+
+    def _to_bytes(self) -> bytes:
+        return self._payload() + END_MARKER
+
+    def to_frame(self) -> "Frame":
+        return Frame(self)
+
+    async def send_message(self, conn: "Connection"):
+        await conn.send(self.to_frame())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}: {self.model_dump_json()}"
+
+
+class Frame:
+    # Сообщение, сериализованное один раз: одни и те же неизменяемые байты
+    # уходят в очереди всех получателей рассылки. Полезная нагрузка строится
+    # один раз на кодек, обёртка кадра (END_MARKER или заголовок длины) -
+    # один раз на пару (версия протокола, кодек)
+    __slots__ = ("message", "_data", "_payloads", "_wire")
+
+    def __init__(self, message: BaseMessage):
+        self.message = message
+        self._data: dict | None = None
+        self._payloads: dict[str, bytes] = {}
+        self._wire: dict[tuple[int, str], bytes] = {}
+
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = self.message.model_dump(mode="json")
+        return self._data
+
+    def payload(self, codec: Codec = JSON_CODEC) -> bytes:
+        data = self._payloads.get(codec.name)
+        if data is None:
+            data = self._payloads[codec.name] = codec.dumps(self.data())
+        return data
+
+    def wire(self, framing: "Framing", codec: Codec = JSON_CODEC) -> bytes:
+        key = (framing.version, codec.name)
+        data = self._wire.get(key)
+        if data is None:
+            data = self._wire[key] = framing.pack(self.payload(codec))
+        return data
+
+    def __repr__(self):
+        return f"<Frame {self.message.__class__.__name__}>"
+
+
+class SplicedFrame(Frame):
+    # Кадр, часть полей которого приходит уже закодированной (например, общий
+    # для всех снимок справочника): остальное кодируется как обычно, а готовые
+    # байты вклеиваются в результат без разбора и повторной сериализации
+    __slots__ = ("_fragments",)
+
+    def __init__(self, message: BaseMessage, fragments: dict[str, Callable[[Codec], bytes]]):
+        super().__init__(message)
+        self._fragments = fragments
+
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = self.message.model_dump(mode="json", exclude=set(self._fragments))
+        return self._data
+
+    def payload(self, codec: Codec = JSON_CODEC) -> bytes:
+        data = self._payloads.get(codec.name)
+        if data is None:
+            data = codec.dumps(self.data())
+            for key, fragment in self._fragments.items():
+                data = codec.splice(data, key, fragment(codec))
+            self._payloads[codec.name] = data
+        return data
+
+
+class RoomBrief(BaseModel):
+    room_id: int
+    title: str
+    users: list['UserBrief']
+
+
+    # unread: int
+
+
+class TokenMessage(BaseMessage):
+    type_: Literal[TypeMessage.token] = Field(TypeMessage.token, alias="type")
+
+
+class Message(BaseMessage):
+    type_: Literal[TypeMessage.message] = Field(TypeMessage.message, alias="type")
+    id: Optional[int] = None
+    from_: int
+    from_username: str
+    room_id: int
+    time_: float
+
+
+class UpdateMessage(BaseMessage):
+    type_: Literal[TypeMessage.update] = Field(TypeMessage.update, alias="type")
+    kind: UpdateKind
+    payload: dict
+    content: Optional[str] = None
+
+
+class UserBrief(BaseModel):
+    id: int
+    username: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class InitMessage(BaseMessage):
+    # delta=False - полный снимок справочника. delta=True - только изменения после
+    # версии клиента: all_users - новые/переименованные, online_users/offline_users -
+    # сменившие статус, removed_users - удалённые, rooms - изменившиеся комнаты
+    type_: Literal[TypeMessage.init] = Field(TypeMessage.init, alias="type")
+    self_user: dict
+    rooms: list[RoomBrief]
+    all_users: list[UserBrief]
+    online_users: list[UserBrief]
+    content: Optional[str] = None
+    directory_version: Optional[str] = None
+    delta: bool = False
+    offline_users: list[UserBrief] = []
+    removed_users: list[int] = []
+
+
+class JoinChatMessage(BaseMessage):
+    type_: Literal[TypeMessage.join_chat] = Field(TypeMessage.join_chat, alias="type")
+    room_id: Optional[int] = None
+    messages: list[Message] = Field()
+    has_more: bool = False
+    # ответ на JoinChatAction.after_id: messages - только новее него,
+    # has_more=True - между after_id и этой страницей есть ещё сообщения
+    after_id: Optional[int] = None
+
+
+class HistoryMessage(BaseMessage):
+    # Страница более старых сообщений в ответ на HistoryAction
+    type_: Literal[TypeMessage.history] = Field(TypeMessage.history, alias="type")
+    room_id: int
+    before_id: Optional[int] = None
+    messages: list[Message]
+    has_more: bool = False
+
+
+class HeartbeatMessage(BaseMessage):
+    # reply=False - запрос (на него отвечают HeartbeatAction с тем же nonce),
+    # reply=True - ответ сервера на HeartbeatAction клиента
+    type_: Literal[TypeMessage.heartbeat] = Field(TypeMessage.heartbeat, alias="type")
+    nonce: int
+    reply: bool = False
+    content: Optional[str] = None
+
+
+class ErrorMessage(BaseMessage):
+    type_: Literal[TypeMessage.error] = Field(TypeMessage.error, alias="type")
+
+
+class StatsMessage(BaseMessage):
+    # Снимок метрик сервера в ответ на StatsAction
+    type_: Literal[TypeMessage.stats] = Field(TypeMessage.stats, alias="type")
+    stats: dict
+    content: Optional[str] = None
+
+
+class PresenceMessage(BaseMessage):
+    # Изменения присутствия за один тик PresenceBatcher (для клиентов с presence_digest)
+    type_: Literal[TypeMessage.presence] = Field(TypeMessage.presence, alias="type")
+    online: list[UserBrief] = []
+    offline: list[UserBrief] = []
+    content: Optional[str] = None
+
+    def expand(self) -> list[UpdateMessage]:
+        # То же самое отдельными UpdateMessage для старых клиентов
+        updates = [
+            UpdateMessage(kind=UpdateKind.user_online, payload=user.model_dump()) for user in self.online
+        ]
+        updates.extend(
+            UpdateMessage(kind=UpdateKind.user_offline, payload=user.model_dump()) for user in self.offline
+        )
+        return updates
+
+
+
+
+AnyMessage = Annotated[
+    Union[Message, UpdateMessage, InitMessage, TokenMessage, JoinChatMessage, ErrorMessage, HistoryMessage,
+          HeartbeatMessage, StatsMessage, PresenceMessage],
+    Field(discriminator="type_")
+]
+
+message_adapter = TypeAdapter(AnyMessage)
+
+# # Пример данных
+# data = {
+#     "type": "message",
+#     "content": "Привет!",
+#     "from_": 1,
+#     "room_id": 2
+# }
+#
+# parsed: BaseMessage = message_adapter.validate_python(data)
+# print(parsed.to_bytes())
+# print(type(parsed))
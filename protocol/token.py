@@ -0,0 +1,13 @@
+import base64
+import json
+from typing import Any
+
+
+def token_claims(token: str) -> Any:
+    # Данные из JWT без проверки подписи: ключа у клиента нет,
+    # токен проверяет сервер при каждом действии
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError) as e:
+        raise ValueError("Invalid token") from e
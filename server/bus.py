@@ -0,0 +1,146 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from protocol.codec import CODECS, PREFERRED_CODECS
+from protocol.framing import LengthPrefixedFraming
+from utils.logger import get_logger
+
+Connector = Callable[[], Awaitable[tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+class PeerLink:
+    # Исходящий канал к соседу: своя очередь и задача-писатель,
+    # которая сама переподключается, если сосед ещё не поднялся или упал
+
+    def __init__(self,
+                 name: str,
+                 connect: Connector,
+                 queue_size: int,
+                 retry_delay: float = 0.2,
+                 hello: bytes | None = None):
+        self.name = name
+        self._connect = connect
+        # кадр, который отправляется первым после каждого подключения
+        self.hello = hello
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=queue_size)
+        self._task: asyncio.Task | None = None
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def publish(self, data: bytes):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(data)
+
+    async def _run(self):
+        pending: list[bytes] = []
+        while True:
+            try:
+                _, writer = await self._connect()
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self.log.info("Канал к %s установлен", self.name)
+            try:
+                if self.hello:
+                    writer.write(self.hello)
+                while True:
+                    if not pending:
+                        pending = [await self._queue.get()]
+                        while not self._queue.empty():
+                            pending.append(self._queue.get_nowait())
+                    writer.writelines(pending)
+                    await writer.drain()
+                    pending = []
+            except (OSError, ConnectionError) as e:
+                self.log.warning("Канал к %s разорван: %s", self.name, e)
+                writer.close()
+                await asyncio.sleep(self.retry_delay)
+
+
+class LocalBus:
+    # Шина между процессами-воркерами одной машины поверх Unix-сокетов:
+    # каждый воркер слушает свой сокет и держит исходящий канал к каждому соседу
+
+    def __init__(self,
+                 worker_id: int,
+                 workers: int,
+                 socket_dir: str,
+                 name: str,
+                 handler: EventHandler,
+                 queue_size: int = 100_000):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.name = name
+        self.handler = handler
+        self.codec = CODECS[PREFERRED_CODECS[0]]
+        self.framing = LengthPrefixedFraming()
+        self.links = [
+            PeerLink(f"воркер {i}", self._connector(i), queue_size)
+            for i in range(workers) if i != worker_id
+        ]
+        self._server: asyncio.AbstractServer | None = None
+        self._incoming: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    def path(self, worker_id: int) -> str:
+        return os.path.join(self.socket_dir, f"{self.name}-{worker_id}.sock")
+
+    def _connector(self, worker_id: int) -> Connector:
+        return lambda: asyncio.open_unix_connection(self.path(worker_id))
+
+    async def start(self):
+        path = self.path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path)
+        for link in self.links:
+            link.start()
+        self.log.info("Шина воркера %s слушает %s", self.worker_id, path)
+
+    async def stop(self):
+        for link in self.links:
+            link.stop()
+        if self._server:
+            self._server.close()
+            handlers = list(self._incoming.values())
+            for writer in list(self._incoming):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def publish(self, event: dict):
+        data = self.framing.pack(self.codec.dumps(event))
+        for link in self.links:
+            link.publish(data)
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._incoming[writer] = asyncio.current_task()
+        try:
+            while True:
+                event = self.codec.loads(await self.framing.read(reader))
+                try:
+                    await self.handler(event)
+                except Exception as e:
+                    self.log.error(e, exc_info=True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self._incoming.pop(writer, None)
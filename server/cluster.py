@@ -0,0 +1,380 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import time
+from typing import TYPE_CHECKING, Iterable
+
+from protocol.codec import CODECS, PREFERRED_CODECS
+from protocol.framing import LengthPrefixedFraming
+from action.schemas import adapter
+from protocol.messages import Frame, message_adapter
+from server.bus import PeerLink
+from server.session import Session
+from utils.cache import TTLCache
+from utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from action.schemas import BaseAction
+    from server.server import Server
+
+# События, которые сервер обрабатывает одинаково для шины воркеров и кластера
+SERVER_EVENTS = {"room", "all", "presence", "members", "online", "offline"}
+
+
+def parse_nodes(spec: str) -> dict[str, tuple[str, int]]:
+    # "a=127.0.0.1:9001,b=127.0.0.1:9002" -> {"a": ("127.0.0.1", 9001), ...}
+    nodes = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, addr = item.split("=", 1)
+        host, port = addr.rsplit(":", 1)
+        nodes[name] = (host, int(port))
+    return nodes
+
+
+class HashRing:
+    # Консистентное хеширование: у каждого узла vnodes точек на кольце,
+    # комната принадлежит ближайшей точке по часовой стрелке от хеша room_id.
+    # При уходе или появлении узла переезжает только его доля комнат
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 128):
+        self.nodes = sorted(set(nodes))
+        points = sorted((self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def owner(self, room_id: int) -> str:
+        i = bisect.bisect(self._keys, self._hash(f"room:{room_id}")) % len(self._keys)
+        return self._owners[i]
+
+
+class RemoteConnection:
+    # Соединение пользователя на другом узле: владелец комнаты выполняет
+    # пересланное действие, а ответы уходят обратно на узел пользователя
+
+    def __init__(self, cluster: "Cluster", node: str, session: Session):
+        self.cluster = cluster
+        self.node = node
+        self.session = session
+        self.addr = (node, session.user_id)
+
+    async def send(self, frame: Frame):
+        self.cluster.send({"kind": "reply", "user_id": self.session.user_id, "message": frame.data()}, to=self.node)
+
+
+class Cluster:
+    # Узлы связаны TCP-каналами (PeerLink из шины воркеров). Каждая комната
+    # принадлежит одному узлу по кольцу из живых узлов: владелец сохраняет
+    # сообщения и рассылает их узлам, где есть онлайн-участники комнаты.
+    # События доставляются с подтверждением: неподтверждённые переотправляются,
+    # а при смене кольца уходят новому владельцу комнаты
+
+    def __init__(self,
+                 server: "Server",
+                 node: str,
+                 nodes: dict[str, tuple[str, int]],
+                 retry_interval: float = 1.0,
+                 max_attempts: int = 30,
+                 queue_size: int = 100_000):
+        if node not in nodes:
+            raise Exception(f"Узел {node} не описан в списке узлов кластера")
+        self.server = server
+        self.node = node
+        self.nodes = nodes
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.codec = CODECS[PREFERRED_CODECS[0]]
+        self.framing = LengthPrefixedFraming()
+        # эпоха отличает перезапущенный узел, у которого seq начинается заново
+        self.epoch = time.time_ns()
+        hello = self._pack({"kind": "hello", "from": node})
+        self.links = {
+            name: PeerLink(f"узел {name}", self._connector(host, port), queue_size, hello=hello)
+            for name, (host, port) in nodes.items() if name != node
+        }
+        self.alive: set[str] = set()
+        # узлы, объявившие выход: новые события им не идут, но подтверждения от них ещё ждём
+        self.leaving: set[str] = set()
+        self.ring = HashRing([node])
+        # полное кольцо из всех описанных узлов - по нему решаем, какие комнаты грузить при старте
+        self.home_ring = HashRing(nodes)
+        # на владельце: комната -> узлы с онлайн-участниками;
+        # на узле: комната -> владелец, у которого мы подписаны
+        self.subscribers: dict[int, set[str]] = {}
+        self.subscribed: dict[int, str] = {}
+        self.unacked: dict[int, list] = {}
+        self._seq = itertools.count(1)
+        self._seen = TTLCache(max_size=100_000, ttl=max_attempts * retry_interval * 2)
+        self._server: asyncio.AbstractServer | None = None
+        self._incoming: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._retry_task: asyncio.Task | None = None
+        self._reload_task: asyncio.Task | None = None
+        self._reload_again = False
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    @staticmethod
+    def _connector(host: str, port: int):
+        return lambda: asyncio.open_connection(host, port)
+
+    def _pack(self, event: dict) -> bytes:
+        return self.framing.pack(self.codec.dumps(event))
+
+    async def start(self):
+        host, port = self.nodes[self.node]
+        self._server = await asyncio.start_server(self._handle_peer, host, port)
+        for link in self.links.values():
+            link.start()
+        self._retry_task = asyncio.create_task(self._retry_loop())
+        self.log.info("Узел %s слушает кластер на %s:%s", self.node, host, port)
+
+    async def leave(self):
+        # Плавный выход: соседи убирают узел из кольца, но ждут подтверждений
+        # от него до разрыва канала - всё, что уже переслано сюда, дорабатывается здесь
+        for link in self.links.values():
+            link.publish(self._pack({"kind": "leave", "from": self.node}))
+        await asyncio.sleep(self.retry_interval)
+
+    async def stop(self):
+        # даём уйти последним подтверждениям и рассылкам
+        deadline = time.monotonic() + self.retry_interval
+        while any(link.queue_depth for link in self.links.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        if self._retry_task:
+            self._retry_task.cancel()
+        if self._reload_task:
+            self._reload_task.cancel()
+        for link in self.links.values():
+            link.stop()
+        if self._server:
+            self._server.close()
+            handlers = list(self._incoming.values())
+            for writer in list(self._incoming):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def owns(self, room_id: int) -> bool:
+        return self.ring.owner(room_id) == self.node
+
+    def is_home(self, room_id: int) -> bool:
+        return self.home_ring.owner(room_id) == self.node
+
+    # ---- отправка ----
+
+    def send(self, event: dict, to: str | None = None):
+        # to=None - событие адресовано владельцу event["room_id"] на момент отправки
+        event.update(seq=next(self._seq), epoch=self.epoch, attempts=0)
+        event["from"] = self.node
+        if to is None:
+            event["routed"] = True
+        else:
+            event["to"] = to
+        self._dispatch(event)
+
+    def broadcast(self, event: dict):
+        for node in self.alive:
+            self.send(dict(event), to=node)
+
+    def forward_action(self, action: "BaseAction", session: Session):
+        self.send({
+            "kind": "action",
+            "room_id": action.room,
+            "action": action.model_dump(mode="json"),
+            "user_id": session.user_id,
+            "username": session.username,
+            "token": session.token,
+        })
+
+    def _target(self, event: dict) -> str | None:
+        if event.get("routed"):
+            return self.ring.owner(event["room_id"])
+        to = event["to"]
+        return to if to in self.alive else None
+
+    def _dispatch(self, event: dict):
+        target = self._target(event)
+        if target is None:
+            self.unacked.pop(event["seq"], None)
+            return
+        if target == self.node:
+            # после смены кольца комната досталась нам самим
+            self.unacked.pop(event["seq"], None)
+            asyncio.create_task(self._handle_safe(event))
+            return
+        event["attempts"] += 1
+        self.unacked[event["seq"]] = [event, time.monotonic(), target]
+        self.links[target].publish(self._pack(event))
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            self.retry(time.monotonic() - self.retry_interval)
+
+    def retry(self, sent_before: float):
+        for seq, (event, sent_at, node) in list(self.unacked.items()):
+            if sent_at > sent_before or node in self.leaving:
+                continue
+            if event["attempts"] >= self.max_attempts:
+                self.log.error("Событие %s #%s не подтверждено за %s попыток", event["kind"], seq, self.max_attempts)
+                del self.unacked[seq]
+                continue
+            self._dispatch(event)
+
+    # ---- приём ----
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = None
+        self._incoming[writer] = asyncio.current_task()
+        try:
+            while True:
+                event = self.codec.loads(await self.framing.read(reader))
+                match event["kind"]:
+                    case "hello":
+                        peer = event["from"]
+                        self.leaving.discard(peer)
+                        self._set_alive(peer, True)
+                    case "leave":
+                        self.leaving.add(peer)
+                        self._set_alive(peer, False)
+                    case "ack":
+                        self.unacked.pop(event["seq"], None)
+                    case _:
+                        key = (event["from"], event["epoch"], event["seq"])
+                        if self._seen.get(key) is None:
+                            self._seen.put(key, True)
+                            await self._handle_safe(event)
+                        # подтверждаем после обработки: при падении посередине событие придёт снова
+                        if link := self.links.get(event["from"]):
+                            link.publish(self._pack({"kind": "ack", "seq": event["seq"]}))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self._incoming.pop(writer, None)
+            if peer in self.leaving:
+                # узел ушёл: всё, что он так и не подтвердил, - новым владельцам
+                self.leaving.discard(peer)
+                self.retry(time.monotonic())
+            elif peer is not None:
+                self._set_alive(peer, False)
+
+    async def _handle_safe(self, event: dict):
+        try:
+            await self._handle(event)
+        except Exception as e:
+            self.log.error(e, exc_info=True)
+
+    async def _handle(self, event: dict):
+        kind = event["kind"]
+        if kind in SERVER_EVENTS:
+            await self.server.on_bus_event(event)
+            return
+        match kind:
+            case "action":
+                action = adapter.validate_python(event["action"])
+                session = Session(event["user_id"], event["username"], event["token"])
+                await self.server.run_action(action, RemoteConnection(self, event["from"], session))
+            case "forward":
+                await self.distribute(Frame(message_adapter.validate_python(event["message"])), event["room_id"])
+            case "subscribe":
+                self.subscribers.setdefault(event["room_id"], set()).add(event["from"])
+            case "unsubscribe":
+                nodes = self.subscribers.get(event["room_id"])
+                if nodes is not None:
+                    nodes.discard(event["from"])
+                    if not nodes:
+                        del self.subscribers[event["room_id"]]
+            case "reply":
+                if conn := self.server.users.get(event["user_id"]):
+                    await conn.send(Frame(message_adapter.validate_python(event["message"])))
+
+    # ---- комнаты ----
+
+    async def send_room(self, frame: Frame, room_id: int):
+        if self.owns(room_id):
+            await self.distribute(frame, room_id)
+        else:
+            self.send({"kind": "forward", "room_id": room_id, "message": frame.data()})
+
+    async def distribute(self, frame: Frame, room_id: int):
+        # Владелец: своим участникам напрямую, остальным узлам - одним событием на узел
+        for node in self.subscribers.get(room_id, ()):
+            if node != self.node:
+                self.send({"kind": "room", "room_id": room_id, "message": frame.data()}, to=node)
+        await self.server.deliver_room(frame, room_id)
+
+    def note_members(self, room_id: int, user_ids: Iterable[int]):
+        # Владелец сразу подписывает узлы новых участников, не дожидаясь
+        # их subscribe: иначе первое сообщение после входа в комнату до них не дойдёт
+        if not self.owns(room_id):
+            return
+        for user_id in user_ids:
+            node = self.server.remote_online.get(user_id)
+            if node is not None and node != self.node:
+                self.subscribers.setdefault(room_id, set()).add(node)
+
+    def sync_rooms(self, rooms: Iterable[int]):
+        # Подписка узла у владельцев комнат, где у нас есть онлайн-участники
+        for room_id in rooms:
+            live = room_id in self.server.registry.live_rooms
+            current = self.subscribed.get(room_id)
+            if live and current is None:
+                owner = self.subscribed[room_id] = self.ring.owner(room_id)
+                if owner != self.node:
+                    self.send({"kind": "subscribe", "room_id": room_id})
+            elif not live and current is not None:
+                del self.subscribed[room_id]
+                if current != self.node:
+                    self.send({"kind": "unsubscribe", "room_id": room_id})
+
+    def _set_alive(self, node: str, alive: bool):
+        if (node in self.alive) == alive:
+            return
+        if alive:
+            self.alive.add(node)
+            # новый узел не знает, кто онлайн у нас
+            for user_id in self.server.users:
+                self.send({"kind": "online", "user_id": user_id, "node": self.node}, to=node)
+        else:
+            self.alive.discard(node)
+            for nodes in self.subscribers.values():
+                nodes.discard(node)
+            for user_id in [u for u, n in self.server.remote_online.items() if n == node]:
+                del self.server.remote_online[user_id]
+        self.ring = HashRing([self.node, *self.alive])
+        self.log.info("Узел %s %s, живые узлы: %s", node, "в кластере" if alive else "выбыл", self.ring.nodes)
+        self._rebalance()
+
+    def _rebalance(self):
+        # Подписки на комнаты, которые теперь не наши, больше не нужны
+        self.subscribers = {room_id: nodes for room_id, nodes in self.subscribers.items() if self.owns(room_id)}
+        # Переподписываемся у новых владельцев до повторной отправки:
+        # по одному каналу subscribe придёт к владельцу раньше переотправленных сообщений
+        moved = [room_id for room_id, owner in self.subscribed.items() if self.ring.owner(room_id) != owner]
+        for room_id in moved:
+            del self.subscribed[room_id]
+        self.sync_rooms(moved)
+        self.retry(time.monotonic())
+        # составы комнат, которые теперь наши, и пропущенные события members - из БД
+        self._schedule_reload()
+
+    def _schedule_reload(self):
+        # Несколько смен кольца подряд дают одну перезагрузку после текущей
+        if self._reload_task and not self._reload_task.done():
+            self._reload_again = True
+            return
+        self._reload_task = asyncio.create_task(self._reload())
+
+    async def _reload(self):
+        while True:
+            self._reload_again = False
+            try:
+                await self.server.reload_memberships()
+            except Exception as e:
+                self.log.error("Не удалось перезагрузить составы комнат: %s", e)
+            if not self._reload_again:
+                return
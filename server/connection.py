@@ -0,0 +1,125 @@
+import asyncio
+import time
+from enum import Enum
+from typing import TYPE_CHECKING
+
+from protocol.codec import Codec
+from protocol.framing import Framing
+from utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from protocol.messages import Frame
+    from server.metrics import Metrics
+    from server.session import Session
+
+
+class SlowConsumerPolicy(str, Enum):
+    drop_oldest = "drop_oldest"
+    disconnect = "disconnect"
+    block = "block"
+
+
+class Connection:
+
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 framing: Framing,
+                 codec: Codec,
+                 queue_size: int,
+                 policy: SlowConsumerPolicy,
+                 block_timeout: float,
+                 metrics: 'Metrics | None' = None):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.framing = framing
+        self.codec = codec
+        self.session: 'Session | None' = None
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.metrics = metrics
+        self.dropped = 0
+        self.closed = False
+        # last_seen - любой входящий кадр, last_active - любое действие кроме heartbeat
+        self.last_seen = self.last_active = time.monotonic()
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=queue_size)
+        self._writer_task: asyncio.Task | None = None
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    async def read(self) -> bytes:
+        data = await self.framing.read(self.reader)
+        self.last_seen = time.monotonic()
+        return data
+
+    def touch(self):
+        self.last_active = self.last_seen
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def write_buffer_size(self) -> int:
+        transport = self.writer.transport
+        return 0 if transport.is_closing() else transport.get_write_buffer_size()
+
+    def offer(self, frame: 'Frame') -> bool:
+        # True - кадр обработан без ожидания (поставлен, отброшен или соединение закрыто),
+        # False - очередь заполнена и политика block требует ждать через send()
+        if self.closed:
+            return True
+        data = frame.wire(self.framing, self.codec)
+        if not self._queue.full():
+            self._queue.put_nowait(data)
+            return True
+        match self.policy:
+            case SlowConsumerPolicy.drop_oldest:
+                self._queue.get_nowait()
+                self._queue.put_nowait(data)
+                self.dropped += 1
+                if self.metrics:
+                    self.metrics.dropped.inc()
+                return True
+            case SlowConsumerPolicy.disconnect:
+                self.log.warning("Медленный клиент %s: очередь переполнена, отключаем", self.addr)
+                self.close()
+                return True
+        return False
+
+    async def send(self, frame: 'Frame'):
+        if self.offer(frame):
+            return
+        try:
+            await asyncio.wait_for(self._queue.put(frame.wire(self.framing, self.codec)), self.block_timeout)
+        except TimeoutError:
+            self.log.warning("Медленный клиент %s: таймаут %sс, отключаем", self.addr, self.block_timeout)
+            self.close()
+
+    async def _writer_loop(self):
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                self.writer.writelines(batch)
+                if self.metrics:
+                    self.metrics.frames_out.inc(len(batch))
+                    self.metrics.bytes_out.inc(sum(map(len, batch)))
+                await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError as e:
+            self.log.info("Запись в %s прервана: %s", self.addr, e)
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        self.writer.close()
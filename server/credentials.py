@@ -0,0 +1,41 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from action.passwords import CredentialsBusy
+
+T = TypeVar("T")
+
+
+class CredentialPool:
+    # Хэширование паролей (scrypt отпускает GIL) и подпись токенов в пуле потоков,
+    # чтобы волна входов не останавливала рассылку сообщений в event loop.
+    # Допуск ограничен: одновременно не больше max_pending входов/регистраций,
+    # лишним сразу отказываем, а не копим очередь. workers=0 - считать в event loop
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="credentials") if workers else None
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise CredentialsBusy("Сервер перегружен входами, повторите позже")
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        if self._executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def stop(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,120 @@
+import collections
+import uuid
+from typing import TYPE_CHECKING
+
+from protocol.codec import Codec
+from protocol.messages import UserBrief
+from utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from db_model.db_repo import DbRepo
+
+
+class DirectoryDelta:
+    # Что изменилось после версии клиента: id пользователей и комнат
+    __slots__ = ("users", "removed", "presence", "rooms")
+
+    def __init__(self):
+        self.users: set[int] = set()
+        self.removed: set[int] = set()
+        self.presence: set[int] = set()
+        self.rooms: set[int] = set()
+
+
+class Directory:
+    # Справочник пользователей в памяти и журнал изменений с версиями.
+    # Версия клиенту - "эпоха:номер": эпоха своя у каждого процесса, поэтому после
+    # перезапуска или на другом воркере клиент получает полный снимок.
+    # Журнал хранит log_size последних изменений; кто отстал сильнее - тоже снимок
+    def __init__(self, log_size: int):
+        self.users: dict[int, str] = {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.entries: collections.deque[tuple[int, str, int]] = collections.deque(maxlen=log_size)
+        # Снимок all_users уже закодированным: по кодеку - закодированный UserBrief
+        # каждого пользователя и склеенный из них массив. Новый пользователь
+        # кодируется один раз, массив переклеивается только после изменений
+        self._encoded: dict[str, dict[int, bytes]] = {}
+        self._fragments: dict[str, bytes] = {}
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    @property
+    def tag(self) -> str:
+        return f"{self.epoch}:{self.version}"
+
+    async def load(self, db: "DbRepo"):
+        self.users = {user.id: user.username for user in await db.get_all_users()}
+        self.log.info("Справочник: %s пользователей, версия %s", len(self.users), self.tag)
+
+    def _record(self, kind: str, key: int):
+        self.version += 1
+        self.entries.append((self.version, kind, key))
+
+    def add_user(self, user_id: int, username: str):
+        if self.users.get(user_id) != username:
+            self.users[user_id] = username
+            self._forget(user_id)
+            self._record("user", user_id)
+
+    def remove_user(self, user_id: int):
+        if self.users.pop(user_id, None) is not None:
+            self._forget(user_id)
+            self._record("removed", user_id)
+
+    def _forget(self, user_id: int):
+        for encoded in self._encoded.values():
+            encoded.pop(user_id, None)
+        self._fragments.clear()
+
+    def presence_changed(self, user_id: int):
+        self._record("presence", user_id)
+
+    def room_changed(self, room_id: int):
+        self._record("room", room_id)
+
+    def users_fragment(self, codec: Codec) -> bytes:
+        # Закодированный список всех пользователей для InitMessage.all_users
+        fragment = self._fragments.get(codec.name)
+        if fragment is None:
+            encoded = self._encoded.setdefault(codec.name, {})
+            items = []
+            for user_id, username in self.users.items():
+                item = encoded.get(user_id)
+                if item is None:
+                    item = encoded[user_id] = codec.dumps({"id": user_id, "username": username})
+                items.append(item)
+            fragment = self._fragments[codec.name] = codec.array(items)
+        return fragment
+
+    def briefs(self, user_ids) -> list[UserBrief]:
+        return [UserBrief(id=uid, username=name) for uid in user_ids if (name := self.users.get(uid)) is not None]
+
+    def delta(self, tag: str | None) -> DirectoryDelta | None:
+        # Изменения после версии tag или None, если нужен полный снимок
+        if not tag:
+            return None
+        epoch, _, version = tag.partition(":")
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        version = int(version)
+        if self.entries and len(self.entries) == self.entries.maxlen and version < self.entries[0][0] - 1:
+            return None
+        delta = DirectoryDelta()
+        changes = 0
+        for entry_version, kind, key in reversed(self.entries):
+            if entry_version <= version:
+                break
+            changes += 1
+            match kind:
+                case "user":
+                    delta.users.add(key)
+                case "removed":
+                    delta.removed.add(key)
+                case "presence":
+                    delta.presence.add(key)
+                case "room":
+                    delta.rooms.add(key)
+        # изменений больше, чем в половине снимка - дешевле прислать снимок
+        if changes > len(self.users) // 2 + 1:
+            return None
+        return delta
@@ -0,0 +1,287 @@
+import asyncio
+import bisect
+import functools
+import hmac
+import inspect
+import ipaddress
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from utils.logger import get_logger, levels, set_level
+
+if TYPE_CHECKING:
+    from db_model.db_repo import DbRepo
+    from server.server import Server
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Границы корзин размера комнат, участники
+ROOM_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+Labels = tuple[str, ...]
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labels: Labels = ()):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+    def snapshot(self) -> dict | float:
+        if not self.labels:
+            return self.values.get((), 0)
+        return {",".join(labels): value for labels, value in self.values.items()}
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        # последняя корзина - всё, что больше верхней границы (+Inf)
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: Labels = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict[Labels, _Series] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = _Series(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def samples(self) -> Iterator[str]:
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {series.sum}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {series.count}"
+
+    def quantile(self, series: _Series, q: float) -> float | None:
+        # Верхняя граница корзины, в которую попадает квантиль (None - выше последней)
+        rank = q * series.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, series.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> dict:
+        result = {}
+        for labels, series in self.values.items():
+            result[",".join(labels)] = {
+                "count": series.count,
+                "sum": round(series.sum, 6),
+                "mean": round(series.sum / series.count, 6) if series.count else 0.0,
+                "p50": self.quantile(series, 0.5),
+                "p99": self.quantile(series, 0.99),
+            }
+        return result
+
+
+class Gauge:
+    # Значение считается в момент чтения метрик: для размеров очередей,
+    # числа соединений и т.п. не нужно ничего обновлять на горячем пути.
+    # kind="counter" - для монотонных значений, которые уже считает кто-то другой
+
+    def __init__(self, name: str, help_: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help_
+        self.read = read
+        self.kind = kind
+        self.labels = ()
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {self.read()}"
+
+    def snapshot(self) -> float:
+        return self.read()
+
+
+class Metrics:
+    # Счётчики и гистограммы сервера: Prometheus-текст на отдельном порту
+    # и снимок в виде dict для StatsAction
+
+    def __init__(self, server: "Server", token: str = ""):
+        self.server = server
+        # POST /loglevel меняет поведение сервера: с токеном - только с заголовком
+        # "Authorization: Bearer <token>", без токена - только с loopback-адресов
+        self.token = token
+        self.actions = Histogram("onlinechat_action_seconds", "Время Action.run по командам", ("command",))
+        self.action_errors = Counter("onlinechat_action_errors_total", "Ошибки Action.run по командам", ("command",))
+        self.frames_in = Counter("onlinechat_frames_in_total", "Принятые кадры")
+        self.bytes_in = Counter("onlinechat_bytes_in_total", "Принятые байты полезной нагрузки")
+        self.frames_out = Counter("onlinechat_frames_out_total", "Отправленные кадры")
+        self.bytes_out = Counter("onlinechat_bytes_out_total", "Отправленные байты")
+        self.dropped = Counter("onlinechat_dropped_frames_total", "Кадры, вытесненные у медленных клиентов")
+        self.db = Histogram("onlinechat_db_seconds", "Время методов DbRepo", ("method",))
+        self.collected = [
+            self.actions, self.action_errors,
+            self.frames_in, self.bytes_in, self.frames_out, self.bytes_out, self.dropped,
+            self.db,
+            Gauge("onlinechat_connections", "Открытые соединения", lambda: len(server.registry.connections)),
+            Gauge("onlinechat_online_users", "Пользователи онлайн на этом узле", lambda: len(server.users)),
+            Gauge("onlinechat_rooms", "Комнаты в памяти", lambda: len(server.chats)),
+            Gauge("onlinechat_live_rooms", "Комнаты с онлайн-участниками", lambda: len(server.registry.live_rooms)),
+            Gauge("onlinechat_outbound_queue_frames", "Кадры в исходящих очередях (сумма)",
+                  lambda: sum(conn.queue_depth for conn in server.registry.connections)),
+            Gauge("onlinechat_outbound_queue_max", "Самая длинная исходящая очередь",
+                  lambda: max((conn.queue_depth for conn in server.registry.connections), default=0)),
+            Gauge("onlinechat_write_buffer_bytes", "Байты в буферах транспорта (сумма)",
+                  lambda: sum(conn.write_buffer_size for conn in server.registry.connections)),
+            Gauge("onlinechat_persist_pending", "Сообщения в очереди записи в БД",
+                  lambda: server.message_writer.pending),
+            Gauge("onlinechat_persist_flushed_total", "Сообщения, записанные в БД",
+                  lambda: server.message_writer.flushed, kind="counter"),
+            Gauge("onlinechat_persist_batches_total", "Пачки, записанные в БД",
+                  lambda: server.message_writer.batches, kind="counter"),
+            Gauge("onlinechat_presence_digests_total", "Разосланные дайджесты присутствия",
+                  lambda: server.presence.digests, kind="counter"),
+            Gauge("onlinechat_auth_pending", "Входы и регистрации в пуле паролей",
+                  lambda: server.credentials.pending),
+            Gauge("onlinechat_auth_rejected_total", "Входы, отклонённые из-за переполнения пула",
+                  lambda: server.credentials.rejected, kind="counter"),
+        ]
+        self._server: asyncio.AbstractServer | None = None
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    def room_sizes(self) -> Histogram:
+        # Распределение размеров комнат строится при чтении метрик
+        sizes = Histogram("onlinechat_room_members", "Размеры комнат", buckets=ROOM_SIZE_BUCKETS)
+        for members in self.server.chats.values():
+            sizes.observe(len(members))
+        return sizes
+
+    def instrument_repo(self, db: "DbRepo"):
+        # Оборачиваем публичные корутины репозитория замером времени
+        for name in dir(type(db)):
+            if name.startswith("_") or not inspect.iscoroutinefunction(getattr(type(db), name)):
+                continue
+            setattr(db, name, self._timed(getattr(db, name), (name,)))
+
+    def _timed(self, method, labels: Labels):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.db.observe(time.perf_counter() - start, labels)
+        return wrapper
+
+    def render(self) -> str:
+        lines = []
+        for metric in (*self.collected, self.room_sizes()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        stats = {metric.name: metric.snapshot() for metric in self.collected}
+        stats["onlinechat_room_members"] = self.room_sizes().snapshot().get("", {})
+        stats["token_cache"] = self.server.token_cache.stats()
+        if cache_stats := getattr(self.server.db, "cache_stats", None):
+            stats["db_cache"] = cache_stats()
+        return stats
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle_http, host, port)
+        self.log.info("Метрики Prometheus на http://%s:%s/metrics", host, port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _may_change(self, peer: str | None, headers: dict[str, str]) -> bool:
+        if self.token:
+            return hmac.compare_digest(headers.get("authorization", ""), f"Bearer {self.token}")
+        try:
+            return peer is not None and ipaddress.ip_address(peer).is_loopback
+        except ValueError:
+            return False
+
+    def _log_levels(self, method: str, query: str, allowed: bool) -> tuple[str, bytes]:
+        # GET /loglevel - текущие уровни; POST /loglevel?level=DEBUG[&logger=Server][&payload_every=N]
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+        if method == "POST":
+            if not allowed:
+                self.log.warning("Отклонена попытка изменить логирование: %s", params)
+                return "403 Forbidden", b"forbidden\n"
+            try:
+                if "level" in params:
+                    set_level(params["level"], params.get("logger"))
+                if "payload_every" in params:
+                    self.server.payload_sampler.every = int(params["payload_every"])
+            except ValueError as e:
+                return "400 Bad Request", f"{e}\n".encode()
+            self.log.warning("Логирование изменено: %s", params)
+        lines = [f"{name} {level}" for name, level in levels().items()]
+        lines.append(f"payload_every {self.server.payload_sampler.every}")
+        return "200 OK", ("\n".join(lines) + "\n").encode()
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Минимальный HTTP/1.0: GET /metrics, GET|POST /loglevel, остальное - 404
+        try:
+            request = await reader.readline()
+            headers = {}
+            while line := (await reader.readline()).strip():
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            parts = request.decode("latin-1").split()
+            method, path, query = "", "", ""
+            if len(parts) >= 2:
+                method = parts[0]
+                path, _, query = parts[1].partition("?")
+            if method == "GET" and path == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            elif method in ("GET", "POST") and path == "/loglevel":
+                peer = writer.get_extra_info("peername")
+                status, body = self._log_levels(method, query, self._may_change(peer and peer[0], headers))
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
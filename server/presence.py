@@ -0,0 +1,70 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+from protocol.messages import PresenceMessage, UserBrief
+from utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from server.server import Server
+
+
+class PresenceBatcher:
+    # Изменения присутствия копятся interval секунд и уходят всем одним
+    # PresenceMessage: волна входов стоит один кадр на соединение за тик,
+    # а не кадр на каждый вход. Повтор того же состояния схлопывается,
+    # online+offline за один тик взаимно гасятся. interval=0 - без накопления
+    def __init__(self, server: "Server", interval: float):
+        self.server = server
+        self.interval = interval
+        self.pending: dict[int, tuple[str, bool]] = {}
+        self.digests = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def online(self, user_id: int, username: str):
+        await self._change(user_id, username, True)
+
+    async def offline(self, user_id: int, username: str):
+        await self._change(user_id, username, False)
+
+    async def _change(self, user_id: int, username: str, online: bool):
+        previous = self.pending.pop(user_id, None)
+        if previous is None or previous[1] == online:
+            self.pending[user_id] = (username, online)
+        if self._task is None:
+            await self.flush()
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                self.log.error(e, exc_info=True)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        changes, self.pending = self.pending, {}
+        digest = PresenceMessage(
+            online=[UserBrief(id=uid, username=name) for uid, (name, online) in changes.items() if online],
+            offline=[UserBrief(id=uid, username=name) for uid, (name, online) in changes.items() if not online],
+        )
+        self.digests += 1
+        self.log.debug("Дайджест присутствия: +%s -%s", len(digest.online), len(digest.offline))
+        await self.server.broadcast_presence(digest)
@@ -0,0 +1,91 @@
+import asyncio
+import itertools
+import time
+from typing import Iterable
+
+from protocol.messages import HeartbeatMessage
+from server.connection import Connection
+from server.session import Session
+from utils.logger import get_logger
+
+
+class ConnectionRegistry:
+    # Живые соединения: кто онлайн (users), кто из онлайна в какой комнате
+    # (live_rooms), а также heartbeat и вытеснение неактивных соединений
+
+    def __init__(self, heartbeat_interval: float, heartbeat_misses: int, idle_timeout: float):
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_misses = heartbeat_misses
+        self.idle_timeout = idle_timeout
+        self.connections: set[Connection] = set()
+        self.users: dict[int, Connection] = {}
+        self.live_rooms: dict[int, set[int]] = {}
+        self._nonce = itertools.count(1)
+        self._reaper_task: asyncio.Task | None = None
+        self.log = get_logger(self.__class__.__name__, to_file=True)
+
+    def add(self, conn: Connection):
+        self.connections.add(conn)
+
+    def bind(self, conn: Connection, rooms: Iterable[int]):
+        user_id = conn.session.user_id
+        previous = self.users.get(user_id)
+        self.users[user_id] = conn
+        if previous is None:
+            for room_id in rooms:
+                self.live_rooms.setdefault(room_id, set()).add(user_id)
+
+    def join_room(self, room_id: int, user_id: int):
+        if user_id in self.users:
+            self.live_rooms.setdefault(room_id, set()).add(user_id)
+
+    def unbind(self, conn: Connection, rooms: Iterable[int]) -> Session | None:
+        # Возвращает сессию, если с этим соединением пользователь ушёл офлайн
+        session = conn.session
+        if session is None or self.users.get(session.user_id) is not conn:
+            return None
+        del self.users[session.user_id]
+        for room_id in rooms:
+            live = self.live_rooms.get(room_id)
+            if live is not None:
+                live.discard(session.user_id)
+                if not live:
+                    del self.live_rooms[room_id]
+        return session
+
+    def remove(self, conn: Connection, rooms: Iterable[int]) -> Session | None:
+        self.connections.discard(conn)
+        return self.unbind(conn, rooms)
+
+    def start(self):
+        if self.heartbeat_interval > 0 or self.idle_timeout > 0:
+            self._reaper_task = asyncio.create_task(self._reaper())
+
+    def stop(self):
+        if self._reaper_task:
+            self._reaper_task.cancel()
+
+    async def _reaper(self):
+        tick = self.heartbeat_interval if self.heartbeat_interval > 0 else max(self.idle_timeout / 4, 1.0)
+        while True:
+            await asyncio.sleep(tick)
+            self.check(time.monotonic())
+
+    def check(self, now: float):
+        ping = None
+        for conn in list(self.connections):
+            if self.idle_timeout > 0 and now - conn.last_active > self.idle_timeout:
+                self.log.info("Соединение %s неактивно %s с, отключаем", conn.addr, self.idle_timeout)
+                conn.close()
+                continue
+            # heartbeat понимают только клиенты протокола v2
+            if self.heartbeat_interval <= 0 or conn.framing.version < 2:
+                continue
+            silence = now - conn.last_seen
+            if silence > self.heartbeat_interval * self.heartbeat_misses:
+                self.log.info("Соединение %s не отвечает %.1f с, отключаем", conn.addr, silence)
+                conn.close()
+            elif silence >= self.heartbeat_interval:
+                if ping is None:
+                    ping = HeartbeatMessage(nonce=next(self._nonce)).to_frame()
+                conn.offer(ping)
@@ -1,87 +1,478 @@
 import asyncio
-import json
+import contextlib
+import signal
+import time
 from argparse import Action
-from typing import Protocol
+from typing import Protocol, Iterable
 
 from action.auth_token import decode_token
-from action.schemas_message import END_MARKER, BaseMessage
+from protocol.framing import PRESENCE_DIGEST, server_handshake
+from protocol.messages import BaseMessage, Frame, message_adapter
 from config import Config
 from db_model.db_repo import DbRepo
+from db_model.cached_repo import CachedDbRepo
+from db_model.message_writer import MessageWriter
 from action.schemas import (
-    adapter
+    adapter, Command
 )
-from utils.logger import get_logger
+from protocol.messages import PresenceMessage
+from server.bus import LocalBus
+from server.cluster import Cluster, parse_nodes
+from server.connection import Connection, SlowConsumerPolicy
+from server.credentials import CredentialPool
+from server.directory import Directory
+from server.metrics import Metrics
+from server.presence import PresenceBatcher
+from server.registry import ConnectionRegistry
+from server.session import Session, TokenCache
+from utils.logger import PayloadSampler, get_logger, log_context
 
 class Action(Protocol):
 
-    async def run(self, server: 'Server', reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+    async def run(self, server: 'Server', conn: 'Connection'):
         pass
 
     async def send_action(self, writer: 'asyncio.StreamWriter'):
         pass
 
+# Действия, которые в кластере выполняет узел-владелец комнаты action.room
+ROUTED_COMMANDS = {Command.SEND, Command.JOIN_CHAT}
+
+
 class Server:
 
-    def __init__(self, db: 'DbRepo'):
+    def __init__(self,
+                 db: 'DbRepo',
+                 queue_size: int = Config.OUTBOUND_QUEUE_SIZE,
+                 slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy(Config.SLOW_CONSUMER_POLICY),
+                 slow_consumer_timeout: float = Config.SLOW_CONSUMER_TIMEOUT,
+                 max_frame_size: int = Config.MAX_FRAME_SIZE,
+                 codecs: list[str] = Config.WIRE_CODECS,
+                 handshake_timeout: float = Config.HANDSHAKE_TIMEOUT,
+                 token_cache_size: int = Config.TOKEN_CACHE_SIZE,
+                 token_cache_ttl: float = Config.TOKEN_CACHE_TTL,
+                 history_page_size: int = Config.HISTORY_PAGE_SIZE,
+                 history_max_page: int = Config.HISTORY_MAX_PAGE,
+                 persist_batch_size: int = Config.PERSIST_BATCH_SIZE,
+                 persist_flush_interval: float = Config.PERSIST_FLUSH_INTERVAL,
+                 persist_max_pending: int = Config.PERSIST_MAX_PENDING,
+                 heartbeat_interval: float = Config.HEARTBEAT_INTERVAL,
+                 heartbeat_misses: int = Config.HEARTBEAT_MISSES,
+                 idle_timeout: float = Config.IDLE_TIMEOUT,
+                 host: str = Config.SERVER_HOST,
+                 port: int = Config.SERVER_PORT,
+                 worker_id: int = 0,
+                 workers: int = 1,
+                 bus_dir: str = Config.BUS_DIR,
+                 node: str | None = Config.CLUSTER_NODE,
+                 cluster_nodes: str = Config.CLUSTER_NODES,
+                 cluster_retry_interval: float = Config.CLUSTER_RETRY_INTERVAL,
+                 metrics_host: str = Config.METRICS_HOST,
+                 metrics_port: int = Config.METRICS_PORT,
+                 metrics_token: str = Config.METRICS_TOKEN,
+                 admin_users: list[str] = Config.ADMIN_USERS,
+                 log_payload_every: int = Config.LOG_PAYLOAD_EVERY,
+                 auth_workers: int = Config.AUTH_WORKERS,
+                 auth_max_pending: int = Config.AUTH_MAX_PENDING,
+                 presence_interval: float = Config.PRESENCE_INTERVAL,
+                 directory_log_size: int = Config.DIRECTORY_LOG_SIZE):
+        # chats - все участники комнат (как в БД), user_rooms - обратный индекс;
+        # онлайн-часть (users, live_rooms) ведёт реестр соединений
         self.chats: dict[int, set[int]] = {}
-        self.users: dict[int, asyncio.StreamWriter] = {}
+        self.user_rooms: dict[int, set[int]] = {}
+        self.registry = ConnectionRegistry(heartbeat_interval, heartbeat_misses, idle_timeout)
+        self.users: dict[int, Connection] = self.registry.users
         self.db = db
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.slow_consumer_timeout = slow_consumer_timeout
+        self.max_frame_size = max_frame_size
+        self.codecs = codecs
+        self.handshake_timeout = handshake_timeout
+        self.token_cache = TokenCache(token_cache_size, token_cache_ttl)
+        self.credentials = CredentialPool(auth_workers, auth_max_pending)
+        self.history_page_size = history_page_size
+        self.history_max_page = history_max_page
+        self.message_writer = MessageWriter(
+            db,
+            batch_size=persist_batch_size,
+            flush_interval=persist_flush_interval,
+            max_pending=persist_max_pending,
+        )
+        self.host = host
+        self.port = port
+        # Несколько воркеров слушают один порт (SO_REUSEPORT) и пересылают
+        # друг другу рассылки по шине, либо узлы кластера делят комнаты между собой;
+        # remote_online - кто онлайн на других воркерах/узлах: user_id -> узел
+        self.worker_id = worker_id
+        self.node = node or str(worker_id)
+        self.bus: LocalBus | None = None
+        self.cluster: Cluster | None = None
+        if node and workers > 1:
+            raise Exception("Узел кластера запускается одним процессом")
+        if workers > 1:
+            self.bus = LocalBus(worker_id, workers, bus_dir, f"onlinechat-{port}", self.on_bus_event)
+        if node:
+            self.cluster = Cluster(self, node, parse_nodes(cluster_nodes), cluster_retry_interval)
+        self.remote_online: dict[int, str] = {}
+        self.presence = PresenceBatcher(self, presence_interval)
+        # Справочник пользователей с журналом версий для InitMessage-дельт
+        self.directory = Directory(directory_log_size)
+        # Метрики: Prometheus на отдельном порту (0 - выключен) и StatsAction для admin_users
+        self.metrics = Metrics(self, metrics_token)
+        self.metrics.instrument_repo(db)
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.admin_users = set(admin_users)
+        self.payload_sampler = PayloadSampler(log_payload_every)
         self.log = get_logger(self.__class__.__name__, to_file=True)
         self.log.info("Создание экзкмепляра Сервера")
 
     async def start(self):
-        server = await asyncio.start_server(self.handle_client, '0.0.0.0', 8888)
+        # limit нужен клиентам с END_MARKER: readuntil не должен упираться в 64 КиБ
+        server = await asyncio.start_server(
+            self.handle_client,
+            self.host,
+            self.port,
+            limit=self.max_frame_size,
+            reuse_port=self.bus is not None,
+        )
         addr = server.sockets[0].getsockname()
-        self.log.info(f"Сервер запущен на {addr}")
-        chats = await self.db.get_rooms()
-        for chat in chats:
-            self.chats[chat.id] = set()
+        self.log.info("Сервер (узел %s) запущен на %s", self.node, addr)
+        try:
+            await self.db.ensure_indexes()
+        except Exception as e:
+            # например, нет прав на DDL: сервер работает, но история без индекса медленнее
+            self.log.warning("Не удалось создать индексы: %s", e)
+        await self.load_memberships()
+        await self.directory.load(self.db)
+
+        if self.bus:
+            await self.bus.start()
+        if self.cluster:
+            await self.cluster.start()
+        if self.metrics_port:
+            # у каждого воркера свой порт метрик: METRICS_PORT + номер воркера
+            try:
+                await self.metrics.start(self.metrics_host, self.metrics_port + self.worker_id)
+            except OSError as e:
+                self.log.warning("Порт метрик недоступен, метрики только через STATS: %s", e)
+        self.message_writer.start()
+        self.registry.start()
+        self.presence.start()
+        try:
+            await server.serve_forever()
+        finally:
+            self.registry.stop()
+            await self.presence.stop()
+            # закрываем клиентские соединения, чтобы их обработчики завершились штатно
+            for conn in list(self.registry.connections):
+                conn.close()
+            await self.metrics.stop()
+            self.credentials.stop()
+            if self.bus:
+                await self.bus.stop()
+            if self.cluster:
+                await self.cluster.leave()
+            # при остановке дописываем в БД всё, что ещё в очереди
+            await self.message_writer.close()
+            if self.cluster:
+                await self.cluster.stop()
+
+    async def load_memberships(self):
+        # Полная карта комнат и участников одним потоковым запросом при старте.
+        # В кластере состав комнаты (chats) держит только её владелец,
+        # а обратный индекс user_rooms нужен на любом узле, куда придёт пользователь
+        start = time.perf_counter()
+        memberships = 0
+        async for rows in self.db.stream_memberships():
+            for room_id, user_id in rows:
+                members = self.chats.get(room_id)
+                if members is None and (self.cluster is None or self.cluster.is_home(room_id)):
+                    members = self.chats[room_id] = set()
+                if user_id is not None:
+                    if members is not None:
+                        members.add(user_id)
+                    self.user_rooms.setdefault(user_id, set()).add(room_id)
+                    memberships += 1
+        self.log.info(
+            "Загружено %s комнат и %s участий за %.2f с",
+            len(self.chats), memberships, time.perf_counter() - start,
+        )
 
-        await server.serve_forever()
+    async def reload_memberships(self):
+        # В кластере после смены кольца: составы комнат, доставшихся узлу, и
+        # участия, добавленные, пока узел был отрезан от соседей (события members
+        # получают только живые узлы), - заново из БД. Пока идёт чтение, участники
+        # могут добавляться и через _index_room, поэтому объединяем, а не заменяем
+        chats: dict[int, set[int]] = {}
+        joined: list[tuple[int, int]] = []
+        async for rows in self.db.stream_memberships():
+            for room_id, user_id in rows:
+                members = chats.setdefault(room_id, set())
+                if user_id is not None:
+                    members.add(user_id)
+                    if room_id not in self.user_rooms.get(user_id, ()):
+                        joined.append((room_id, user_id))
+        for room_id, user_id in joined:
+            self.user_rooms.setdefault(user_id, set()).add(room_id)
+            self.registry.join_room(room_id, user_id)
+        self.chats = {
+            room_id: members | self.chats.get(room_id, set())
+            for room_id, members in chats.items() if self.cluster.owns(room_id)
+        }
+        self.sync_rooms({room_id for room_id, _ in joined})
+        self.log.info("Составы комнат перезагружены: %s комнат узла, новых участий %s", len(self.chats), len(joined))
+
+    async def add_member(self, room_id: int, user_id: int):
+        # Держим Server.chats и таблицу memberships в согласии
+        if user_id not in self.chats.get(room_id, ()):
+            await self.db.add_membership(user_id, room_id)
+            self.add_room(room_id, [user_id])
+
+    def add_room(self, room_id: int, user_ids: Iterable[int]):
+        # Участники уже записаны в БД; обновляем индексы в памяти
+        user_ids = list(user_ids)
+        self._index_room(room_id, user_ids)
+        self.publish({"kind": "members", "room_id": room_id, "user_ids": user_ids})
+
+    def _index_room(self, room_id: int, user_ids: list[int]):
+        members = None
+        if self.cluster is None or self.cluster.owns(room_id):
+            members = self.chats.setdefault(room_id, set())
+        for user_id in user_ids:
+            if members is not None:
+                members.add(user_id)
+            self.user_rooms.setdefault(user_id, set()).add(room_id)
+            self.registry.join_room(room_id, user_id)
+        self.directory.room_changed(room_id)
+        if self.cluster:
+            self.cluster.note_members(room_id, user_ids)
+            self.cluster.sync_rooms([room_id])
 
     async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         addr = writer.get_extra_info('peername')
-        self.log.info(f"Подключение от {addr}")
+        # у каждого клиента своя задача asyncio - и свой контекст логирования
+        log_context(conn="%s:%s" % addr[:2] if addr else None)
+        self.log.info("Подключение от %s", addr)
+        conn: Connection | None = None
         try:
+            # до приветствия соединения нет в реестре, и heartbeat его не снимет
+            framing, codec = await server_handshake(
+                reader, writer, self.max_frame_size, self.codecs, self.handshake_timeout or None,
+            )
+            self.log.info("Клиент %s использует протокол v%s, кодек %s", addr, framing.version, codec.name)
+            conn = Connection(
+                reader,
+                writer,
+                framing=framing,
+                codec=codec,
+                queue_size=self.queue_size,
+                policy=self.slow_consumer_policy,
+                block_timeout=self.slow_consumer_timeout,
+                metrics=self.metrics,
+            )
+            conn.start()
+            self.registry.add(conn)
             while True:
-                data = await reader.readuntil(END_MARKER)
-                self.log.info(f"Получено сообщение от {addr}")
-                self.log.info(f"Данные: {data}")
+                data = await conn.read()
+                self.metrics.frames_in.inc()
+                self.metrics.bytes_in.inc(len(data))
+                # на каждый кадр - только DEBUG; содержимое - выборочно (LOG_PAYLOAD_EVERY)
+                self.log.debug("Получено сообщение от %s, %s байт", addr, len(data))
+                if self.payload_sampler():
+                    self.log.info("Данные от %s: %r", addr, data)
                 if data:
-                    data = data.removesuffix(END_MARKER)
-                    action: Action = adapter.validate_python(json.loads(data))
+                    action: Action = adapter.validate_python(conn.codec.loads(data))
+                    if action.command != Command.HEARTBEAT:
+                        conn.touch()
                     if token := getattr(action, 'token', None):
-                        self.log.info(f"Есть токен: {token}")
-                        payload = decode_token(token)
-                        user_id, username = payload['id'], payload['username']
-                        if user_id not in self.users:
-                            user = await self.db.get_user_by_id(user_id)
-                            if not user:
-                                raise Exception("Невалидынй токен")
-                            self.users[user_id] = writer
-                    self.log.info(f"Сообщение прошло валидицию: {action}")
-                    await action.run(self, reader, writer)
+                        await self.authenticate(conn, token)
+                    self.log.debug("Сообщение прошло валидацию: %s", action.command)
+                    await self.dispatch(action, conn)
                 elif not data:
                     break
-            self.log.info(f'Пользователь {addr} отключился')
+            self.log.info("Пользователь %s отключился", addr)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.log.info("Пользователь %s отключился", addr)
+        except asyncio.TimeoutError:
+            self.log.info("Нет приветствия v2 от %s за %s с, отключаем", addr, self.handshake_timeout)
         except Exception as e:
             self.log.error(e, exc_info=True)
         finally:
-            self.log.info(f"Удаляем пользователя {addr}")
-
-    async def all_broadcast(self, message: BaseMessage):
-        self.log.info(f"Оповещаем всех {message}")
-        for user_id in self.users:
-            writer = self.users[user_id]
-            await message.send_message(writer)
-
-    async def send_in_chats(self, message: BaseMessage, room_id: int):
-        self.log.info(f"Оповещаем в комнате {room_id} {message}")
-        for user_id in self.chats[room_id]:
-            if writer := self.users.get(user_id):
-                await message.send_message(writer)
-
-async def main():
-    db_repo = DbRepo(db_url=Config.SQLALCHEMY_DATABASE_URI)
-    my_server = Server(db_repo)
+            self.log.debug("Удаляем пользователя %s", addr)
+            if conn:
+                await self.disconnect(conn)
+            else:
+                writer.close()
+
+    async def dispatch(self, action: Action, conn: Connection):
+        # В кластере действие над чужой комнатой выполняет её владелец
+        if self.cluster and conn.session and action.command in ROUTED_COMMANDS and not self.cluster.owns(action.room):
+            self.cluster.forward_action(action, conn.session)
+            return
+        await self.run_action(action, conn)
+
+    async def run_action(self, action: Action, conn: Connection):
+        labels = (action.command.value,)
+        log_context(
+            user=conn.session.user_id if conn.session else None,
+            command=action.command.value,
+            room=getattr(action, "room", None),
+        )
+        start = time.perf_counter()
+        try:
+            await action.run(self, conn)
+        except Exception:
+            self.metrics.action_errors.inc(labels=labels)
+            raise
+        finally:
+            self.metrics.actions.observe(time.perf_counter() - start, labels)
+
+    async def disconnect(self, conn: Connection):
+        conn.close()
+        session = conn.session
+        rooms = self.user_rooms.get(session.user_id, ()) if session else ()
+        if self.registry.remove(conn, rooms):
+            self.publish_presence(session.user_id, online=False)
+            self.sync_rooms(rooms)
+            await self.presence.offline(session.user_id, session.username)
+
+    async def authenticate(self, conn: Connection, token: str) -> Session:
+        # Токен проверяется один раз на соединение; дальше личность берётся из сессии
+        if conn.session and conn.session.token == token:
+            return conn.session
+        payload = self.token_cache.get(token)
+        if payload is None:
+            payload = decode_token(token)
+            user = await self.db.get_user_by_id(payload['id'])
+            if not user or user.username != payload['username']:
+                raise Exception("Невалидынй токен")
+            self.token_cache.put(token, payload)
+        self.log.info("Соединение %s авторизовано как %s", conn.addr, payload["username"])
+        return self.bind_session(conn, payload['id'], payload['username'], token)
+
+    def bind_session(self, conn: Connection, user_id: int, username: str, token: str | None = None) -> Session:
+        if conn.session and conn.session.user_id != user_id:
+            rooms = self.user_rooms.get(conn.session.user_id, ())
+            if self.registry.unbind(conn, rooms):
+                self.publish_presence(conn.session.user_id, online=False)
+                self.sync_rooms(rooms)
+        conn.session = Session(user_id, username, token)
+        if user_id not in self.users:
+            self.publish_presence(user_id, online=True)
+        self.registry.bind(conn, self.user_rooms.get(user_id, ()))
+        self.sync_rooms(self.user_rooms.get(user_id, ()))
+        return conn.session
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.users or user_id in self.remote_online
+
+    def online_ids(self) -> set[int]:
+        return self.users.keys() | self.remote_online.keys()
+
+    def publish(self, event: dict):
+        # Событие остальным процессам: воркерам по шине или всем узлам кластера
+        event["node"] = self.node
+        if self.bus:
+            self.bus.publish(event)
+        if self.cluster:
+            self.cluster.broadcast(event)
+
+    def publish_presence(self, user_id: int, online: bool):
+        self.publish({"kind": "online" if online else "offline", "user_id": user_id})
+
+    def sync_rooms(self, rooms: Iterable[int]):
+        # Узел подписан у владельцев тех комнат, где у него есть онлайн-участники
+        if self.cluster:
+            self.cluster.sync_rooms(rooms)
+
+    async def fan_out(self, frame: Frame, conns: Iterable[Connection]):
+        # Кадр только ставится в очереди получателей; ждём лишь тех,
+        # у кого очередь заполнена при политике block, и ждём их параллельно
+        blocked = [conn.send(frame) for conn in conns if not conn.offer(frame)]
+        if blocked:
+            await asyncio.gather(*blocked)
+
+    async def all_broadcast(self, message: BaseMessage | Frame):
+        frame = message if isinstance(message, Frame) else message.to_frame()
+        self.log.debug("Оповещаем всех %s", frame)
+        self.publish({"kind": "all", "message": frame.data()})
+        await self.deliver_all(frame)
+
+    async def send_in_chats(self, message: BaseMessage | Frame, room_id: int):
+        frame = message if isinstance(message, Frame) else message.to_frame()
+        self.log.debug("Оповещаем в комнате %s %s", room_id, frame)
+        if self.cluster:
+            # рассылает владелец комнаты - по узлам, где есть её онлайн-участники
+            await self.cluster.send_room(frame, room_id)
+            return
+        if self.bus:
+            self.bus.publish({"kind": "room", "room_id": room_id, "message": frame.data()})
+        await self.deliver_room(frame, room_id)
+
+    async def deliver_all(self, frame: Frame):
+        await self.fan_out(frame, list(self.users.values()))
+
+    async def broadcast_presence(self, digest: PresenceMessage):
+        frame = digest.to_frame()
+        self.publish({"kind": "presence", "message": frame.data()})
+        await self.deliver_presence(frame)
+
+    async def deliver_presence(self, frame: Frame):
+        # Клиенты с presence_digest получают один кадр на тик,
+        # остальные - по UpdateMessage на каждое изменение.
+        # Заодно пишем изменения в журнал справочника; новых пользователей
+        # с других воркеров/узлов справочник узнаёт отсюда же
+        for user in frame.message.online:
+            self.directory.add_user(user.id, user.username)
+            self.directory.presence_changed(user.id)
+        for user in frame.message.offline:
+            self.directory.presence_changed(user.id)
+        conns = list(self.users.values())
+        legacy = [conn for conn in conns if PRESENCE_DIGEST not in conn.framing.features]
+        if len(legacy) < len(conns):
+            await self.fan_out(frame, [conn for conn in conns if PRESENCE_DIGEST in conn.framing.features])
+        if legacy:
+            for update in frame.message.expand():
+                await self.fan_out(update.to_frame(), legacy)
+
+    async def deliver_room(self, frame: Frame, room_id: int):
+        # только участники, которые сейчас онлайн на этом воркере/узле
+        conns = [conn for user_id in self.registry.live_rooms.get(room_id, ()) if (conn := self.users.get(user_id))]
+        await self.fan_out(frame, conns)
+
+    async def on_bus_event(self, event: dict):
+        # События от других воркеров или узлов: доставляем только своим
+        # соединениям и дальше не пересылаем
+        match event["kind"]:
+            case "room":
+                frame = Frame(message_adapter.validate_python(event["message"]))
+                await self.deliver_room(frame, event["room_id"])
+            case "all":
+                await self.deliver_all(Frame(message_adapter.validate_python(event["message"])))
+            case "presence":
+                await self.deliver_presence(Frame(message_adapter.validate_python(event["message"])))
+            case "members":
+                self._index_room(event["room_id"], event["user_ids"])
+            case "online":
+                self.remote_online[event["user_id"]] = event["node"]
+            case "offline":
+                if self.remote_online.get(event["user_id"]) == event["node"]:
+                    del self.remote_online[event["user_id"]]
+
+async def main(host: str = Config.SERVER_HOST,
+               port: int = Config.SERVER_PORT,
+               worker_id: int = 0,
+               workers: int = 1,
+               node: str | None = Config.CLUSTER_NODE):
+    if Config.DB_CACHE_SIZE > 0:
+        db_repo = CachedDbRepo(Config.SQLALCHEMY_DATABASE_URI, Config.DB_CACHE_SIZE, Config.DB_CACHE_TTL)
+    else:
+        db_repo = DbRepo(db_url=Config.SQLALCHEMY_DATABASE_URI)
+    my_server = Server(db_repo, host=host, port=port, worker_id=worker_id, workers=workers, node=node)
+    # SIGTERM останавливает приём соединений, а finally в start() успевает
+    # дописать очередь сообщений в БД (на Windows обработчик не ставится)
+    with contextlib.suppress(NotImplementedError):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
     await my_server.start()
@@ -0,0 +1,24 @@
+import time
+
+from utils.cache import TTLCache
+
+
+class Session:
+    __slots__ = ("user_id", "username", "token")
+
+    def __init__(self, user_id: int, username: str, token: str | None = None):
+        self.user_id = user_id
+        self.username = username
+        self.token = token
+
+    def __repr__(self):
+        return f"<Session {self.user_id}:{self.username}>"
+
+
+class TokenCache(TTLCache):
+    # LRU проверенных токенов: токен -> payload.
+    # Запись живёт не дольше ttl и не дольше exp из самого токена
+    def put(self, token: str, payload: dict, ttl: float | None = None):
+        if exp := payload.get("exp"):
+            ttl = exp - time.time()
+        super().put(token, payload, ttl)
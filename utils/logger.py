@@ -1,23 +1,197 @@
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+
+from config import Config
+
+FMT = (
+    "%(name)-15s | %(asctime)s | "
+    "%(module)-15s | line:%(lineno)4d | %(levelname)-8s | "
+    "%(message)s"
+)
+LOG_FILE = "online_chat.log"
+# Поля контекста записи: соединение, пользователь, комната, команда
+FIELDS = ("conn", "user", "room", "command")
+
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
+
+def log_context(**fields):
+    # Поля для всех записей текущей задачи asyncio и задач, созданных из неё;
+    # None убирает поле. Отдельное значение можно передать и в вызове: extra={"room": 5}
+    context = {**_context.get(), **fields}
+    _context.set({name: value for name, value in context.items() if value is not None})
+
+
+class _ContextFilter(logging.Filter):
+    # Переносит поля контекста в запись; поля из extra= важнее
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    # Строка FMT с полями контекста "key=value" в конце или (json_lines=True)
+    # один JSON-объект на запись - для сборщиков логов
+    def __init__(self, json_lines: bool = False):
+        super().__init__(fmt=FMT, datefmt="%Y-%m-%d %H:%M:%S")
+        self.json_lines = json_lines
+
+    @staticmethod
+    def fields(record: logging.LogRecord) -> dict:
+        return {name: value for name in FIELDS if (value := getattr(record, name, None)) is not None}
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        if fields := self.fields(record):
+            line += " | " + " ".join(f"{name}={value}" for name, value in fields.items())
+        return line
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not self.json_lines:
+            return super().format(record)
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+            **self.fields(record),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Сообщение собирается здесь же, как в стандартном QueueHandler: изменяемые
+    # args, отформатированные позже в другом потоке, показали бы уже новое
+    # состояние. Раскладка строки и запись в файл - в потоке QueueListener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_exc_formatter = logging.Formatter()
+
+
+class _MarkToFile(logging.Filter):
+    # Логгеры с to_file=True помечают свои записи для файлового обработчика
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.to_file = True
+        return True
+
+
+class _OnlyToFile(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        return getattr(record, "to_file", False)
+
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_handler = _QueueHandler(_queue)
+_handler.addFilter(_ContextFilter())
+_listener: logging.handlers.QueueListener | None = None
+_loggers: set[str] = set()
+
+
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
+    formatter = StructuredFormatter(json_lines=Config.LOG_FORMAT == "json")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    file_handler = logging.FileHandler(filename=LOG_FILE, mode="a", delay=True)
+    file_handler.setFormatter(formatter)
+    file_handler.addFilter(_OnlyToFile())
+    _listener = logging.handlers.QueueListener(_queue, stream_handler, file_handler)
+    _listener.start()
+
+
+def _stop_listener():
+    # при выходе дописываем всё, что осталось в очереди
+    if _listener is not None:
+        _listener.stop()
+
+
+def _after_fork():
+    # Потока QueueListener в дочернем процессе (воркеры main_server) нет:
+    # без своего слушателя записи копились бы в очереди навсегда. Очередь
+    # тоже новая - её блокировка могла быть занята родителем в момент fork
+    global _queue, _listener
+    _queue = queue.SimpleQueue()
+    _handler.queue = _queue
+    if _listener is not None:
+        _listener = None
+        _start_listener()
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _parse_levels(spec: str) -> dict[str, str]:
+    # "Server=DEBUG,Cluster=WARNING" -> {"Server": "DEBUG", "Cluster": "WARNING"}
+    return dict(item.split("=", 1) for item in spec.split(",") if "=" in item)
+
+
+_levels = _parse_levels(Config.LOG_LEVELS)
 
 
 def get_logger(name: str = "OnlineChat", to_file: bool = False) -> logging.Logger:
     logger = logging.getLogger(name)
-    fmt = (
-        "%(name)-15s | %(asctime)s | "
-        "%(module)-15s | line:%(lineno)4d | %(levelname)-8s | "
-        "%(message)s"
-    )
     if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(fmt=fmt, datefmt="%Y-%m-%d %H:%M:%S")
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-
+        logger.setLevel(_levels.get(name, Config.LOG_LEVEL))
+        logger.addHandler(_handler)
         if to_file:
-            file_handler = logging.FileHandler(filename="online_chat.log", mode="a")
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            logger.addFilter(_MarkToFile())
+        _loggers.add(name)
+        _start_listener()
+
+    return logger
+
+
+def set_level(level: str, name: str | None = None) -> dict[str, str]:
+    # Уровень меняется на лету: для одного логгера или для всех (и будущих) сразу
+    level = level.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Неизвестный уровень логирования: {level}")
+    if name is None:
+        Config.LOG_LEVEL = level
+        _levels.clear()
+        names = _loggers
+    else:
+        _levels[name] = level
+        names = [name] if name in _loggers else []
+    for logger_name in names:
+        logging.getLogger(logger_name).setLevel(level)
+    return levels()
+
+
+def levels() -> dict[str, str]:
+    return {name: logging.getLevelName(logging.getLogger(name).level) for name in sorted(_loggers)}
+
+
+class PayloadSampler:
+    # Разрешает логировать полезную нагрузку раз в every кадров; every=0 - никогда
+    def __init__(self, every: int):
+        self.every = every
+        self._count = 0
 
-    return logger
\ No newline at end of file
+    def __call__(self) -> bool:
+        if not self.every:
+            return False
+        self._count += 1
+        return self._count % self.every == 0